@@ -117,6 +117,8 @@ class ApplicationInfo(BaseModel):
     langfuse_public_key: Optional[str]
     langfuse_secret_key: Optional[str]
     active_version: Optional[str]
+    retention_days: Optional[int]
+    persistence_policy: Optional[str]
     created_at: int
     updated_at: int
 
@@ -135,6 +137,7 @@ class ApplicationVersionInfo(BaseModel):
     updated_at: int
     metadata: Optional[dict]
     configuration: Optional[dict]
+    persistence_policy: Optional[str]
 
 
 class GraphNode(BaseModel):
@@ -174,21 +177,27 @@ class GraphConfiguration(BaseModel):
 
 class AppMetadata(APIModel):
     """
-    The request model for updating app data.
+    The request model for updating app data. The retention and the persistence
+    policy are kept as they are if retention_days and persistence_policy are not
+    given.
     """
 
     name: str
     langfuse_public_key: Optional[str]
     langfuse_secret_key: Optional[str]
+    retention_days: Optional[int]
+    persistence_policy: Optional[str]
 
 
 class VersionMetadata(APIModel):
     """
-    The request model for updating app version data.
+    The request model for updating app version data. The persistence policy is kept
+    as it is if persistence_policy is not given.
     """
 
     name: str
     metadata: Optional[dict]
+    persistence_policy: Optional[str]
 
 
 class InteractionInfo(BaseModel):
@@ -203,6 +212,7 @@ class InteractionInfo(BaseModel):
     updated_at: int
     output: Optional[str]
     data: Optional[Dict[str, Any]]
+    status: Optional[str]
 
 
 class InteractionInfoResponse(APIModel):
@@ -213,12 +223,50 @@ class InteractionInfoResponse(APIModel):
     interaction: Optional[InteractionInfo]
 
 
+class InteractionListResponse(APIModel):
+    """
+    The response model for /applications/{application_id}/interactions, the data of
+    the interactions is not included. The next page is retrieved with next_cursor,
+    which is None on the last page.
+    """
+
+    interactions: List[InteractionInfo]
+    next_cursor: Optional[str]
+
+
+class InteractionNodeInfo(BaseModel):
+    """
+    InteractionNodeInfo models the output of a node in an interaction. The timestamps
+    are in seconds with fractions, and missing for the interactions recorded before
+    the nodes are stored separately.
+
+    If blob_size is set, the output is too large and the value is only a preview of
+    it, the full output is retrieved by /interactions/{interaction_id}/nodes/{node_id}/value.
+    """
+
+    node_id: str
+    value: Any
+    status: Optional[str]
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    blob_size: Optional[int]
+
+
+class InteractionNodesResponse(APIModel):
+    """
+    The response model for /interactions/{interaction_id}/nodes.
+    """
+
+    nodes: List[InteractionNodeInfo]
+
+
 class ApplicationListResponse(APIModel):
     """
     The response model for /applications, which returns a list of app info.
     """
 
     applications: List[ApplicationInfo]
+    next_cursor: Optional[str]
 
 
 class ApplicationInfoResponse(APIModel):
@@ -247,6 +295,8 @@ class ApplicationCreate(APIModel):
     name: str
     langfuse_public_key: Optional[str]
     langfuse_secret_key: Optional[str]
+    retention_days: Optional[int]
+    persistence_policy: Optional[str]
 
 
 class InteractionScore(APIModel):
@@ -301,6 +351,7 @@ class VersionListResponse(APIModel):
     """
 
     versions: List[ApplicationVersionInfo]
+    next_cursor: Optional[str]
 
 
 class VersionCreateResponse(APIModel):
@@ -316,6 +367,7 @@ class ApplicationVersionCreate(APIModel):
     parent_id: Optional[str]
     metadata: Optional[dict]
     configuration: GraphConfiguration
+    persistence_policy: Optional[str]
 
 
 class ApplicationRun(APIModel):
@@ -325,12 +377,31 @@ class ApplicationRun(APIModel):
     session_id: Optional[str]
 
 
+class ApplicationBatchRun(APIModel):
+    """The request model for running an app over a batch of inputs."""
+
+    inputs: List[Union[str, List[str], Dict[str, str]]]
+    session_id: Optional[str]
+
+
 class ApplicationRunResponse(APIModel):
     """The response model for trigger an app."""
 
     id: InteractionID
 
 
+class ApplicationRunOutputResponse(APIModel):
+    """
+    The response model for running an app synchronously. If the run doesn't finish
+    in time, the status is running and the output is None, the interaction can be
+    polled by its id later.
+    """
+
+    id: InteractionID
+    status: str
+    output: Optional[str]
+
+
 class User(APIModel):
     """The user identity"""
 
@@ -1,20 +1,28 @@
+import asyncio
+import concurrent.futures
 import inspect
 import json
+import logging
+import time
 import uuid
+from collections import deque
 from datetime import datetime
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from environs import Env
-from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi import Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi_utils.cbv import cbv
 from fastapi_utils.inferring_router import InferringRouter
 from langfuse import Langfuse
-from sqlalchemy import create_engine
+from pydantic import ValidationError
 
 import patterns
 import plugins
 from api.api_schemas import (
+    ApplicationBatchRun,
     ApplicationBlocksResponse,
     ApplicationCreate,
     ApplicationCreateResponse,
@@ -23,6 +31,7 @@ from api.api_schemas import (
     ApplicationListResponse,
     ApplicationPatternsResponse,
     ApplicationRun,
+    ApplicationRunOutputResponse,
     ApplicationRunResponse,
     ApplicationVersionCreate,
     ApplicationVersionInfo,
@@ -30,6 +39,9 @@ from api.api_schemas import (
     BlockInfo,
     InteractionInfo,
     InteractionInfoResponse,
+    InteractionListResponse,
+    InteractionNodeInfo,
+    InteractionNodesResponse,
     InteractionScore,
     ItemCreateResponse,
     ItemDeleteResponse,
@@ -42,14 +54,195 @@ from api.api_schemas import (
     VersionListResponse,
     VersionMetadata,
 )
+from blobstore import get_blob_store
 from blocks import AsyncInvoker
-from database import Database
-from exceptions import ApplicationNotFound, InteractionNotFound
-from model import Application, ApplicationVersion
+from codec import EncodedValue
+from database import (
+    AsyncDatabase,
+    Database,
+    engine_stats,
+    get_async_engine,
+    get_engine,
+    next_cursor,
+)
+from exceptions import (
+    ApplicationConcurrencyExceeded,
+    ApplicationNotFound,
+    AsyncExceptionHandler,
+    ExecutorQueueFull,
+    InteractionError,
+    InteractionNodeNotFound,
+    InteractionNotFound,
+    NoActiveVersion,
+    register_exception_handlers,
+)
+from model import Application, ApplicationVersion, InteractionStatus
+from recorder import InteractionRecorder, PersistencePolicy
 from resolver import Resolver
 
 router = InferringRouter()
 
+# read once, ApplicationView is constructed for every request
+env = Env()
+env.read_env()
+
+
+# the maximum seconds a synchronous run is waited for
+RUN_TIMEOUT = env.float("RUN_TIMEOUT", 30)
+
+# the maximum number of items of a batch run running at the same time
+BATCH_MAX_CONCURRENCY = env.int("BATCH_MAX_CONCURRENCY", 16)
+
+# the maximum seconds a batch item waits for a worker while none of the batch is
+# running, it fails once it's passed
+BATCH_QUEUE_TIMEOUT = env.float("BATCH_QUEUE_TIMEOUT", 60)
+
+# the first and the maximum seconds between two attempts to queue a batch item
+BATCH_RETRY_DELAY = 0.1
+BATCH_MAX_RETRY_DELAY = 5
+
+# the content types of a batch run with the inputs in JSON lines
+JSONL_CONTENT_TYPES = (
+    "application/x-ndjson",
+    "application/jsonl",
+    "application/x-jsonl",
+)
+
+# renders the errors of the batch items the same as the errors of the interactions
+batch_error_handler = AsyncExceptionHandler()
+register_exception_handlers(batch_error_handler)
+
+# the seconds between two keepalive comments of an idle event stream
+SSE_KEEPALIVE = 15
+
+
+def truncate_events(events: List[dict]) -> List[dict]:
+    """
+    Returns the interaction events with the node outputs larger than
+    NODE_OUTPUT_SPILL_SIZE truncated to a preview, the same as they're stored, and
+    the full output can be retrieved by
+    /interactions/{interaction_id}/nodes/{node_id}/value once it's stored.
+    """
+    truncated = []
+    for event in events:
+        if _untruncated(event):
+            value = event["value"]
+            data = json.dumps(value, default=str)
+            if len(data) > InteractionRecorder.spill_size:
+                preview = value if isinstance(value, str) else data
+                event = dict(
+                    event,
+                    value=preview[: InteractionRecorder.preview_size],
+                    blob_size=len(data.encode()),
+                )
+        truncated.append(event)
+    return truncated
+
+
+def _untruncated(event: dict) -> bool:
+    return (
+        event["event"] == "node"
+        and event.get("value") is not None
+        and event.get("blob_size") is None
+    )
+
+
+def encode_event(event: dict) -> str:
+    """
+    Returns the server-sent event of an interaction event, the node outputs must be
+    truncated already (see truncate_events).
+    """
+    event = dict(event)
+    name = event.pop("event")
+    if name == "node":
+        event.setdefault("blob_size", None)
+    return f"event: {name}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+def encode_batch_result(
+    index: int,
+    interaction_id: Optional[str],
+    status: str,
+    output: Optional[str] = None,
+    error: Optional[dict] = None,
+) -> str:
+    """
+    Returns the NDJSON line of the result of a batch item.
+    """
+    return (
+        json.dumps(
+            {
+                "index": index,
+                "id": interaction_id,
+                "status": status,
+                "output": output,
+                "error": error,
+            },
+            default=str,
+        )
+        + "\n"
+    )
+
+
+async def parse_batch_run(request: Request) -> ApplicationBatchRun:
+    """
+    Parses the body of a batch run, which is either an ApplicationBatchRun in JSON,
+    or the inputs in JSON lines (see JSONL_CONTENT_TYPES).
+
+    Raises:
+        RequestValidationError: If the body is invalid.
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        if content_type in JSONL_CONTENT_TYPES:
+            inputs = []
+            for i, line in enumerate(body.splitlines()):
+                if line.strip():
+                    try:
+                        inputs.append(json.loads(line))
+                    except ValueError as e:
+                        raise RequestValidationError(
+                            [
+                                {
+                                    "loc": ("body", i),
+                                    "msg": str(e),
+                                    "type": "value_error.jsondecode",
+                                }
+                            ]
+                        )
+            return ApplicationBatchRun(inputs=inputs)
+        return ApplicationBatchRun.parse_raw(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [dict(error, loc=("body",) + error["loc"]) for error in e.errors()]
+        )
+
+
+def render_error(exc: Exception) -> dict:
+    """
+    Returns the error of an exception, in the form of the error of an interaction.
+    """
+    r = batch_error_handler.render(exc)
+    return {"status_code": r.status_code, "content": json.loads(r.body)}
+
+
+def parse_etags(header: Optional[str]) -> List[str]:
+    """
+    Returns the ETags in an If-None-Match header, the weak ones are compared as the
+    strong ones.
+    """
+    if not header:
+        return []
+    etags = []
+    for etag in header.split(","):
+        etag = etag.strip()
+        if etag.startswith("W/"):
+            etag = etag[2:]
+        if etag:
+            etags.append(etag)
+    return etags
+
 
 @cbv(router)
 class ApplicationView:
@@ -58,10 +251,12 @@ class ApplicationView:
     """
 
     def __init__(self):
-        env = Env()
-        env.read_env()
-        self.database = Database(create_engine(env.str("DATABASE_URL")))
-        self.invoker = AsyncInvoker(self.database)
+        self.database = AsyncDatabase(get_async_engine())
+        self.invoker = AsyncInvoker(
+            Database(get_engine()),
+            max_workers=env.int("GRAPH_MAX_WORKERS", 1),
+            mode=env.str("INVOKER_MODE", "thread"),
+        )
         self.resolver = Resolver()
 
     def resolve_params(self, params: Dict[str, inspect.Parameter]) -> List[Parameter]:
@@ -100,7 +295,7 @@ class ApplicationView:
         return ss
 
     @router.get("/patterns")
-    def patterns(self) -> ApplicationPatternsResponse:
+    async def patterns(self) -> ApplicationPatternsResponse:
         """
         Retrieves application patterns based on resolver information.
 
@@ -128,7 +323,7 @@ class ApplicationView:
         return ApplicationPatternsResponse(patterns=patterns)
 
     @router.get("/blocks")
-    def blocks(self) -> ApplicationBlocksResponse:
+    async def blocks(self) -> ApplicationBlocksResponse:
         """
         Retrieves application blocks based on resolver information.
 
@@ -153,7 +348,7 @@ class ApplicationView:
         return ApplicationBlocksResponse(blocks=blocks)
 
     @router.get("/applications/{application_id}")
-    def get_app(self, application_id: str) -> ApplicationInfoResponse:
+    async def get_app(self, application_id: str) -> ApplicationInfoResponse:
         """
         Get information about a specific application.
 
@@ -164,7 +359,7 @@ class ApplicationView:
             ApplicationInfoResponse: Information about the application, including its ID, name,
                 active version, creation timestamp, and last update timestamp.
         """
-        app = self.database.get_application(application_id)
+        app = await self.database.get_application(application_id)
 
         return ApplicationInfoResponse(
             application=(
@@ -175,6 +370,8 @@ class ApplicationView:
                     langfuse_public_key=app.langfuse_public_key,
                     langfuse_secret_key=app.langfuse_secret_key,
                     active_version=app.active_version,
+                    retention_days=app.retention_days,
+                    persistence_policy=app.persistence_policy,
                     created_at=int(app.created_at.timestamp()),
                     updated_at=int(app.updated_at.timestamp()),
                 )
@@ -184,15 +381,25 @@ class ApplicationView:
         )
 
     @router.get("/applications")
-    def list_app(self) -> ApplicationListResponse:
+    async def list_app(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        cursor: Optional[str] = None,
+    ) -> ApplicationListResponse:
         """
-        Retrieve a list of applications.
+        Retrieve a list of applications, the latest first.
+
+        Args:
+            limit (int): The maximum number of applications in the page, all the
+                applications are returned if it's not given.
+            cursor (str): The next_cursor of the previous page.
 
         Returns:
             ApplicationListResponse: The response containing a list of applications.
         """
-        apps = self.database.list_applications()
+        apps = await self.database.list_applications(limit=limit, cursor=cursor)
         return ApplicationListResponse(
+            next_cursor=next_cursor(apps, limit),
             applications=[
                 ApplicationInfo(
                     id=app.id,
@@ -201,15 +408,17 @@ class ApplicationView:
                     langfuse_public_key=app.langfuse_public_key,
                     langfuse_secret_key=app.langfuse_secret_key,
                     active_version=app.active_version,
+                    retention_days=app.retention_days,
+                    persistence_policy=app.persistence_policy,
                     created_at=int(app.created_at.timestamp()),
                     updated_at=int(app.updated_at.timestamp()),
                 )
                 for app in apps
-            ]
+            ],
         )
 
     @router.post("/applications")
-    def create_app(
+    async def create_app(
         self, request: Request, application: ApplicationCreate
     ) -> ApplicationCreateResponse:
         """
@@ -221,15 +430,19 @@ class ApplicationView:
         Returns:
             ApplicationCreateResponse: The response containing the ID of the created application.
         """
+        if application.persistence_policy is not None:
+            PersistencePolicy.validate(application.persistence_policy)
         created_at = datetime.utcnow()
         _id = str(uuid.uuid4())
-        self.database.create_application(
+        await self.database.create_application(
             Application(
                 id=_id,
                 name=application.name,
                 user=request.state.user,
                 langfuse_public_key=application.langfuse_public_key,
                 langfuse_secret_key=application.langfuse_secret_key,
+                retention_days=application.retention_days,
+                persistence_policy=application.persistence_policy,
                 created_at=created_at,
                 updated_at=created_at,
             )
@@ -237,7 +450,7 @@ class ApplicationView:
         return ApplicationCreateResponse(id=_id)
 
     @router.post("/applications/{application_id}/async_run")
-    def async_run_app(
+    async def async_run_app(
         self, request: Request, application_id: str, config: ApplicationRun
     ) -> ApplicationRunResponse:
         """
@@ -252,7 +465,8 @@ class ApplicationView:
                 used for polling running result latter.
         """
         return ApplicationRunResponse(
-            id=self.invoker.invoke(
+            id=await run_in_threadpool(
+                self.invoker.invoke,
                 user=request.state.user,
                 app_id=application_id,
                 input=config.input,
@@ -260,20 +474,390 @@ class ApplicationView:
             )
         )
 
+    @router.post("/applications/{application_id}/run")
+    async def run_app(
+        self,
+        request: Request,
+        response: Response,
+        application_id: str,
+        config: ApplicationRun,
+        timeout: Optional[float] = Query(None, gt=0),
+    ) -> ApplicationRunOutputResponse:
+        """
+        Runs an application with the specified ID and configuration, and returns its
+        output as soon as the graph finishes. The interaction is recorded as the
+        other runs, but the response doesn't wait for the output to be written.
+
+        If the run doesn't finish in time, 202 is returned with the interaction ID,
+        and the interaction can be polled by /interactions/{interaction_id}. A
+        failed run returns the error of the interaction.
+
+        Args:
+            application_id (str): The ID of the application to run.
+            config (ApplicationRun): The configuration for running the application.
+            timeout (float): The maximum seconds to wait, it's capped by RUN_TIMEOUT.
+
+        Returns:
+            ApplicationRunOutputResponse: The interaction ID, status and output.
+        """
+        future = concurrent.futures.Future()
+        interaction_id = await run_in_threadpool(
+            self.invoker.invoke,
+            user=request.state.user,
+            app_id=application_id,
+            input=config.input,
+            session_id=config.session_id,
+            future=future,
+        )
+        try:
+            # shielded, so the timeout never cancels the run
+            output = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)),
+                min(timeout or RUN_TIMEOUT, RUN_TIMEOUT),
+            )
+        except asyncio.TimeoutError:
+            response.status_code = 202
+            return ApplicationRunOutputResponse(
+                id=interaction_id, status=InteractionStatus.RUNNING, output=None
+            )
+        except InteractionError as e:
+            return JSONResponse(**e.error)
+        return ApplicationRunOutputResponse(
+            id=interaction_id, status=InteractionStatus.SUCCEEDED, output=output
+        )
+
+    @router.post("/applications/{application_id}/batch_run")
+    async def batch_run_app(
+        self,
+        request: Request,
+        application_id: str,
+        concurrency: int = Query(4, ge=1),
+        batch_id: Optional[str] = Query(None, max_length=36),
+    ):
+        """
+        Runs an application over a batch of inputs, and streams the results as JSON
+        lines in the order they complete: index (the position of the input), id
+        (the interaction ID), status, output and error. The body is either an
+        ApplicationBatchRun, or the inputs in JSON lines with the content type
+        application/x-ndjson.
+
+        The batch ID is returned in the X-Batch-ID header. A batch is resumed by
+        running it again with its batch_id and the same inputs, then the results of
+        the succeeded items are sent first and the other items are run again.
+
+        Args:
+            application_id (str): The ID of the application to run.
+            concurrency (int): The maximum number of items running at the same time,
+                it's capped by BATCH_MAX_CONCURRENCY.
+            batch_id (str): The ID of the batch to resume.
+
+        Returns:
+            The stream of the results, with media type application/x-ndjson.
+        """
+        config = await parse_batch_run(request)
+        app = await self.database.get_application(application_id)
+        if app is None:
+            raise ApplicationNotFound(application_id)
+        if not app.active_version:
+            raise NoActiveVersion(application_id)
+        batch_id = batch_id or str(uuid.uuid4())
+        return StreamingResponse(
+            self.batch_results(
+                request.state.user,
+                application_id,
+                batch_id,
+                config,
+                min(concurrency, BATCH_MAX_CONCURRENCY),
+            ),
+            media_type="application/x-ndjson",
+            headers={"X-Batch-ID": batch_id, "X-Accel-Buffering": "no"},
+        )
+
+    async def batch_results(
+        self,
+        user: str,
+        app_id: str,
+        batch_id: str,
+        config: ApplicationBatchRun,
+        concurrency: int,
+    ) -> AsyncIterator[str]:
+        """
+        Run the items of a batch on the invoker workers, and generate their results
+        as they complete. The items succeeded in a previous run of the batch are not
+        run again. When the workers are busy, the next item waits for a running item
+        to complete, or if none is running, it's retried with backoff and fails after
+        BATCH_QUEUE_TIMEOUT seconds. The items failed before they're run are recorded
+        as failed interactions too.
+
+        Args:
+            user (str): The user who runs the batch.
+            app_id (str): The ID of the application to run.
+            batch_id (str): The ID of the batch.
+            config (ApplicationBatchRun): The inputs of the batch.
+            concurrency (int): The maximum number of items running at the same time.
+
+        Returns:
+            AsyncIterator[str]: The results in JSON lines.
+        """
+        succeeded = {}
+        for interaction in await self.database.list_batch_interactions(batch_id):
+            if interaction.status == InteractionStatus.SUCCEEDED:
+                succeeded[interaction.batch_index] = interaction
+        for index, interaction in sorted(succeeded.items()):
+            if index < len(config.inputs):
+                yield encode_batch_result(
+                    index, interaction.id, interaction.status, interaction.output
+                )
+
+        pending = deque(i for i in range(len(config.inputs)) if i not in succeeded)
+        running = {}
+        # the backoff of an item rejected while none of the batch is running
+        delay, deadline = BATCH_RETRY_DELAY, None
+        while pending or running:
+            while pending and len(running) < concurrency:
+                index = pending[0]
+                future = concurrent.futures.Future()
+                try:
+                    interaction_id = await run_in_threadpool(
+                        self.invoker.invoke,
+                        user=user,
+                        app_id=app_id,
+                        input=config.inputs[index],
+                        session_id=config.session_id,
+                        future=future,
+                        batch_id=batch_id,
+                        batch_index=index,
+                    )
+                except (ExecutorQueueFull, ApplicationConcurrencyExceeded) as e:
+                    if running:
+                        break
+                    # the workers are busy with other requests
+                    now = time.monotonic()
+                    deadline = deadline or now + BATCH_QUEUE_TIMEOUT
+                    if now < deadline:
+                        await asyncio.sleep(min(delay, deadline - now))
+                        delay = min(delay * 2, BATCH_MAX_RETRY_DELAY)
+                        continue
+                    error = render_error(e)
+                except Exception as e:
+                    error = render_error(e)
+                else:
+                    pending.popleft()
+                    running[asyncio.wrap_future(future)] = (index, interaction_id)
+                    delay, deadline = BATCH_RETRY_DELAY, None
+                    continue
+                # the deadline is kept, so the rest of the batch fails without
+                # waiting again until an item is queued
+                pending.popleft()
+                interaction_id = await self.record_batch_failure(
+                    user, app_id, batch_id, config, index, error
+                )
+                yield encode_batch_result(
+                    index, interaction_id, InteractionStatus.FAILED, error=error
+                )
+            if not running:
+                continue
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                index, interaction_id = running.pop(future)
+                try:
+                    output = future.result()
+                except InteractionError as e:
+                    yield encode_batch_result(
+                        index, interaction_id, InteractionStatus.FAILED, error=e.error
+                    )
+                except Exception as e:
+                    yield encode_batch_result(
+                        index,
+                        interaction_id,
+                        InteractionStatus.FAILED,
+                        error=render_error(e),
+                    )
+                else:
+                    yield encode_batch_result(
+                        index, interaction_id, InteractionStatus.SUCCEEDED, output
+                    )
+
+    async def record_batch_failure(
+        self,
+        user: str,
+        app_id: str,
+        batch_id: str,
+        config: ApplicationBatchRun,
+        index: int,
+        error: dict,
+    ) -> Optional[str]:
+        """
+        Record a failed interaction for a batch item rejected before it's run, so it's
+        listed by the results of the batch and run again when the batch is resumed.
+
+        Returns:
+            Optional[str]: The ID of the interaction, None if it can't be recorded.
+        """
+        try:
+            return await run_in_threadpool(
+                self.invoker.record_failure,
+                user=user,
+                app_id=app_id,
+                input=config.inputs[index],
+                error=error,
+                session_id=config.session_id,
+                batch_id=batch_id,
+                batch_index=index,
+            )
+        except Exception:
+            logging.exception(f"failed to record the item {index} of batch {batch_id}")
+            return None
+
+    @router.get("/batches/{batch_id}/results")
+    async def get_batch_results(self, batch_id: str):
+        """
+        Streams the results of a batch recorded so far as JSON lines, by index: index,
+        id, status, output and error. Only the latest run of an item is included.
+
+        Args:
+            batch_id (str): The ID of the batch.
+
+        Returns:
+            The stream of the results, with media type application/x-ndjson.
+        """
+        latest = {}
+        for interaction in await self.database.list_batch_interactions(batch_id):
+            latest[interaction.batch_index] = interaction
+
+        async def results() -> AsyncIterator[str]:
+            for index, interaction in sorted(latest.items()):
+                yield encode_batch_result(
+                    index,
+                    interaction.id,
+                    interaction.status,
+                    interaction.output,
+                    interaction.error,
+                )
+
+        return StreamingResponse(results(), media_type="application/x-ndjson")
+
+    @router.post("/applications/{application_id}/stream_run")
+    async def stream_run_app(
+        self, request: Request, application_id: str, config: ApplicationRun
+    ):
+        """
+        Runs an application with the specified ID and configuration, and streams its
+        progress as server-sent events: an "interaction" event (id) first, then a
+        "token" event (node_id, text) for every token of the output as it's
+        generated, and the events of /interactions/{interaction_id}/events. The
+        output is recorded to the interaction as the other runs.
+
+        Only the tokens of the LLM blocks feeding the output block directly are
+        streamed, the output of the other applications is sent by the "end" event
+        at once.
+
+        Args:
+            application_id (str): The ID of the application to run.
+            config (ApplicationRun): The configuration for running the application.
+
+        Returns:
+            The stream of the events, with media type text/event-stream.
+        """
+        interaction_id = await run_in_threadpool(
+            self.invoker.invoke,
+            user=request.state.user,
+            app_id=application_id,
+            input=config.input,
+            session_id=config.session_id,
+            stream=True,
+        )
+
+        async def events() -> AsyncIterator[str]:
+            yield encode_event({"event": "interaction", "id": interaction_id})
+            async for event in self.interaction_events(interaction_id):
+                yield event
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @router.get("/applications/{application_id}/interactions")
+    async def list_app_interactions(
+        self,
+        application_id: str,
+        version_id: Optional[str] = None,
+        limit: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = None,
+    ) -> InteractionListResponse:
+        """
+        Get a page of the interactions of an application, the latest first.
+
+        Args:
+            application_id (str): The ID of the application.
+            version_id (str): Only list the interactions of this version if it's given.
+            limit (int): The maximum number of interactions in the page.
+            cursor (str): The next_cursor of the previous page.
+
+        Returns:
+            InteractionListResponse: The interactions of the page, without their data.
+        """
+        interactions = await self.database.list_interactions(
+            application_id, version_id=version_id, limit=limit, cursor=cursor
+        )
+        return InteractionListResponse(
+            interactions=[
+                InteractionInfo(
+                    id=interaction.id,
+                    user=interaction.user,
+                    version_id=interaction.version_id,
+                    created_at=int(interaction.created_at.timestamp()),
+                    updated_at=int(interaction.updated_at.timestamp()),
+                    output=interaction.output,
+                    data=None,
+                    status=interaction.status,
+                )
+                for interaction in interactions
+            ],
+            next_cursor=next_cursor(interactions, limit),
+        )
+
     @router.get("/interactions/{interaction_id}")
-    def get_interaction(self, interaction_id: str) -> InteractionInfoResponse:
+    async def get_interaction(
+        self,
+        request: Request,
+        response: Response,
+        interaction_id: str,
+        wait: Optional[float] = Query(None, ge=0, le=60),
+    ) -> InteractionInfoResponse:
         """
         Retrieves information about a specific interaction by its ID.
 
+        The response carries an ETag, a request with the ETag in If-None-Match gets
+        304 if the interaction hasn't changed since. With wait, the request is held
+        until the interaction changes (since the ETag in If-None-Match, or since the
+        request arrives without it) or completes, or wait seconds have passed.
+
         Args:
             interaction_id (str): The ID of the interaction to retrieve.
+            wait (float): The maximum seconds to hold the request.
 
         Returns:
             InteractionInfoResponse: An object containing information about the interaction.
         """
-        interaction = self.invoker.poll(interaction_id)
+        etags = parse_etags(request.headers.get("if-none-match"))
+        if wait:
+            revision = await self.wait_interaction(
+                interaction_id, etags[0].strip('"') if etags else None, wait
+            )
+        else:
+            revision = await self.database.get_interaction_revision(interaction_id)
+        if revision is not None:
+            etag = f'"{revision[0]}"'
+            if etag in etags or "*" in etags:
+                return Response(status_code=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
+
+        interaction = await self.database.get_interaction(interaction_id)
         if interaction is not None and interaction.error is not None:
-            return JSONResponse(**interaction.error)
+            return JSONResponse(**interaction.error, headers=dict(response.headers))
         return InteractionInfoResponse(
             interaction=(
                 InteractionInfo(
@@ -282,16 +866,292 @@ class ApplicationView:
                     version_id=interaction.version_id,
                     created_at=int(interaction.created_at.timestamp()),
                     updated_at=int(interaction.updated_at.timestamp()),
-                    data=interaction.data,
+                    data=await self.database.get_interaction_data(interaction),
                     output=interaction.output,
+                    status=interaction.status,
                 )
                 if interaction
                 else None
             )
         )
 
+    async def wait_interaction(
+        self, interaction_id: str, revision: Optional[str], timeout: float
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Wait for an interaction to change or complete. The waiter is woken up as soon
+        as the interaction is written if it is run in this process, otherwise the
+        interaction is polled with a backoff from 50 milliseconds up to a second.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+            revision (str): The revision known by the client, the revision when the
+                wait starts if it is None.
+            timeout (float): The maximum seconds to wait.
+
+        Returns:
+            Optional[Tuple[str, str]]: The revision and the status of the interaction,
+                None if the interaction is not found.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = 0.05
+        while True:
+            future = InteractionRecorder.changes.watch(interaction_id)
+            try:
+                current = await self.database.get_interaction_revision(interaction_id)
+                if current is None or current[1] in (
+                    InteractionStatus.SUCCEEDED,
+                    InteractionStatus.FAILED,
+                ):
+                    return current
+                if revision is None:
+                    revision = current[0]
+                elif current[0] != revision:
+                    return current
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return current
+                try:
+                    await asyncio.wait_for(future, min(delay, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, 1.0)
+            finally:
+                InteractionRecorder.changes.unwatch(interaction_id, future)
+
+    @router.get("/interactions/{interaction_id}/events")
+    async def stream_interaction_events(self, interaction_id: str):
+        """
+        Streams the progress of an interaction as server-sent events: a "node" event
+        (node_id, status, started_at, finished_at, value, and blob_size if the value
+        is truncated) once a node finishes, and an "end" event (status, output,
+        error) once the interaction completes. The nodes finished before the stream
+        starts are sent first. The interactions started by
+        /applications/{application_id}/stream_run have "token" events as well.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+
+        Returns:
+            The stream of the events, with media type text/event-stream.
+        """
+        if await self.database.get_interaction_revision(interaction_id) is None:
+            raise InteractionNotFound(interaction_id)
+        return StreamingResponse(
+            self.interaction_events(interaction_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def interaction_events(self, interaction_id: str) -> AsyncIterator[str]:
+        """
+        Generate the server-sent events of an interaction. The events of the
+        interactions running in this process are received from the event bus of
+        InteractionRecorder as the nodes finish. The others (not started yet, or run
+        by another process) are read from the database whenever they're written,
+        until they start running in this process.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+
+        Returns:
+            AsyncIterator[str]: The server-sent events.
+        """
+        loop = asyncio.get_running_loop()
+        sent = set()
+        revision = None
+        delay = 0.05
+        last_sent = loop.time()
+        while True:
+            subscription = InteractionRecorder.events.subscribe(interaction_id)
+            if subscription is not None:
+                try:
+                    while True:
+                        try:
+                            event = await subscription.get(SSE_KEEPALIVE)
+                        except asyncio.TimeoutError:
+                            yield ": keepalive\n\n"
+                            continue
+                        if event is None:
+                            break
+                        if event["event"] == "node":
+                            if event["node_id"] in sent:
+                                continue
+                            sent.add(event["node_id"])
+                        yield encode_event(event)
+                        if event["event"] == "end":
+                            return
+                finally:
+                    subscription.close()
+
+            future = InteractionRecorder.changes.watch(interaction_id)
+            try:
+                current = await self.database.get_interaction_revision(interaction_id)
+                if current is None:
+                    return
+                if current[0] != revision:
+                    revision = current[0]
+                    for event in await self.stored_interaction_events(interaction_id):
+                        if event["event"] == "node":
+                            if event["node_id"] in sent:
+                                continue
+                            sent.add(event["node_id"])
+                        yield encode_event(event)
+                        last_sent = loop.time()
+                        if event["event"] == "end":
+                            return
+                if loop.time() - last_sent > SSE_KEEPALIVE:
+                    yield ": keepalive\n\n"
+                    last_sent = loop.time()
+                try:
+                    await asyncio.wait_for(future, delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, 1.0)
+            finally:
+                InteractionRecorder.changes.unwatch(interaction_id, future)
+
+    async def stored_interaction_events(self, interaction_id: str) -> List[dict]:
+        """
+        Returns the events of the nodes of an interaction stored in the database,
+        and the end event if the interaction has completed.
+        """
+        interaction = await self.database.get_interaction(interaction_id)
+        if interaction is None:
+            return []
+        nodes = await self.database.list_interaction_nodes(interaction_id)
+        if nodes:
+            events = [
+                {
+                    "event": "node",
+                    "node_id": node.node_id,
+                    "status": node.status,
+                    "started_at": (
+                        node.started_at.timestamp() if node.started_at else None
+                    ),
+                    "finished_at": node.finished_at.timestamp(),
+                    "value": node.value,
+                    "blob_size": node.blob_size,
+                }
+                for node in nodes
+            ]
+        else:
+            # recorded before the nodes are stored in their own table
+            events = [
+                {"event": "node", "node_id": k, "value": v}
+                for k, v in (interaction.data or {}).items()
+            ]
+        if any(_untruncated(event) for event in events):
+            # the nodes stored without a blob store keep their values in full, the
+            # large ones are truncated out of the event loop
+            events = await run_in_threadpool(truncate_events, events)
+        if interaction.status in (
+            InteractionStatus.SUCCEEDED,
+            InteractionStatus.FAILED,
+        ):
+            events.append(
+                {
+                    "event": "end",
+                    "status": interaction.status,
+                    "output": interaction.output,
+                    "error": interaction.error,
+                }
+            )
+        return events
+
+    @router.get("/interactions/{interaction_id}/nodes")
+    async def get_interaction_nodes(
+        self, interaction_id: str, node_id: Optional[List[str]] = Query(None)
+    ) -> InteractionNodesResponse:
+        """
+        Retrieves the finished nodes of an interaction, so a large interaction can be
+        loaded node by node.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+            node_id (List[str]): Only retrieve the nodes with these IDs if it's given.
+
+        Returns:
+            InteractionNodesResponse: The finished nodes, in the order they finished.
+        """
+        interaction = await self.database.get_interaction(interaction_id)
+        if interaction is None:
+            raise InteractionNotFound(interaction_id)
+        nodes = await self.database.list_interaction_nodes(interaction_id, node_id)
+        if nodes:
+            return InteractionNodesResponse(
+                nodes=[
+                    InteractionNodeInfo(
+                        node_id=node.node_id,
+                        value=node.value,
+                        status=node.status,
+                        started_at=(
+                            node.started_at.timestamp() if node.started_at else None
+                        ),
+                        finished_at=node.finished_at.timestamp(),
+                        blob_size=node.blob_size,
+                    )
+                    for node in nodes
+                ]
+            )
+        # recorded before the nodes are stored in their own table
+        data = interaction.data or {}
+        return InteractionNodesResponse(
+            nodes=[
+                InteractionNodeInfo(
+                    node_id=k,
+                    value=v,
+                    status=None,
+                    started_at=None,
+                    finished_at=None,
+                    blob_size=None,
+                )
+                for k, v in data.items()
+                if node_id is None or k in node_id
+            ]
+        )
+
+    @router.get("/interactions/{interaction_id}/nodes/{node_id}/value")
+    async def get_interaction_node_value(self, interaction_id: str, node_id: str):
+        """
+        Retrieves the full output of a node as JSON. The outputs spilled to the blob
+        store are streamed from it, instead of the preview returned with the node.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+            node_id (str): The ID of the node.
+
+        Returns:
+            The output of the node.
+        """
+        nodes = await self.database.list_interaction_nodes(interaction_id, [node_id])
+        if not nodes:
+            # recorded before the nodes are stored in their own table
+            interaction = await self.database.get_interaction(interaction_id)
+            if interaction is None:
+                raise InteractionNotFound(interaction_id)
+            if node_id not in (interaction.data or {}):
+                raise InteractionNodeNotFound(interaction_id, node_id)
+            return JSONResponse(content=interaction.data[node_id])
+        node = nodes[0]
+        if node.blob_key is None:
+            return JSONResponse(content=node.value)
+        blob_store = get_blob_store()
+        try:
+            if blob_store is None:
+                raise KeyError(node.blob_key)
+            chunks = await run_in_threadpool(blob_store.open, node.blob_key)
+        except KeyError:
+            raise InteractionNodeNotFound(interaction_id, node_id)
+        return StreamingResponse(
+            chunks,
+            media_type="application/json",
+            headers={"Content-Length": str(node.blob_size)},
+        )
+
     @router.post("/interactions/{interaction_id}/scores")
-    def score_interaction(
+    async def score_interaction(
         self,
         request: Request,
         interaction_id: str,
@@ -309,10 +1169,10 @@ class ApplicationView:
         """
 
         # get langfuse configuration
-        interaction = self.database.get_interaction(interaction_id)
+        interaction = await self.database.get_interaction(interaction_id)
         if not interaction:
             raise InteractionNotFound(interaction_id)
-        app = self.database.get_application(interaction.app_id)
+        app = await self.database.get_application(interaction.app_id)
         if not app:
             raise ApplicationNotFound(app_id)
         if not app.langfuse_public_key or not app.langfuse_secret_key:
@@ -341,7 +1201,7 @@ class ApplicationView:
         return ItemCreateResponse(success=True, message=f"Score has been created.")
 
     @router.put("/applications/{application_id}")
-    def update_app_meta(
+    async def update_app_meta(
         self, application_id: str, metadata: AppMetadata
     ) -> ItemUpdateResponse:
         """
@@ -354,17 +1214,21 @@ class ApplicationView:
         Returns:
             ItemUpdateResponse: An object indicating the success or failure of the update operation.
         """
+        if metadata.persistence_policy is not None:
+            PersistencePolicy.validate(metadata.persistence_policy)
         try:
             updated_at = datetime.utcnow()
-            self.database.update_application(
-                application_id,
-                {
-                    "name": metadata.name,
-                    "langfuse_public_key": metadata.langfuse_public_key,
-                    "langfuse_secret_key": metadata.langfuse_secret_key,
-                    "updated_at": updated_at,
-                },
-            )
+            attrs = {
+                "name": metadata.name,
+                "langfuse_public_key": metadata.langfuse_public_key,
+                "langfuse_secret_key": metadata.langfuse_secret_key,
+                "updated_at": updated_at,
+            }
+            if "retention_days" in metadata.__fields_set__:
+                attrs["retention_days"] = metadata.retention_days
+            if "persistence_policy" in metadata.__fields_set__:
+                attrs["persistence_policy"] = metadata.persistence_policy
+            await self.database.update_application(application_id, attrs)
             return ItemUpdateResponse(
                 success=True,
                 message=f"Application {application_id}'s metadata updated.",
@@ -376,7 +1240,7 @@ class ApplicationView:
             )
 
     @router.delete("/applications/{application_id}")
-    def delete_app(self, application_id: str) -> ItemDeleteResponse:
+    async def delete_app(self, application_id: str) -> ItemDeleteResponse:
         """
         Delete an application by its ID.
 
@@ -388,7 +1252,7 @@ class ApplicationView:
         """
         try:
             deleted_at = datetime.utcnow()
-            self.database.update_application(
+            await self.database.update_application(
                 application_id,
                 {
                     "updated_at": deleted_at,
@@ -406,7 +1270,7 @@ class ApplicationView:
             )
 
     @router.post("/applications/{application_id}/versions/{version_id}/async_run")
-    def async_run_app_version(
+    async def async_run_app_version(
         self,
         request: Request,
         application_id: str,
@@ -426,7 +1290,8 @@ class ApplicationView:
                 used for polling running result latter.
         """
         return ApplicationRunResponse(
-            id=self.invoker.invoke(
+            id=await run_in_threadpool(
+                self.invoker.invoke,
                 user=request.state.user,
                 app_id=application_id,
                 input=config.input,
@@ -436,10 +1301,10 @@ class ApplicationView:
         )
 
     @router.get("/applications/{application_id}/versions/{version_id}")
-    def get_app_version(
+    async def get_app_version(
         self, application_id: str, version_id: str
     ) -> VersionInfoResponse:
-        version = self.database.get_version(version_id)
+        version = await self.database.get_version(version_id)
         if not version or version.app_id != application_id:
             return VersionInfoResponse(version=None)
 
@@ -454,24 +1319,36 @@ class ApplicationView:
                     updated_at=int(version.updated_at.timestamp()),
                     metadata=version.meta,
                     configuration=version.configuration,
+                    persistence_policy=version.persistence_policy,
                 )
             )
         )
 
     @router.get("/applications/{application_id}/versions")
-    def list_app_versions(self, application_id: str) -> VersionListResponse:
+    async def list_app_versions(
+        self,
+        application_id: str,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        cursor: Optional[str] = None,
+    ) -> VersionListResponse:
         """
-        Get a list of application versions for the specified application_id.
+        Get a list of application versions for the specified application_id, the latest first.
 
         Args:
             application_id (str): The ID of the application.
+            limit (int): The maximum number of versions in the page, all the versions
+                are returned if it's not given.
+            cursor (str): The next_cursor of the previous page.
 
         Returns:
             VersionListResponse: A response containing a list of ApplicationVersionInfo objects
                 representing the versions of the specified application.
         """
-        versions = self.database.list_versions(application_id)
+        versions = await self.database.list_versions(
+            application_id, limit=limit, cursor=cursor
+        )
         return VersionListResponse(
+            next_cursor=next_cursor(versions, limit),
             versions=[
                 ApplicationVersionInfo(
                     id=version.id,
@@ -482,13 +1359,14 @@ class ApplicationView:
                     updated_at=int(version.updated_at.timestamp()),
                     metadata=None,
                     configuration=None,
+                    persistence_policy=version.persistence_policy,
                 )
                 for version in versions
-            ]
+            ],
         )
 
     @router.post("/applications/{application_id}/versions")
-    def create_app_version(
+    async def create_app_version(
         self,
         request: Request,
         application_id: str,
@@ -504,9 +1382,11 @@ class ApplicationView:
         Returns:
             VersionCreateResponse: The response containing the ID of the created version.
         """
+        if version.persistence_policy is not None:
+            PersistencePolicy.validate(version.persistence_policy)
         created_at = datetime.utcnow()
         _id = str(uuid.uuid4())
-        self.database.create_version(
+        await self.database.create_version(
             ApplicationVersion(
                 id=_id,
                 name=version.name,
@@ -517,12 +1397,13 @@ class ApplicationView:
                 updated_at=created_at,
                 meta=version.metadata,
                 configuration=version.configuration.dict(),
+                persistence_policy=version.persistence_policy,
             )
         )
         return VersionCreateResponse(id=_id)
 
     @router.put("/applications/{application_id}/versions/{version_id}")
-    def update_app_version_meta(
+    async def update_app_version_meta(
         self, application_id: str, version_id: str, metadata: VersionMetadata
     ) -> ItemUpdateResponse:
         """
@@ -536,16 +1417,19 @@ class ApplicationView:
         Returns:
             ItemUpdateResponse: An object indicating the success or failure of the update operation.
         """
+        if metadata.persistence_policy is not None:
+            PersistencePolicy.validate(metadata.persistence_policy)
         try:
             updated_at = datetime.utcnow()
-            self.database.update_version(
-                version_id,
-                {
-                    "name": metadata.name,
-                    "meta": metadata.metadata,
-                    "updated_at": updated_at,
-                },
-            )
+            attrs = {
+                "name": metadata.name,
+                "meta": metadata.metadata,
+                "updated_at": updated_at,
+            }
+            if "persistence_policy" in metadata.__fields_set__:
+                attrs["persistence_policy"] = metadata.persistence_policy
+            await self.database.update_version(version_id, attrs)
+            AsyncInvoker.invalidate_graph(version_id)
             return ItemUpdateResponse(
                 success=True,
                 message=f"Version {version_id}'s metadata updated.",
@@ -557,7 +1441,7 @@ class ApplicationView:
             )
 
     @router.delete("/applications/{application_id}/versions/{version_id}")
-    def delete_app_version(
+    async def delete_app_version(
         self, application_id: str, version_id: str
     ) -> ItemDeleteResponse:
         """
@@ -572,20 +1456,21 @@ class ApplicationView:
         """
         try:
             deleted_at = datetime.utcnow()
-            app = self.database.get_application(application_id)
+            app = await self.database.get_application(application_id)
             if app.active_version == version_id:
                 return ItemDeleteResponse(
                     success=False,
                     message=f"Active version can not be deleted.",
                 )
 
-            self.database.update_version(
+            await self.database.update_version(
                 version_id,
                 {
                     "updated_at": deleted_at,
                     "deleted_at": deleted_at,
                 },
             )
+            AsyncInvoker.invalidate_graph(version_id)
             return ItemDeleteResponse(
                 success=True,
                 message=f"Version {version_id} has been deleted.",
@@ -597,7 +1482,7 @@ class ApplicationView:
             )
 
     @router.put("/applications/{application_id}/versions/{version_id}/active")
-    def active_app_version(self, application_id: str, version_id: str):
+    async def active_app_version(self, application_id: str, version_id: str):
         """
         Update the active version of an application in the database.
 
@@ -610,7 +1495,7 @@ class ApplicationView:
         """
         try:
             updated_at = datetime.utcnow()
-            self.database.update_application(
+            await self.database.update_application(
                 application_id,
                 {
                     "active_version": version_id,
@@ -628,9 +1513,27 @@ class ApplicationView:
             )
 
     @router.get("/ping")
-    def ping(self) -> dict:
+    async def ping(self) -> dict:
         return {"message": "pong"}
 
+    @router.get("/metrics")
+    async def metrics(self) -> dict:
+        """
+        Returns the runtime metrics of the process.
+        """
+        return {
+            "graph_cache": AsyncInvoker.graph_cache.stats(),
+            "application_cache": Database.application_cache.stats(),
+            "version_cache": Database.version_cache.stats(),
+            "executor": AsyncInvoker.executor.stats(),
+            "database_pool": engine_stats(get_engine()),
+            "async_database_pool": engine_stats(get_async_engine().sync_engine),
+            "interaction_codec": {
+                "codec": (EncodedValue.codec.name if EncodedValue.codec else "none"),
+                **EncodedValue.stats.stats(),
+            },
+        }
+
     @router.get("/me")
-    def me(self, request: Request) -> User:
+    async def me(self, request: Request) -> User:
         return User(user=request.state.user)
@@ -0,0 +1,174 @@
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional
+
+from environs import Env
+
+"""
+Blob stores keep the node outputs too large to be stored in the database, see
+InteractionRecorder. The store is configured by BLOB_STORE_DIR, the outputs are
+stored in the local directory if it's set, and in the database otherwise.
+
+Other stores (an object storage for example) can be plugged by subclassing BlobStore
+and installing it with set_blob_store when the process starts, a plugin for example.
+"""
+
+
+class BlobStore(ABC):
+    """
+    BlobStore stores bytes by keys. A key is a relative path like
+    "interactions/{interaction_id}/{node}.json".
+    """
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        """
+        Store the bytes of a key, replacing the existing ones.
+
+        Args:
+            key (str): The key.
+            data (bytes): The bytes to store.
+        """
+        pass
+
+    @abstractmethod
+    def open(self, key: str, chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Read the bytes of a key in chunks.
+
+        Args:
+            key (str): The key.
+            chunk_size (int): The maximum size of a chunk.
+
+        Returns:
+            Iterator[bytes]: The chunks.
+
+        Raises:
+            KeyError: If the key doesn't exist, it's raised by open itself instead
+                of the iteration.
+        """
+        pass
+
+    def get(self, key: str) -> bytes:
+        """
+        Read the bytes of a key.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            bytes: The stored bytes.
+
+        Raises:
+            KeyError: If the key doesn't exist.
+        """
+        return b"".join(self.open(key))
+
+    @abstractmethod
+    def delete(self, keys: List[str]):
+        """
+        Delete keys, the missing keys are ignored.
+
+        Args:
+            keys (List[str]): The keys to delete.
+        """
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    """
+    LocalBlobStore stores every key as a file under a directory. The directory must
+    be shared by the API servers and the workers, a network file system for example.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory (str): The directory the files are stored in.
+        """
+        self.directory = os.path.realpath(directory)
+
+    def path(self, key: str) -> str:
+        """
+        Returns the path of the file of a key.
+
+        Raises:
+            KeyError: If the key points outside the directory.
+        """
+        path = os.path.realpath(os.path.join(self.directory, key))
+        if not path.startswith(self.directory + os.sep):
+            raise KeyError(key)
+        return path
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file, so a reader never sees a partial blob
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def open(self, key: str, chunk_size: int = 65536) -> Iterator[bytes]:
+        try:
+            f = open(self.path(key), "rb")
+        except FileNotFoundError:
+            raise KeyError(key)
+
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        return chunks()
+
+    def delete(self, keys: List[str]):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+_blob_store_loaded = False
+
+
+def get_blob_store() -> Optional[BlobStore]:
+    """
+    Returns the blob store of the process, a LocalBlobStore of BLOB_STORE_DIR unless
+    another one is installed by set_blob_store.
+
+    Returns:
+        Optional[BlobStore]: The blob store, None if no blob store is configured.
+    """
+    global _blob_store, _blob_store_loaded
+    if not _blob_store_loaded:
+        with _blob_store_lock:
+            if not _blob_store_loaded:
+                env = Env()
+                env.read_env()
+                directory = env.str("BLOB_STORE_DIR", None)
+                if directory:
+                    _blob_store = LocalBlobStore(directory)
+                _blob_store_loaded = True
+    return _blob_store
+
+
+def set_blob_store(store: Optional[BlobStore]):
+    """
+    Install the blob store of the process.
+
+    Args:
+        store (BlobStore): The blob store, None to store everything in the database.
+    """
+    global _blob_store, _blob_store_loaded
+    with _blob_store_lock:
+        _blob_store = store
+        _blob_store_loaded = True
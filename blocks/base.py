@@ -1,6 +1,7 @@
+import asyncio
 import contextvars
 from abc import abstractmethod
-from typing import Any, Callable
+from typing import Any, Callable, List, Optional
 
 
 class BaseBlock(Callable):
@@ -13,6 +14,10 @@ class BaseBlock(Callable):
     # the global context for all blocks
     _ctx = contextvars.ContextVar("context")
 
+    # the callback receiving the tokens of the output of the running node, which is
+    # only set when the output is streamed (see Graph.run)
+    _token_callback = contextvars.ContextVar("token_callback", default=None)
+
     def __init__(self):
         pass
 
@@ -20,6 +25,40 @@ class BaseBlock(Callable):
     def context(self) -> dict:
         return self._ctx.get({})
 
+    @property
+    def token_callback(self) -> Optional[Callable[[str], None]]:
+        """
+        The callback to pass the tokens of the output to as they're generated, or
+        None if the output of the running node is not streamed. Blocks able to
+        generate their output incrementally (the LLM blocks for example) should
+        stream it when it's set, and still return the full output.
+        """
+        return self._token_callback.get()
+
+    async def acall(self, **kwargs) -> Any:
+        """
+        The async version of __call__, which is used when the graph is run on an
+        event loop. By default the __call__ method is offloaded to a thread (with
+        the current context copied), blocks doing IO should override it with a
+        native async implementation.
+        """
+        return await asyncio.to_thread(self, **kwargs)
+
+    def call_batch(self, batch: List[dict]) -> List[Any]:
+        """
+        Calls the block over a batch of parameters, it's used when the graph is run
+        over a batch of inputs (see Graph.run_batch). By default the block is called
+        once per item, blocks able to process many items at once (the LLM blocks for
+        example) should override it.
+
+        Args:
+            batch (List[dict]): The keyword arguments of every call.
+
+        Returns:
+            List[Any]: The outputs, in the order of the batch.
+        """
+        return [self(**kwargs) for kwargs in batch]
+
     @property
     def is_input(self) -> bool:
         return False
@@ -34,14 +73,28 @@ class InputBlock(BaseBlock):
     An abstract class for input block. Input block is a special block for the DAG:
     there should be exactly one input block in the DAG. It's the entry point of the
     graph.
+
+    The input of the graph is passed through the context of the current run, so the
+    same block can serve many runs concurrently. The input method declares the type
+    of the graph input and converts it into the output of the block.
     """
 
+    # the input of the current graph run
+    _input = contextvars.ContextVar("input")
+
     @property
     def is_input(self) -> bool:
         return True
 
+    @property
+    def inputs(self) -> Any:
+        return self._input.get(None)
+
     @abstractmethod
-    def input(self, inputs: Any) -> None: ...
+    def input(self, inputs: Any) -> Any: ...
+
+    async def acall(self, **kwargs) -> Any:
+        return self(**kwargs)
 
 
 class OutputBlock(BaseBlock):
@@ -49,8 +102,17 @@ class OutputBlock(BaseBlock):
     An abstract class for output block. Output block is a special block for the DAG:
     there should be exactly one output block in the DAG. It's the exit point of the
     graph.
+
+    An output block passing the value of a port through as the graph output sets
+    stream_port to it, so the tokens streamed by the node feeding the port are
+    streamed as the graph output.
     """
 
+    stream_port: Optional[str] = None
+
     @property
     def is_output(self):
         return True
+
+    async def acall(self, **kwargs) -> Any:
+        return self(**kwargs)
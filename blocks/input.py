@@ -11,11 +11,11 @@ class TextInput(InputBlock):
     A input block that accepts a text as the DAG input.
     """
 
-    def input(self, text: str):
-        self.text = text
+    def input(self, text: str) -> str:
+        return text
 
     def __call__(self) -> str:
-        return self.text
+        return self.input(self.inputs)
 
 
 @block(name="List_Input", kind="input & output")
@@ -24,11 +24,11 @@ class ListInput(InputBlock):
     A input block that accpets a list of texts as the DAG input.
     """
 
-    def input(self, messages: list):
-        self.messages = messages
+    def input(self, messages: list) -> list:
+        return messages
 
     def __call__(self) -> list:
-        return self.messages
+        return self.input(self.inputs)
 
 
 @block(name="Dict_Input", kind="input & output")
@@ -38,8 +38,8 @@ class DictInput(InputBlock):
     as the DAG input.
     """
 
-    def input(self, messages: dict):
-        self.messages = messages
+    def input(self, messages: dict) -> dict:
+        return messages
 
     def __call__(self) -> dict:
-        return self.messages
+        return self.input(self.inputs)
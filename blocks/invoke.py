@@ -1,15 +1,17 @@
+import contextvars
 import functools
+import hashlib
 import json
-import threading
 import time
 import uuid
+from concurrent.futures import Future
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Union
 
 from environs import Env
-from sqlalchemy import create_engine
 
-from database import Database
+from cache import LRUCache
+from database import Database, Lease, get_engine
 from exceptions import (
     ApplicationInputTypeMismatch,
     ApplicationNotFound,
@@ -18,13 +20,18 @@ from exceptions import (
     InteractionNotFound,
     NoActiveVersion,
     NodeConstructError,
+    NodeException,
     VersionnNotFound,
     register_exception_handlers,
 )
-from model import Interaction
+from executor import InvokeExecutor
+from model import Application, ApplicationVersion, Interaction, InteractionStatus
+from notification import CompletionRegistry
 from observability import langfuse, span, trace
+from recorder import InteractionRecorder, PersistencePolicy
 from resolver import Resolver, block
 from scheduler import Edge, Graph
+from settings import EnvSetting
 
 from .base import BaseBlock
 
@@ -47,11 +54,64 @@ class AsyncInvoker:
         result = interaction.output
         # sleep some time here
     ```
+
+    Or wait for the interaction to complete:
+
+    ```
+    interaction = invoker.wait(interaction_id, timeout=300)
+    ```
     """
 
-    def __init__(self, database: Database):
+    # the constructed graphs shared by all invokers of the process,
+    # keyed by (version id, configuration digest)
+    graph_cache = EnvSetting(
+        lambda env: LRUCache(maxsize=env.int("GRAPH_CACHE_SIZE", 128))
+    )
+
+    # the workers running interactions, shared by all invokers of the process
+    executor = EnvSetting(
+        lambda env: InvokeExecutor(
+            max_workers=env.int("INVOKER_WORKERS", 32),
+            max_queue_size=env.int("INVOKER_QUEUE_SIZE", 1024),
+            max_app_concurrency=env.int("INVOKER_APP_CONCURRENCY", 0),
+        )
+    )
+
+    # the minimum seconds between two writes of the node outputs of an interaction
+    flush_interval = EnvSetting(
+        lambda env: env.float("INTERACTION_FLUSH_INTERVAL", 0.5)
+    )
+
+    # the persistence policy of the applications and versions without their own
+    persistence_policy = EnvSetting(
+        lambda env: PersistencePolicy.validate(
+            env.str("INTERACTION_PERSISTENCE", PersistencePolicy.ALL)
+        )
+    )
+
+    # whether the applications invoked by Invoke blocks run inline in their parent
+    inline_nested = EnvSetting(lambda env: env.bool("INVOKE_INLINE", False))
+
+    # notifies the waiters when the interactions run in this process complete
+    completions = CompletionRegistry()
+
+    # the invoker running the current interaction
+    _current = contextvars.ContextVar("invoker", default=None)
+
+    def __init__(self, database: Database, max_workers: int = 1, mode: str = "thread"):
+        """
+        Args:
+            database (Database): The database to store interactions.
+            max_workers (int): The maximum number of graph nodes running concurrently
+                in one interaction, nodes are run one after another if it is 1.
+            mode (str): How the interactions are run, "thread" runs them on the
+                worker threads of this process, "queue" only queues them in the
+                database for the standalone workers (see worker.py).
+        """
         self.resolver = Resolver()
         self.database = database
+        self.max_workers = max_workers
+        self.mode = mode
 
     def construct_graph_node(self, config: dict) -> BaseBlock:
         """
@@ -125,26 +185,80 @@ class AsyncInvoker:
             nodes[node.get("id")] = self.construct_graph_node(node)
         return Graph(nodes, edges, skip_validation)
 
-    def invoke(
+    def get_graph(self, version: ApplicationVersion) -> Graph:
+        """
+        Get the ready-to-run graph of a version. The constructed graph is cached, so
+        the blocks (and the clients they hold) are reused by later invocations.
+
+        Args:
+            version (ApplicationVersion): The version to get graph for.
+
+        Returns:
+            Graph: The graph constructed from the version configuration.
+        """
+        key = (version.id, configuration_digest(version.configuration))
+        graph = self.graph_cache.get(key)
+        if graph is None:
+            graph = self.initialize_graph(version.configuration)
+            self.graph_cache.put(key, graph)
+        return graph
+
+    @classmethod
+    def invalidate_graph(cls, version_id: str):
+        """
+        Remove the cached graphs of a version, it should be called when the version
+        is updated or deleted.
+
+        Args:
+            version_id (str): The ID of the version.
+        """
+        cls.graph_cache.invalidate(lambda key: key[0] == version_id)
+
+    def get_persistence_policy(
+        self, app: Application, version: ApplicationVersion
+    ) -> str:
+        """
+        Returns the persistence policy of a version, see PersistencePolicy.
+
+        Args:
+            app (Application): The application of the version.
+            version (ApplicationVersion): The version.
+
+        Returns:
+            str: The persistence policy.
+        """
+        if version.persistence_policy:
+            return version.persistence_policy
+        return app.persistence_policy or self.persistence_policy
+
+    def prepare(
         self,
         user: str,
         app_id: str,
         input: Union[str, dict, list],
         version_id: Optional[str] = None,
         session_id: Optional[str] = None,
-    ) -> str:
+        batch_id: Optional[str] = None,
+        batch_index: Optional[int] = None,
+    ) -> Tuple[Application, ApplicationVersion, Graph, Interaction]:
         """
-        Invoke the specified application with the given input.
+        Look up the application and the graph to invoke, and check the input against
+        the graph.
 
         Args:
-            input (Union[str, dict, list]): The input data for the application,
-                which can be a string, dictionary, or list.
+            user (str): The user who invokes the application.
             app_id (str): The ID of the application to invoke.
+            input (Union[str, dict, list]): The input data for the application.
             version_id (str): The version to invoke, by default the active_version of
                 the application will be used.
+            session_id (str): The session the interaction belongs to.
+            batch_id (str): The batch run the interaction belongs to.
+            batch_index (int): The position of the input in the batch run.
 
         Returns:
-            str: The ID of the interaction created for this invocation.
+            Tuple[Application, ApplicationVersion, Graph, Interaction]: The
+                application, the version, its graph and the interaction to be
+                created.
         """
         app = self.database.get_application(app_id)
         if not app:
@@ -156,30 +270,265 @@ class AsyncInvoker:
         version = self.database.get_version(version_id)
         if not version:
             raise VersionnNotFound(version_id)
-        graph = self.initialize_graph(version.configuration)
+        graph = self.get_graph(version)
         if not isinstance(input, graph.input_type()):
             raise ApplicationInputTypeMismatch(graph.input_type(), type(input))
 
-        _id = str(uuid.uuid4())
         created_at = datetime.utcnow()
-        self.database.create_interaction(
-            Interaction(
-                id=_id,
-                user=user,
-                app_id=app_id,
-                version_id=version_id,
-                created_at=created_at,
-                updated_at=created_at,
-                output=None,
-                data=None,
-                error=None,
-            )
+        interaction = Interaction(
+            id=str(uuid.uuid4()),
+            user=user,
+            app_id=app_id,
+            version_id=version_id,
+            created_at=created_at,
+            updated_at=created_at,
+            output=None,
+            data=None,
+            error=None,
+            input=input,
+            session_id=session_id,
+            status=InteractionStatus.RUNNING,
+            batch_id=batch_id,
+            batch_index=batch_index,
+        )
+        return app, version, graph, interaction
+
+    def invoke(
+        self,
+        user: str,
+        app_id: str,
+        input: Union[str, dict, list],
+        version_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        stream: bool = False,
+        future: Optional[Future] = None,
+        batch_id: Optional[str] = None,
+        batch_index: Optional[int] = None,
+    ) -> str:
+        """
+        Invoke the specified application with the given input.
+
+        Args:
+            input (Union[str, dict, list]): The input data for the application,
+                which can be a string, dictionary, or list.
+            app_id (str): The ID of the application to invoke.
+            version_id (str): The version to invoke, by default the active_version of
+                the application will be used.
+            stream (bool): Whether to stream the tokens of the output as they're
+                generated, see InteractionRecorder.token. The streamed interactions
+                are always run in this process, so the tokens can be sent by it.
+            future (Future): The future resolved with the output (or an
+                InteractionError) as soon as the graph finishes, before the output is
+                recorded. The interaction is run in this process if it's given.
+            batch_id (str): The batch run the interaction belongs to.
+            batch_index (int): The position of the input in the batch run.
+
+        Returns:
+            str: The ID of the interaction created for this invocation.
+        """
+        app, version, graph, interaction = self.prepare(
+            user,
+            app_id,
+            input,
+            version_id=version_id,
+            session_id=session_id,
+            batch_id=batch_id,
+            batch_index=batch_index,
+        )
+        # the attributes are expired once the interaction is created
+        _id = interaction.id
+
+        # in queue mode the interaction is run by the standalone workers, except the
+        # nested ones, which are run in process to keep the workers from waiting
+        # for each other, and the ones the caller waits for in process
+        in_process = InvokeExecutor.in_task() or stream or future is not None
+        if self.mode == "queue" and not in_process:
+            interaction.status = InteractionStatus.PENDING
+            self.database.create_interaction(interaction)
+            return _id
+
+        # reserve a worker before creating the interaction, so rejected
+        # invocations leave nothing behind. It's created before the task is
+        # submitted, so the interaction of a run the caller stops waiting for
+        # (see the future) can already be polled
+        slot = self.executor.reserve(app_id)
+        try:
+            self.database.create_interaction(interaction)
+        except Exception:
+            slot.release()
+            raise
+        slot.submit(
+            self.execute,
+            app=app,
+            interaction_id=_id,
+            version=version,
+            graph=graph,
+            user=user,
+            input=input,
+            session_id=session_id,
+            stream=stream,
+            future=future,
+        )
+
+        return _id
+
+    def record_failure(
+        self,
+        user: str,
+        app_id: str,
+        input: Union[str, dict, list],
+        error: dict,
+        version_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        batch_id: Optional[str] = None,
+        batch_index: Optional[int] = None,
+    ) -> str:
+        """
+        Record a failed interaction for an invocation rejected before it's run, e.g.
+        the input of a batch item doesn't match the graph, so it's listed with the
+        interactions which were run.
+
+        Args:
+            user (str): The user who invokes the application.
+            app_id (str): The ID of the application to invoke.
+            input (Union[str, dict, list]): The input data for the application.
+            error (dict): The error of the interaction, with status_code and content.
+            version_id (str): The version to invoke, by default the active_version of
+                the application will be used.
+            session_id (str): The session the interaction belongs to.
+            batch_id (str): The batch run the interaction belongs to.
+            batch_index (int): The position of the input in the batch run.
+
+        Returns:
+            str: The ID of the interaction recorded.
+        """
+        if not version_id:
+            app = self.database.get_application(app_id)
+            version_id = (app.active_version if app else None) or ""
+        created_at = datetime.utcnow()
+        interaction = Interaction(
+            id=str(uuid.uuid4()),
+            user=user,
+            app_id=app_id,
+            version_id=version_id,
+            created_at=created_at,
+            updated_at=created_at,
+            error=error,
+            input=input,
+            session_id=session_id,
+            status=InteractionStatus.FAILED,
+            batch_id=batch_id,
+            batch_index=batch_index,
+        )
+        _id = interaction.id
+        self.database.create_interaction(interaction)
+        return _id
+
+    def invoke_inline(
+        self,
+        user: str,
+        app_id: str,
+        input: Union[str, dict, list],
+        version_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Invoke the specified application in the calling thread, and return its output.
+        The interaction is recorded as the one created by invoke, but the run skips
+        the worker threads and the polling, it's used to run nested applications
+        inside the run of their parent.
+
+        Args:
+            user (str): The user who invokes the application.
+            app_id (str): The ID of the application to invoke.
+            input (Union[str, dict, list]): The input data for the application.
+            version_id (str): The version to invoke, by default the active_version of
+                the application will be used.
+            session_id (str): The session the interaction belongs to.
+
+        Returns:
+            Optional[str]: The output of the application.
+
+        Raises:
+            InteractionError: If the run of the application failed.
+        """
+        app, version, graph, interaction = self.prepare(
+            user, app_id, input, version_id=version_id, session_id=session_id
+        )
+        # the attributes are expired once the interaction is created
+        _id = interaction.id
+        self.database.create_interaction(interaction)
+        # run in a copied context, so the child does not leak its context variables
+        # to the parent
+        return contextvars.copy_context().run(
+            self.execute,
+            app=app,
+            interaction_id=_id,
+            version=version,
+            graph=graph,
+            user=user,
+            input=input,
+            session_id=session_id,
+            raise_error=True,
         )
 
+    def execute(
+        self,
+        app: Application,
+        interaction_id: str,
+        version: ApplicationVersion,
+        graph: Graph,
+        user: str,
+        input: Union[str, dict, list],
+        session_id: Optional[str] = None,
+        raise_error: bool = False,
+        stream: bool = False,
+        future: Optional[Future] = None,
+        lease: Optional[Lease] = None,
+    ) -> Optional[str]:
+        """
+        Run the graph for a created interaction, and record the node data, the output
+        or the error to the interaction. The run is traced by langfuse if the
+        application has configured it.
+
+        Args:
+            app (Application): The application being invoked.
+            interaction_id (str): The ID of the interaction.
+            version (ApplicationVersion): The version being invoked.
+            graph (Graph): The graph of the version.
+            user (str): The user who invoked the application.
+            input (Union[str, dict, list]): The input data for the application.
+            session_id (str): The session the interaction belongs to.
+            raise_error (bool): Whether to raise an InteractionError after the error
+                is recorded.
+            stream (bool): Whether to publish the tokens streamed by the node feeding
+                the output.
+            future (Future): The future to resolve with the output (or an
+                InteractionError) before the output is recorded.
+            lease (Lease): The lease of the worker running a queued interaction, the
+                run is aborted without recording anything once it's lost.
+
+        Returns:
+            Optional[str]: The output of the graph, or None if it failed.
+        """
+        _id = interaction_id
+        app_id, version_id = app.id, version.id
+
         @trace(id=_id, name=app.name, user_id=user, session_id=session_id)
         def async_task(input: Union[str, dict, list]) -> str:
+            token = self._current.set(self)
             h = AsyncExceptionHandler()
             register_exception_handlers(h)
+            recorder = InteractionRecorder(
+                self.database,
+                _id,
+                flush_interval=self.flush_interval,
+                persisted_nodes=PersistencePolicy.persisted_nodes(
+                    self.get_persistence_policy(app, version), graph.output_node()
+                ),
+                lease=lease,
+            )
+
             try:
                 output = graph.run(
                     input,
@@ -190,26 +539,32 @@ class AsyncInvoker:
                         "user": user,
                         "session_id": session_id,
                     },
-                    node_callback=lambda *args: self.database.update_interaction(
-                        _id,
-                        {
-                            "data": graph.data,
-                        },
-                    ),
+                    node_callback=recorder.record,
+                    max_workers=self.max_workers,
+                    node_start_callback=recorder.start,
+                    token_callback=recorder.token if stream else None,
+                )
+                if future is not None:
+                    future.set_result(output)
+                recorder.close(
+                    {"output": output, "status": InteractionStatus.SUCCEEDED}
                 )
-                self.database.update_interaction(_id, {"output": output})
                 return output
             except Exception as e:
+                if isinstance(e, NodeException):
+                    recorder.fail(e.node_id)
                 r = h.render(e)
-                self.database.update_interaction(
-                    _id,
-                    {
-                        "error": {
-                            "status_code": r.status_code,
-                            "content": json.loads(r.body),
-                        },
-                    },
-                )
+                error = {
+                    "status_code": r.status_code,
+                    "content": json.loads(r.body),
+                }
+                if future is not None and not future.done():
+                    future.set_exception(InteractionError(error))
+                recorder.close({"error": error, "status": InteractionStatus.FAILED})
+                if raise_error:
+                    raise InteractionError(error) from e
+            finally:
+                self._current.reset(token)
 
         task = async_task
         if app.langfuse_public_key and app.langfuse_secret_key:
@@ -217,9 +572,23 @@ class AsyncInvoker:
                 public_key=app.langfuse_public_key,
                 secret_key=app.langfuse_secret_key,
             )(async_task)
-        threading.Thread(target=task, kwargs={"input": input}).start()
-
-        return _id
+        try:
+            return task(input=input)
+        except Exception as e:
+            # failed outside the graph, to create the recorder for example
+            if future is not None and not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            self.completions.notify(_id)
+
+    @classmethod
+    def current(cls) -> Optional["AsyncInvoker"]:
+        """
+        Returns the invoker running the current interaction, or None if it's called
+        outside an interaction.
+        """
+        return cls._current.get()
 
     def poll(self, interaction_id: str) -> Interaction:
         """
@@ -233,6 +602,62 @@ class AsyncInvoker:
         """
         return self.database.get_interaction(interaction_id)
 
+    def wait(
+        self,
+        interaction_id: str,
+        timeout: Optional[float] = 300,
+        interval: Optional[float] = 10,
+    ) -> Optional[Interaction]:
+        """
+        Wait for an interaction to complete. The waiter is woken up as soon as the
+        interaction completes if it is run in this process, otherwise (by the
+        standalone workers for example) the interaction is polled with a backoff
+        from 50 milliseconds up to the interval.
+
+        Args:
+            interaction_id (str): The ID of the interaction to wait for.
+            timeout (float): The maximum seconds to wait.
+            interval (float): The maximum seconds between two polls.
+
+        Returns:
+            Optional[Interaction]: The interaction, which is still running if the
+                wait timed out, or None if the interaction is not found.
+        """
+        deadline = time.monotonic() + timeout
+        delay = min(0.05, interval)
+        event = self.completions.watch(interaction_id)
+        try:
+            while True:
+                interaction = self.poll(interaction_id)
+                if interaction is None or interaction.status in (
+                    InteractionStatus.SUCCEEDED,
+                    InteractionStatus.FAILED,
+                ):
+                    return interaction
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return interaction
+                event.wait(min(delay, remaining))
+                delay = min(delay * 2, interval)
+        finally:
+            self.completions.unwatch(interaction_id)
+
+
+def configuration_digest(configuration: dict) -> str:
+    """
+    Returns a digest of the graph configuration, which changes whenever the
+    configuration changes.
+
+    Args:
+        configuration (dict): The configuration for the graph, including nodes and edges.
+
+    Returns:
+        str: The hex digest of the configuration.
+    """
+    return hashlib.sha256(
+        json.dumps(configuration, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
 
 class HashableDict(dict):
     """
@@ -266,25 +691,32 @@ def invoke(
     timeout: Optional[int] = 300,
     interval: Optional[int] = 10,
 ) -> str:
-    env = Env()
-    env.read_env()
+    # reuse the invoker (and its database) of the parent interaction
+    invoker = AsyncInvoker.current()
+    if invoker is None:
+        env = Env()
+        env.read_env()
+        invoker = AsyncInvoker(
+            Database(get_engine()),
+            max_workers=env.int("GRAPH_MAX_WORKERS", 1),
+            mode=env.str("INVOKER_MODE", "thread"),
+        )
 
-    db = Database(create_engine(env.str("DATABASE_URL")))
-    invoker = AsyncInvoker(db)
+    if AsyncInvoker.inline_nested:
+        return invoker.invoke_inline(
+            user=user, app_id=app_id, input=input, session_id=session_id
+        )
 
     interaction_id = invoker.invoke(
         user=user, app_id=app_id, input=input, session_id=session_id
     )
-    while timeout > 0:
-        interaction = invoker.poll(interaction_id)
-        if not interaction:
-            raise InteractionNotFound(interaction_id)
-        if interaction.error:
-            raise InteractionError(interaction.error)
-        if interaction.output:
-            return interaction.output
-        time.sleep(interval)
-        timeout -= interval
+    interaction = invoker.wait(interaction_id, timeout=timeout, interval=interval)
+    if not interaction:
+        raise InteractionNotFound(interaction_id)
+    if interaction.error:
+        raise InteractionError(interaction.error)
+    if interaction.status == InteractionStatus.SUCCEEDED:
+        return interaction.output
     raise TimeoutError(f"timeout on polling interaction {interaction_id}")
 
 
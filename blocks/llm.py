@@ -1,7 +1,10 @@
+from typing import Callable, List, Optional
+
 import langchain.chains
 from langchain.prompts.chat import BaseChatPromptTemplate
 from langchain_core.language_models import BaseChatModel, BaseLanguageModel
 from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompt_values import PromptValue
 from langchain_core.prompts import StringPromptTemplate
 
 from observability import span
@@ -10,6 +13,17 @@ from resolver import block
 from .base import BaseBlock
 
 
+def stream_whole(text: str, callback: Optional[Callable[[str], None]]) -> str:
+    """
+    Stream a completion as a single token, it's used when the output of an LLM block
+    is streamed but its model can't stream (it has no stream_prompt method, see
+    ChatOpenAIWrapper), so the output is still streamed once it's complete.
+    """
+    if callback is not None and text:
+        callback(text)
+    return text
+
+
 @block(name="LLM", kind="llm")
 class LLMChain(BaseBlock):
     """
@@ -23,7 +37,38 @@ class LLMChain(BaseBlock):
 
     @span(name="LLM Chain")
     def __call__(self, text: str, **kwargs) -> str:
-        return self.chain.predict(text=text, **kwargs)
+        callback = self.token_callback
+        if callback is not None and hasattr(self.chain.llm, "stream_prompt"):
+            prompt_value = self.chain.prep_prompts([dict(text=text, **kwargs)])[0][0]
+            return self.chain.llm.stream_prompt(prompt_value, callback)
+        return stream_whole(self.chain.predict(text=text, **kwargs), callback)
+
+    @span(name="LLM Chain")
+    async def acall(self, text: str, **kwargs) -> str:
+        callback = self.token_callback
+        if callback is not None and hasattr(self.chain.llm, "astream_prompt"):
+            prompt_value = self.chain.prep_prompts([dict(text=text, **kwargs)])[0][0]
+            return await self.chain.llm.astream_prompt(prompt_value, callback)
+        return stream_whole(await self.chain.apredict(text=text, **kwargs), callback)
+
+    @span(name="LLM Chain")
+    def call_batch(self, batch: List[dict]) -> List[str]:
+        """
+        Generate the completions of a batch of prompts with one generate_prompt
+        call, which sends them in one request for the completion models.
+
+        Args:
+            batch (List[dict]): The keyword arguments of every call.
+
+        Returns:
+            List[str]: The completions, in the order of the batch.
+        """
+        if hasattr(self.chain.prompt, "format_prompts"):
+            prompts, stop = self.chain.prompt.format_prompts(batch), None
+        else:
+            prompts, stop = self.chain.prep_prompts(batch)
+        response = self.chain.llm.generate_prompt(prompts, stop)
+        return [g[0].text for g in response.generations]
 
 
 @block(name="Chat_LLM", kind="llm")
@@ -36,6 +81,9 @@ class ChatLLMChain(BaseBlock):
         prompt_template_type: BaseChatPromptTemplate from LangChain which contains a system_template to use.
     """
 
+    # the maximum number of requests sent at the same time by call_batch
+    max_concurrency = 8
+
     def __init__(
         self, model: BaseChatModel, prompt_template_type: BaseChatPromptTemplate
     ):
@@ -47,6 +95,54 @@ class ChatLLMChain(BaseBlock):
         """
         Generate a response to a given message.
 
+        Args:
+            messages: A list of string messages.
+            **kwargs: Additional arguments to pass to the prompt template.
+        """
+        prompt_value = self.format_prompt(messages, **kwargs)
+        callback = self.token_callback
+        if callback is not None and hasattr(self.chat, "stream_prompt"):
+            return self.chat.stream_prompt(prompt_value, callback)
+        response = self.chat.generate_prompt([prompt_value])
+        return stream_whole(response.generations[0][0].text, callback)
+
+    @span(name="ChatLLM")
+    async def acall(self, messages: list, **kwargs) -> str:
+        """
+        The async version of __call__.
+        """
+        prompt_value = self.format_prompt(messages, **kwargs)
+        callback = self.token_callback
+        if callback is not None and hasattr(self.chat, "astream_prompt"):
+            return await self.chat.astream_prompt(prompt_value, callback)
+        response = await self.chat.agenerate_prompt([prompt_value])
+        return stream_whole(response.generations[0][0].text, callback)
+
+    @span(name="ChatLLM")
+    def call_batch(self, batch: List[dict]) -> List[str]:
+        """
+        Generate the responses of a batch of messages. The chat API takes a single
+        conversation per request, the requests are sent concurrently.
+
+        Args:
+            batch (List[dict]): The keyword arguments of every call.
+
+        Returns:
+            List[str]: The responses, in the order of the batch.
+        """
+        prompt_values = [self.format_prompt(**kwargs) for kwargs in batch]
+        # the models invoked return messages, except the plain language models
+        return [
+            getattr(m, "content", m)
+            for m in self.chat.batch(
+                prompt_values, config={"max_concurrency": self.max_concurrency}
+            )
+        ]
+
+    def format_prompt(self, messages: list, **kwargs) -> PromptValue:
+        """
+        Format the messages (alternately from human and AI) into a prompt value.
+
         Args:
             messages: A list of string messages.
             **kwargs: Additional arguments to pass to the prompt template.
@@ -59,6 +155,4 @@ class ChatLLMChain(BaseBlock):
                 ms.append(HumanMessage(content=m))
             else:
                 ms.append(AIMessage(content=m))
-        prompt_value = self.prompt.format_prompt(messages=ms, **kwargs)
-        response = self.chat.generate_prompt([prompt_value])
-        return response.generations[0][0].text
+        return self.prompt.format_prompt(messages=ms, **kwargs)
@@ -11,5 +11,7 @@ class TextOutput(OutputBlock):
     A output block that accept text as input, and use the same text as the DAG output.
     """
 
+    stream_port = "input"
+
     def __call__(self, input: str, **ignore) -> str:
         return input
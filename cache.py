@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache with an optional time-to-live for entries.
+
+    The number of hits, misses and evictions are counted, so the effectiveness of
+    the cache can be observed with the stats method.
+
+    Example:
+
+    ```
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    ```
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize (int): The maximum number of entries, the least recently used
+                entry is evicted when it's exceeded.
+            ttl (float): The seconds an entry stays valid, entries never expire if
+                it is None.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get the value of key, and mark it as the most recently used entry.
+
+        Args:
+            key (Hashable): The key to look up.
+            default (Any): The value returned if the key is missing or expired.
+
+        Returns:
+            Any: The cached value, or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None:
+                if time.monotonic() - entry[0] > self.ttl:
+                    del self._entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Put a value into the cache, the least recently used entries are evicted if
+        the cache is full.
+
+        Args:
+            key (Hashable): The key of the entry.
+            value (Any): The value of the entry.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        """
+        Remove an entry from the cache.
+
+        Args:
+            key (Hashable): The key of the entry.
+
+        Returns:
+            Any: The removed value, or None if the key is missing.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry is not None else None
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Remove all entries whose key matches the predicate.
+
+        Args:
+            predicate (callable): A function accepts a key and returns True if the
+                entry should be removed.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the size and the counters of the cache.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
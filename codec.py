@@ -0,0 +1,256 @@
+import json
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects import mysql
+from sqlalchemy.types import TypeDecorator
+
+from settings import EnvSetting
+
+"""
+The large values of interactions (the outputs of the nodes, and the output of the
+interaction) are stored with a codec chosen by INTERACTION_CODEC:
+
+- none: plain JSON (or plain text for the output), the default.
+- zlib: zlib-compressed JSON.
+- zstd: zstd-compressed msgpack, it requires zstandard and msgpack.
+- auto: zstd if zstandard and msgpack are installed, zlib otherwise.
+
+An encoded value starts with a NUL byte and the ID of its codec, which never starts
+a JSON document or a text output, so values written with any codec (including the
+plain values written before the codec is introduced) can be read whatever codec
+is configured. Reading a zstd value requires zstandard and msgpack, though.
+"""
+
+HEADER = b"\x00"
+
+
+class Codec(ABC):
+    """
+    Codec serializes a value to bytes and compresses them, and the reverse. The text
+    values are not serialized, their UTF-8 bytes are compressed directly.
+    """
+
+    id: int
+    name: str
+
+    @abstractmethod
+    def serialize(self, value: Any) -> bytes:
+        """
+        Serialize a JSON value to bytes.
+        """
+        pass
+
+    @abstractmethod
+    def deserialize(self, data: bytes) -> Any:
+        """
+        Deserialize the bytes returned by serialize.
+        """
+        pass
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress bytes.
+        """
+        pass
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Decompress the bytes returned by compress.
+        """
+        pass
+
+
+class ZlibCodec(Codec):
+    id = 1
+    name = "zlib"
+
+    def serialize(self, value: Any) -> bytes:
+        return json.dumps(value).encode()
+
+    def deserialize(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class ZstdCodec(Codec):
+    id = 2
+    name = "zstd"
+
+    def __init__(self):
+        import msgpack
+        import zstandard
+
+        self.msgpack = msgpack
+        self.zstandard = zstandard
+        # the (de)compressors are not thread-safe
+        self.local = threading.local()
+
+    def _local(self) -> threading.local:
+        if not hasattr(self.local, "compressor"):
+            self.local.compressor = self.zstandard.ZstdCompressor()
+            self.local.decompressor = self.zstandard.ZstdDecompressor()
+        return self.local
+
+    def serialize(self, value: Any) -> bytes:
+        return self.msgpack.packb(value, use_bin_type=True)
+
+    def deserialize(self, data: bytes) -> Any:
+        return self.msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._local().compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._local().decompressor.decompress(data)
+
+
+CODECS = {ZlibCodec.id: ZlibCodec, ZstdCodec.id: ZstdCodec}
+
+
+def create_codec(name: str) -> Optional[Codec]:
+    """
+    Create a codec by its name.
+
+    Args:
+        name (str): none, zlib, zstd or auto.
+
+    Returns:
+        Optional[Codec]: The codec, or None for plain values.
+    """
+    if name == "none":
+        return None
+    if name == "zlib":
+        return ZlibCodec()
+    if name == "zstd":
+        return ZstdCodec()
+    if name == "auto":
+        try:
+            return ZstdCodec()
+        except ImportError:
+            return ZlibCodec()
+    raise ValueError(f"unknown interaction codec {name}")
+
+
+class CodecStats:
+    """
+    CodecStats counts the bytes of the values before and after encoding.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def record(self, raw: int, stored: int):
+        with self._lock:
+            self.values += 1
+            self.raw_bytes += raw
+            self.stored_bytes += stored
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the counters, and the ratio of the plain size to the stored size.
+        """
+        with self._lock:
+            return {
+                "values": self.values,
+                "raw_bytes": self.raw_bytes,
+                "stored_bytes": self.stored_bytes,
+                "ratio": (
+                    self.raw_bytes / self.stored_bytes if self.stored_bytes else 1.0
+                ),
+            }
+
+
+class EncodedValue(TypeDecorator):
+    """
+    EncodedValue stores a JSON value (or a text if text is True) in a binary column
+    with the codec configured by INTERACTION_CODEC, and decodes it transparently.
+    The bytes written are counted in stats, whose raw_bytes is the size of the
+    values serialized before compression.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    codec = EnvSetting(lambda env: create_codec(env.str("INTERACTION_CODEC", "none")))
+    stats = CodecStats()
+    _codecs: Dict[int, Codec] = {}
+
+    def __init__(self, text: bool = False):
+        """
+        Args:
+            text (bool): Whether the value is a text, which is stored as UTF-8
+                instead of being serialized.
+        """
+        super().__init__()
+        self.text = text
+
+    def load_dialect_impl(self, dialect):
+        # BLOB of MySQL is limited to 64KB
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(mysql.LONGBLOB())
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value: Any, dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        codec = self.codec
+        if self.text:
+            raw = value.encode()
+        elif codec is None:
+            raw = json.dumps(value).encode()
+        else:
+            raw = codec.serialize(value)
+        data = (
+            raw if codec is None else HEADER + bytes([codec.id]) + codec.compress(raw)
+        )
+        self.stats.record(len(raw), len(data))
+        return data
+
+    def result_processor(self, dialect, coltype):
+        # the processor of LargeBinary fails on the rows written as text
+        def process(data):
+            return self.process_result_value(data, dialect)
+
+        return process
+
+    def process_result_value(self, data: Any, dialect) -> Any:
+        if data is None:
+            return None
+        if isinstance(data, str):
+            # written as text before the column is converted to binary
+            return data if self.text else json.loads(data)
+        data = bytes(data)
+        if data[:1] == HEADER:
+            codec = self.decoder(data[1])
+            raw = codec.decompress(data[2:])
+            return raw.decode() if self.text else codec.deserialize(raw)
+        return data.decode() if self.text else json.loads(data)
+
+    @classmethod
+    def decoder(cls, codec_id: int) -> Codec:
+        """
+        Returns the codec decoding the values written with a codec ID, whatever the
+        configured codec is.
+        """
+        if cls.codec is not None and cls.codec.id == codec_id:
+            return cls.codec
+        codec = cls._codecs.get(codec_id)
+        if codec is None:
+            if codec_id not in CODECS:
+                raise ValueError(f"unknown interaction codec ID {codec_id}")
+            codec = cls._codecs[codec_id] = CODECS[codec_id]()
+        return codec
@@ -1,16 +1,376 @@
-from typing import List
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
 
+from environs import Env
+from sqlalchemy import and_, create_engine, func, or_, select, update
+from sqlalchemy.engine import URL, make_url
 from sqlalchemy.engine.base import Engine
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-from model import Application, ApplicationVersion, Interaction
+from cache import LRUCache
+from exceptions import InteractionLeaseLost, InvalidCursor
+from model import (
+    Application,
+    ApplicationVersion,
+    Interaction,
+    InteractionNode,
+    InteractionStatus,
+)
+from settings import EnvSetting
+
+
+class TimedQueuePool(QueuePool):
+    """
+    TimedQueuePool is a QueuePool which measures how long the checkouts wait for a
+    connection, so an undersized pool can be told from a slow database.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += elapsed
+                self.wait_seconds_max = max(self.wait_seconds_max, elapsed)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the usage and the checkout waits of the pool.
+        """
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": self.overflow(),
+                "max_overflow": self._max_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """
+    TimedAsyncQueuePool is the TimedQueuePool for the engines of asyncio drivers.
+    """
+
+
+# the asyncio drivers of the backends, used by the async engine
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_engine_lock = threading.Lock()
+
+
+def engine_options(url: URL, env: Env, poolclass: type) -> dict:
+    """
+    Returns the options to create an engine, the pool is configured by:
+
+    - DATABASE_POOL_SIZE: the connections kept in the pool, 10 by default.
+    - DATABASE_MAX_OVERFLOW: the connections opened beyond the pool size, 20 by default.
+    - DATABASE_POOL_TIMEOUT: the seconds to wait for a connection, 30 by default.
+    - DATABASE_POOL_RECYCLE: the seconds a connection is reused, 3600 by default.
+    - DATABASE_POOL_PRE_PING: whether to test connections on checkout, true by default.
+
+    Args:
+        url (URL): The URL of the database.
+        env (Env): The environment to read the options from.
+        poolclass (type): The class of the pool.
+
+    Returns:
+        dict: The keyword arguments of create_engine.
+    """
+    options = {
+        "pool_pre_ping": env.bool("DATABASE_POOL_PRE_PING", True),
+        "pool_recycle": env.int("DATABASE_POOL_RECYCLE", 3600),
+    }
+    # sqlite picks its own pool depending on the database file
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            poolclass=poolclass,
+            pool_size=env.int("DATABASE_POOL_SIZE", 10),
+            max_overflow=env.int("DATABASE_MAX_OVERFLOW", 20),
+            pool_timeout=env.float("DATABASE_POOL_TIMEOUT", 30),
+        )
+    return options
+
+
+def get_engine() -> Engine:
+    """
+    Returns the engine shared by the process, it's created on the first call, so
+    every forked process creates its own. See engine_options for the configuration
+    of the pool.
+
+    Returns:
+        Engine: The sqlalchemy engine connecting DATABASE_URL.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                env = Env()
+                env.read_env()
+                url = make_url(env.str("DATABASE_URL"))
+                _engine = create_engine(url, **engine_options(url, env, TimedQueuePool))
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """
+    Returns the asyncio engine shared by the process, it connects DATABASE_URL with
+    the asyncio driver of the backend (aiomysql for MySQL, aiosqlite for SQLite).
+
+    Returns:
+        AsyncEngine: The sqlalchemy asyncio engine connecting DATABASE_URL.
+    """
+    global _async_engine
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                env = Env()
+                env.read_env()
+                url = make_url(env.str("DATABASE_URL"))
+                driver = ASYNC_DRIVERS.get(url.get_backend_name())
+                if driver is not None:
+                    url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+                _async_engine = create_async_engine(
+                    url, **engine_options(url, env, TimedAsyncQueuePool)
+                )
+    return _async_engine
+
+
+def engine_stats(engine: Engine) -> Dict[str, float]:
+    """
+    Returns the usage and the checkout waits of the pool of an engine.
+
+    Args:
+        engine (Engine): The engine, use the sync_engine of an asyncio engine.
+
+    Returns:
+        dict: The stats of the pool.
+    """
+    pool = engine.pool
+    if isinstance(pool, TimedQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}
+
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    """
+    Encode the position after a row in a list ordered by (created_at, id).
+
+    Args:
+        created_at (datetime): The created_at of the last row of the page.
+        id (str): The ID of the last row of the page.
+
+    Returns:
+        str: The opaque cursor.
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps([created_at.isoformat(), id]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Decode a cursor returned by encode_cursor.
+
+    Args:
+        cursor (str): The opaque cursor.
+
+    Returns:
+        Tuple[datetime, str]: The created_at and the ID of the row before the page.
+
+    Raises:
+        InvalidCursor: If the cursor can not be decoded.
+    """
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), str(id)
+    except Exception as e:
+        raise InvalidCursor(cursor) from e
+
+
+def paginate(query, model: type, limit: Optional[int], cursor: Optional[str]):
+    """
+    Order a query by (created_at, id) descending, and limit it to the page after
+    the cursor. The keyset (instead of an offset) lets the database seek to the
+    page with an index on (..., created_at, id), however deep the page is.
+
+    Args:
+        query: The sqlalchemy query or select.
+        model (type): The model being listed, it must have created_at and id.
+        limit (int): The maximum number of rows, no limit if it is None.
+        cursor (str): The cursor returned with the previous page, None for the first page.
+
+    Returns:
+        The query of the page.
+    """
+    if cursor is not None:
+        created_at, id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id < id),
+            )
+        )
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def next_cursor(rows: list, limit: Optional[int]) -> Optional[str]:
+    """
+    Returns the cursor of the page after rows, or None if rows is the last page.
+
+    Args:
+        rows (list): The rows of a page returned by a query paginated with limit.
+        limit (int): The limit of the page.
+
+    Returns:
+        Optional[str]: The cursor of the next page.
+    """
+    if limit is None or len(rows) < limit or not rows:
+        return None
+    return encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+# the columns listed, the large ones are only loaded with the object itself
+VERSION_LIST_COLUMNS = (
+    ApplicationVersion.id,
+    ApplicationVersion.name,
+    ApplicationVersion.user,
+    ApplicationVersion.app_id,
+    ApplicationVersion.created_at,
+    ApplicationVersion.updated_at,
+    ApplicationVersion.persistence_policy,
+)
+INTERACTION_LIST_COLUMNS = (
+    Interaction.id,
+    Interaction.user,
+    Interaction.app_id,
+    Interaction.version_id,
+    Interaction.created_at,
+    Interaction.updated_at,
+    Interaction.output,
+    Interaction.session_id,
+    Interaction.status,
+)
+
+BATCH_RESULT_COLUMNS = (
+    Interaction.id,
+    Interaction.created_at,
+    Interaction.output,
+    Interaction.error,
+    Interaction.status,
+    Interaction.batch_index,
+)
+
+
+class Lease:
+    """
+    Lease is the claim of a worker on a queued interaction, for one attempt of it.
+    The writes of the run are fenced by it, so a worker whose interaction has been
+    requeued can't overwrite the next attempt.
+    """
+
+    def __init__(self, worker_id: str, attempts: int):
+        """
+        Args:
+            worker_id (str): The ID of the worker which claimed the interaction.
+            attempts (int): The attempt of the claim.
+        """
+        self.worker_id = worker_id
+        self.attempts = attempts
+        # set once the interaction is found to be requeued or failed
+        self.lost = threading.Event()
 
 
 class Database:
     """
     The class Database contains a series of methods for interacting with a database.
+
+    The applications and versions looked up by get_application and get_version are
+    cached by the process for DATABASE_CACHE_TTL seconds (60 by default), and
+    invalidated when they are updated through Database or AsyncDatabase. To
+    invalidate the caches of other processes, register a hook which broadcasts the
+    invalidation, and call invalidate with broadcast=False when it's received:
+
+    ```
+    Database.invalidation_hooks.append(lambda kind, key: publish(kind, key))
+    on_message(lambda kind, key: Database.invalidate(kind, key, broadcast=False))
+    ```
     """
 
+    # the applications and versions looked up by the process, keyed by id
+    application_cache = EnvSetting(
+        lambda env: LRUCache(
+            maxsize=env.int("APPLICATION_CACHE_SIZE", 1024),
+            ttl=env.float("DATABASE_CACHE_TTL", 60),
+        )
+    )
+    version_cache = EnvSetting(
+        lambda env: LRUCache(
+            maxsize=env.int("VERSION_CACHE_SIZE", 1024),
+            ttl=env.float("DATABASE_CACHE_TTL", 60),
+        )
+    )
+
+    # called with (kind, key) whenever a cached object is invalidated by the process
+    invalidation_hooks: List[Callable[[str, str], None]] = []
+
+    @classmethod
+    def invalidate(cls, kind: str, key: str, broadcast: bool = True):
+        """
+        Remove an object from the caches.
+
+        Args:
+            kind (str): "application" or "version".
+            key (str): The ID of the object.
+            broadcast (bool): Whether to call the invalidation hooks.
+        """
+        if kind == "application":
+            cls.application_cache.pop(key)
+        elif kind == "version":
+            cls.version_cache.pop(key)
+        if broadcast:
+            for hook in cls.invalidation_hooks:
+                try:
+                    hook(kind, key)
+                except Exception:
+                    logging.exception(
+                        f"failed to broadcast invalidation of {kind} {key}"
+                    )
+
     def __init__(self, engine: Engine):
         """
         Args:
@@ -18,20 +378,26 @@ class Database:
         """
         self.engine = engine
 
-    def list_applications(self) -> List[Application]:
+    def list_applications(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> List[Application]:
         """
-        Retrieve a list of non-deleted applications from the database.
+        Retrieve a list of non-deleted applications from the database, the latest first.
+
+        Args:
+            limit (int): The maximum number of applications, no limit if it is None.
+            cursor (str): The cursor of the page, see next_cursor.
 
         Returns:
             List[Application]: A list of Application objects.
         """
         with Session(self.engine) as session:
-            return (
-                session.query(Application)
-                .filter(Application.deleted_at == None)
-                .order_by(Application.created_at.desc())
-                .all()
-            )
+            return paginate(
+                session.query(Application).filter(Application.deleted_at == None),
+                Application,
+                limit,
+                cursor,
+            ).all()
 
     def create_application(self, app: Application):
         """
@@ -57,8 +423,14 @@ class Database:
         Returns:
             Application: The application object corresponding to the given ID, or None if not found.
         """
+        app = self.application_cache.get(app_id)
+        if app is not None:
+            return app
         with Session(self.engine) as session:
-            return session.query(Application).filter(Application.id == app_id).first()
+            app = session.query(Application).filter(Application.id == app_id).first()
+        if app is not None:
+            self.application_cache.put(app_id, app)
+        return app
 
     def get_interaction(self, interaction_id: str) -> Interaction:
         """
@@ -92,7 +464,9 @@ class Database:
             session.add(interaction)
             session.commit()
 
-    def update_interaction(self, interaction_id: str, attrs: dict):
+    def update_interaction(
+        self, interaction_id: str, attrs: dict, lease: Optional[Lease] = None
+    ):
         """
         Update an Interaction record in the database with the specified ID.
 
@@ -102,10 +476,15 @@ class Database:
                 The keys should correspond to the column names of the interactions
                 table in the database, and the values should be the new values for
                 those attributes.
+            lease (Lease): The lease the interaction is updated under, see
+                add_interaction_nodes.
 
         Returns:
             None
 
+        Raises:
+            InteractionLeaseLost: If the interaction is no longer held by the lease.
+
         Example usage:
         ```
         attrs = {
@@ -116,10 +495,428 @@ class Database:
         ```
         """
         with Session(self.engine) as session:
-            session.query(Interaction).filter(Interaction.id == interaction_id).update(
-                attrs
+            if lease is not None:
+                self._update_leased(session, interaction_id, attrs, lease)
+            else:
+                session.query(Interaction).filter(
+                    Interaction.id == interaction_id
+                ).update(attrs)
+            session.commit()
+
+    def add_interaction_nodes(
+        self,
+        interaction_id: str,
+        nodes: List[InteractionNode],
+        attrs: Optional[dict] = None,
+        lease: Optional[Lease] = None,
+    ):
+        """
+        Insert the finished nodes of an interaction, and update the other attributes
+        of the interaction in the same transaction.
+
+        If a lease is given, nothing is written unless the interaction is still
+        running with the worker and the attempt of the lease. The interaction is
+        updated before the nodes are inserted, so its row is locked against
+        requeue_interactions until the transaction ends.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+            nodes (List[InteractionNode]): The finished nodes.
+            attrs (dict): The attributes of the interaction to update.
+            lease (Lease): The lease of the worker running the interaction.
+
+        Raises:
+            InteractionLeaseLost: If the interaction is no longer held by the lease.
+        """
+        with Session(self.engine) as session:
+            if lease is not None:
+                self._update_leased(session, interaction_id, attrs, lease)
+            elif attrs:
+                session.query(Interaction).filter(
+                    Interaction.id == interaction_id
+                ).update(attrs)
+            session.add_all(nodes)
+            session.commit()
+
+    def _update_leased(
+        self,
+        session: Session,
+        interaction_id: str,
+        attrs: Optional[dict],
+        lease: Lease,
+    ):
+        # the write renews the heartbeat as well
+        updated = (
+            session.query(Interaction)
+            .filter(Interaction.id == interaction_id)
+            .filter(Interaction.worker_id == lease.worker_id)
+            .filter(Interaction.attempts == lease.attempts)
+            .filter(Interaction.status == InteractionStatus.RUNNING)
+            .update(
+                {**(attrs or {}), "heartbeat_at": datetime.utcnow()},
+                synchronize_session=False,
+            )
+        )
+        if updated == 0:
+            lease.lost.set()
+            raise InteractionLeaseLost(interaction_id)
+
+    def list_interaction_nodes(
+        self, interaction_id: str, node_ids: Optional[List[str]] = None
+    ) -> List[InteractionNode]:
+        """
+        Retrieve the finished nodes of an interaction.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+            node_ids (List[str]): Only retrieve these nodes if it's given.
+
+        Returns:
+            List[InteractionNode]: The finished nodes, in the order they finished.
+        """
+        with Session(self.engine) as session:
+            query = session.query(InteractionNode).filter(
+                InteractionNode.interaction_id == interaction_id
+            )
+            if node_ids is not None:
+                query = query.filter(InteractionNode.node_id.in_(node_ids))
+            return query.order_by(InteractionNode.finished_at).all()
+
+    def get_interaction_data(
+        self, interaction: Interaction, node_ids: Optional[List[str]] = None
+    ) -> Optional[dict]:
+        """
+        Assemble the data of an interaction, which maps the node ids to their outputs.
+
+        Args:
+            interaction (Interaction): The interaction.
+            node_ids (List[str]): Only include these nodes if it's given.
+
+        Returns:
+            Optional[dict]: The data of the interaction.
+        """
+        nodes = self.list_interaction_nodes(interaction.id, node_ids)
+        if nodes:
+            return {node.node_id: node.value for node in nodes}
+        # recorded before the nodes are stored in their own table
+        data = interaction.data
+        if data is not None and node_ids is not None:
+            data = {k: v for k, v in data.items() if k in node_ids}
+        return data
+
+    def list_retention_days(self) -> Dict[str, Optional[int]]:
+        """
+        Retrieve the retention of the interactions of every application, including
+        the deleted ones.
+
+        Returns:
+            Dict[str, Optional[int]]: The retention days keyed by application ID, None
+                if the application uses the default retention.
+        """
+        with Session(self.engine) as session:
+            return dict(session.query(Application.id, Application.retention_days).all())
+
+    def list_expired_interactions(
+        self, app_id: str, before: datetime, limit: int
+    ) -> List[Tuple[str, datetime]]:
+        """
+        Retrieve the keys of the oldest interactions of an application created before
+        a time. Only the index is read, see list_interactions_by_ids for the rows.
+
+        Args:
+            app_id (str): The ID of the application.
+            before (datetime): The interactions created before it are expired.
+            limit (int): The maximum number of interactions.
+
+        Returns:
+            List[Tuple[str, datetime]]: The id and created_at of the expired
+                interactions, the oldest first.
+        """
+        with Session(self.engine) as session:
+            return (
+                session.query(Interaction.id, Interaction.created_at)
+                .filter(Interaction.app_id == app_id)
+                .filter(Interaction.created_at < before)
+                .order_by(Interaction.created_at, Interaction.id)
+                .limit(limit)
+                .all()
+            )
+
+    def list_interactions_by_ids(self, interaction_ids: List[str]) -> List[Interaction]:
+        """
+        Retrieve the full rows of many interactions at once.
+
+        Args:
+            interaction_ids (List[str]): The IDs of the interactions.
+
+        Returns:
+            List[Interaction]: The interactions, the oldest first.
+        """
+        with Session(self.engine) as session:
+            return (
+                session.query(Interaction)
+                .filter(Interaction.id.in_(interaction_ids))
+                .order_by(Interaction.created_at, Interaction.id)
+                .all()
+            )
+
+    def list_nodes_of_interactions(
+        self, interaction_ids: List[str]
+    ) -> Dict[str, List[InteractionNode]]:
+        """
+        Retrieve the finished nodes of many interactions at once.
+
+        Args:
+            interaction_ids (List[str]): The IDs of the interactions.
+
+        Returns:
+            Dict[str, List[InteractionNode]]: The nodes keyed by interaction ID, in the
+                order they finished.
+        """
+        nodes = {}
+        with Session(self.engine) as session:
+            for node in (
+                session.query(InteractionNode)
+                .filter(InteractionNode.interaction_id.in_(interaction_ids))
+                .order_by(InteractionNode.finished_at)
+            ):
+                nodes.setdefault(node.interaction_id, []).append(node)
+        return nodes
+
+    def list_blob_keys_of_interactions(self, interaction_ids: List[str]) -> List[str]:
+        """
+        Retrieve the blob keys of the nodes of many interactions spilled to the blob
+        store, without reading the nodes.
+
+        Args:
+            interaction_ids (List[str]): The IDs of the interactions.
+
+        Returns:
+            List[str]: The blob keys.
+        """
+        with Session(self.engine) as session:
+            return [
+                key
+                for (key,) in session.query(InteractionNode.blob_key)
+                .filter(InteractionNode.interaction_id.in_(interaction_ids))
+                .filter(InteractionNode.blob_key.isnot(None))
+            ]
+
+    def delete_interactions(self, interaction_ids: List[str]) -> int:
+        """
+        Delete interactions and their nodes.
+
+        Args:
+            interaction_ids (List[str]): The IDs of the interactions.
+
+        Returns:
+            int: The number of deleted interactions.
+        """
+        if not interaction_ids:
+            return 0
+        with Session(self.engine) as session:
+            session.query(InteractionNode).filter(
+                InteractionNode.interaction_id.in_(interaction_ids)
+            ).delete(synchronize_session=False)
+            deleted = (
+                session.query(Interaction)
+                .filter(Interaction.id.in_(interaction_ids))
+                .delete(synchronize_session=False)
             )
             session.commit()
+            return deleted
+
+    def delete_orphan_interaction_nodes(self, limit: int) -> int:
+        """
+        Delete the nodes whose interaction no longer exists, for example because the
+        partition of the interaction has been dropped.
+
+        Args:
+            limit (int): The maximum number of interactions whose nodes are deleted.
+
+        Returns:
+            int: The number of interactions whose nodes are deleted.
+        """
+        with Session(self.engine) as session:
+            orphans = [
+                interaction_id
+                for interaction_id, in session.query(InteractionNode.interaction_id)
+                .outerjoin(
+                    Interaction, Interaction.id == InteractionNode.interaction_id
+                )
+                .filter(Interaction.id == None)
+                .distinct()
+                .limit(limit)
+            ]
+            if orphans:
+                session.query(InteractionNode).filter(
+                    InteractionNode.interaction_id.in_(orphans)
+                ).delete(synchronize_session=False)
+                session.commit()
+            return len(orphans)
+
+    def reencode_interactions(
+        self, limit: int, cursor: Optional[str] = None
+    ) -> Tuple[int, Optional[str]]:
+        """
+        Rewrite the output, the data and the nodes of a page of finished interactions
+        with the configured codec, the newest first.
+
+        Args:
+            limit (int): The maximum number of interactions rewritten.
+            cursor (str): The cursor returned by the previous call, None to start.
+
+        Returns:
+            Tuple[int, Optional[str]]: The number of interactions rewritten, and the
+                cursor of the next page, which is None after the last page.
+        """
+        with Session(self.engine) as session:
+            interactions = paginate(
+                session.query(Interaction).filter(
+                    or_(
+                        Interaction.status.in_(
+                            [InteractionStatus.SUCCEEDED, InteractionStatus.FAILED]
+                        ),
+                        # recorded before the status is introduced
+                        Interaction.status == None,
+                    )
+                ),
+                Interaction,
+                limit,
+                cursor,
+            ).all()
+            for interaction in interactions:
+                flag_modified(interaction, "output")
+                flag_modified(interaction, "data")
+            for node in session.query(InteractionNode).filter(
+                InteractionNode.interaction_id.in_([i.id for i in interactions])
+            ):
+                flag_modified(node, "value")
+            session.commit()
+            return len(interactions), next_cursor(interactions, limit)
+
+    def claim_interactions(self, worker_id: str, limit: int) -> List[Interaction]:
+        """
+        Claim pending interactions for a worker, the oldest first. The claimed
+        interactions are set to RUNNING with the worker's heartbeat.
+
+        Rows locked by other workers are skipped (SELECT ... FOR UPDATE SKIP LOCKED),
+        so workers on different nodes never claim the same interaction.
+
+        Args:
+            worker_id (str): The ID of the worker.
+            limit (int): The maximum number of interactions to claim.
+
+        Returns:
+            List[Interaction]: The claimed interactions.
+        """
+        with Session(self.engine, expire_on_commit=False) as session:
+            interactions = (
+                session.query(Interaction)
+                .filter(Interaction.status == InteractionStatus.PENDING)
+                .order_by(Interaction.created_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            now = datetime.utcnow()
+            for interaction in interactions:
+                interaction.status = InteractionStatus.RUNNING
+                interaction.worker_id = worker_id
+                interaction.heartbeat_at = now
+                interaction.attempts = (interaction.attempts or 0) + 1
+            session.commit()
+            return interactions
+
+    def heartbeat_interactions(
+        self, worker_id: str, interaction_ids: List[str]
+    ) -> List[str]:
+        """
+        Renew the heartbeat of the interactions a worker is running.
+
+        Args:
+            worker_id (str): The ID of the worker.
+            interaction_ids (List[str]): The IDs of the running interactions.
+
+        Returns:
+            List[str]: The IDs of the interactions no longer held by the worker,
+                which have been requeued or failed by another worker.
+        """
+        if not interaction_ids:
+            return []
+        with Session(self.engine) as session:
+            held = (
+                session.query(Interaction)
+                .filter(Interaction.id.in_(interaction_ids))
+                .filter(Interaction.worker_id == worker_id)
+                .filter(Interaction.status == InteractionStatus.RUNNING)
+            )
+            renewed = held.update(
+                {"heartbeat_at": datetime.utcnow()}, synchronize_session=False
+            )
+            lost = []
+            if renewed < len(set(interaction_ids)):
+                ids = {id for id, in held.with_entities(Interaction.id)}
+                lost = [id for id in interaction_ids if id not in ids]
+            session.commit()
+            return lost
+
+    def requeue_interactions(self, timeout: timedelta, max_attempts: int) -> int:
+        """
+        Requeue the interactions whose worker has stopped renewing the heartbeat.
+        Interactions which have been attempted max_attempts times are failed instead.
+
+        Args:
+            timeout (timedelta): How long a heartbeat stays valid.
+            max_attempts (int): The maximum number of attempts of an interaction.
+
+        Returns:
+            int: The number of requeued or failed interactions.
+        """
+        deadline = datetime.utcnow() - timeout
+        with Session(self.engine) as session:
+            stale = (
+                session.query(Interaction)
+                .filter(Interaction.status == InteractionStatus.RUNNING)
+                .filter(Interaction.worker_id != None)
+                .filter(Interaction.heartbeat_at < deadline)
+            )
+            failed = stale.filter(Interaction.attempts >= max_attempts).update(
+                {
+                    "status": InteractionStatus.FAILED,
+                    "error": {
+                        "status_code": 500,
+                        "content": {
+                            "code": "worker_lost",
+                            "message": f"interaction abandoned after {max_attempts} attempts",
+                        },
+                    },
+                },
+                synchronize_session=False,
+            )
+            requeued_ids = [
+                id
+                for id, in stale.filter(Interaction.attempts < max_attempts)
+                .with_entities(Interaction.id)
+                .with_for_update()
+            ]
+            if requeued_ids:
+                session.query(Interaction).filter(
+                    Interaction.id.in_(requeued_ids)
+                ).update(
+                    {
+                        "status": InteractionStatus.PENDING,
+                        "worker_id": None,
+                        "heartbeat_at": None,
+                        "data": None,
+                    },
+                    synchronize_session=False,
+                )
+                session.query(InteractionNode).filter(
+                    InteractionNode.interaction_id.in_(requeued_ids)
+                ).delete(synchronize_session=False)
+            session.commit()
+            return failed + len(requeued_ids)
 
     def update_application(self, app_id: str, attrs: dict):
         """
@@ -135,6 +932,7 @@ class Database:
         with Session(self.engine) as session:
             session.query(Application).filter(Application.id == app_id).update(attrs)
             session.commit()
+        self.invalidate("application", app_id)
 
     def update_version(self, version_id: str, attrs: dict):
         """
@@ -152,26 +950,64 @@ class Database:
                 ApplicationVersion.id == version_id
             ).update(attrs)
             session.commit()
+        self.invalidate("version", version_id)
 
-    def list_versions(self, app_id: str) -> List[ApplicationVersion]:
+    def list_versions(
+        self, app_id: str, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> List[ApplicationVersion]:
         """
-        Retrieve all non-deleted versions of an application by app_id.
+        Retrieve the non-deleted versions of an application by app_id, the latest first.
+        Only the columns in VERSION_LIST_COLUMNS are loaded.
 
         Args:
             app_id (str): The ID of the application to retrieve versions for.
+            limit (int): The maximum number of versions, no limit if it is None.
+            cursor (str): The cursor of the page, see next_cursor.
 
         Returns:
             List[ApplicationVersion]: A list of ApplicationVersion objects
                 representing the non-deleted versions.
         """
         with Session(self.engine) as session:
-            return (
+            return paginate(
                 session.query(ApplicationVersion)
+                .options(load_only(*VERSION_LIST_COLUMNS))
                 .filter(ApplicationVersion.app_id == app_id)
-                .filter(ApplicationVersion.deleted_at == None)
-                .order_by(ApplicationVersion.created_at.desc())
-                .all()
+                .filter(ApplicationVersion.deleted_at == None),
+                ApplicationVersion,
+                limit,
+                cursor,
+            ).all()
+
+    def list_interactions(
+        self,
+        app_id: str,
+        version_id: Optional[str] = None,
+        limit: Optional[int] = 20,
+        cursor: Optional[str] = None,
+    ) -> List[Interaction]:
+        """
+        Retrieve the interactions of an application, the latest first. Only the
+        columns in INTERACTION_LIST_COLUMNS are loaded.
+
+        Args:
+            app_id (str): The ID of the application.
+            version_id (str): Only retrieve the interactions of this version if it's given.
+            limit (int): The maximum number of interactions.
+            cursor (str): The cursor of the page, see next_cursor.
+
+        Returns:
+            List[Interaction]: The interactions of the page.
+        """
+        with Session(self.engine) as session:
+            query = (
+                session.query(Interaction)
+                .options(load_only(*INTERACTION_LIST_COLUMNS))
+                .filter(Interaction.app_id == app_id)
             )
+            if version_id is not None:
+                query = query.filter(Interaction.version_id == version_id)
+            return paginate(query, Interaction, limit, cursor).all()
 
     def get_version(self, version_id: str) -> ApplicationVersion:
         """
@@ -183,12 +1019,18 @@ class Database:
         Returns:
             ApplicationVersion: The application version object corresponding to the given ID.
         """
+        version = self.version_cache.get(version_id)
+        if version is not None:
+            return version
         with Session(self.engine) as session:
-            return (
+            version = (
                 session.query(ApplicationVersion)
                 .filter(ApplicationVersion.id == version_id)
                 .first()
             )
+        if version is not None:
+            self.version_cache.put(version_id, version)
+        return version
 
     def create_version(self, version: ApplicationVersion):
         """
@@ -217,3 +1059,317 @@ class Database:
                 ApplicationVersion.id == version_id
             ).update(attrs)
             session.commit()
+        self.invalidate("version", version_id)
+
+
+class AsyncDatabase:
+    """
+    AsyncDatabase is the asyncio counterpart of Database, for the API handlers to
+    query the database without occupying a thread.
+
+    Only the methods the API needs are provided, the interactions are still run
+    (and recorded) by the threads of AsyncInvoker with Database.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        """
+        Args:
+            engine (AsyncEngine): sqlalchemy asyncio engine.
+        """
+        self.engine = engine
+
+    def session(self) -> AsyncSession:
+        # the objects are returned after the session is closed, they can't be
+        # refreshed lazily without blocking
+        return AsyncSession(self.engine, expire_on_commit=False)
+
+    async def list_applications(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> List[Application]:
+        """
+        Retrieve a list of non-deleted applications from the database, the latest first.
+
+        Args:
+            limit (int): The maximum number of applications, no limit if it is None.
+            cursor (str): The cursor of the page, see next_cursor.
+
+        Returns:
+            List[Application]: A list of Application objects.
+        """
+        async with self.session() as session:
+            result = await session.execute(
+                paginate(
+                    select(Application).filter(Application.deleted_at == None),
+                    Application,
+                    limit,
+                    cursor,
+                )
+            )
+            return result.scalars().all()
+
+    async def create_application(self, app: Application):
+        """
+        Adds a new application to the database.
+
+        Args:
+            app (Application): The application object to be added.
+        """
+        async with self.session() as session:
+            session.add(app)
+            await session.commit()
+
+    async def get_application(self, app_id: str) -> Optional[Application]:
+        """
+        Retrieve an application by its ID.
+
+        Args:
+            app_id (str): The ID of the application to retrieve.
+
+        Returns:
+            Application: The application object corresponding to the given ID, or None if not found.
+        """
+        async with self.session() as session:
+            result = await session.execute(
+                select(Application).filter(Application.id == app_id)
+            )
+            return result.scalars().first()
+
+    async def update_application(self, app_id: str, attrs: dict):
+        """
+        Update an application in the database with the specified attributes.
+
+        Args:
+            app_id (str): The ID of the application to update.
+            attrs (dict): A dictionary containing the attributes to update.
+        """
+        async with self.session() as session:
+            await session.execute(
+                update(Application).filter(Application.id == app_id).values(attrs)
+            )
+            await session.commit()
+        Database.invalidate("application", app_id)
+
+    async def list_versions(
+        self, app_id: str, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> List[ApplicationVersion]:
+        """
+        Retrieve the non-deleted versions of an application by app_id, the latest first.
+        Only the columns in VERSION_LIST_COLUMNS are loaded.
+
+        Args:
+            app_id (str): The ID of the application to retrieve versions for.
+            limit (int): The maximum number of versions, no limit if it is None.
+            cursor (str): The cursor of the page, see next_cursor.
+
+        Returns:
+            List[ApplicationVersion]: A list of ApplicationVersion objects
+                representing the non-deleted versions.
+        """
+        async with self.session() as session:
+            result = await session.execute(
+                paginate(
+                    select(ApplicationVersion)
+                    .options(load_only(*VERSION_LIST_COLUMNS))
+                    .filter(ApplicationVersion.app_id == app_id)
+                    .filter(ApplicationVersion.deleted_at == None),
+                    ApplicationVersion,
+                    limit,
+                    cursor,
+                )
+            )
+            return result.scalars().all()
+
+    async def list_interactions(
+        self,
+        app_id: str,
+        version_id: Optional[str] = None,
+        limit: Optional[int] = 20,
+        cursor: Optional[str] = None,
+    ) -> List[Interaction]:
+        """
+        Retrieve the interactions of an application, the latest first. Only the
+        columns in INTERACTION_LIST_COLUMNS are loaded.
+
+        Args:
+            app_id (str): The ID of the application.
+            version_id (str): Only retrieve the interactions of this version if it's given.
+            limit (int): The maximum number of interactions.
+            cursor (str): The cursor of the page, see next_cursor.
+
+        Returns:
+            List[Interaction]: The interactions of the page.
+        """
+        query = (
+            select(Interaction)
+            .options(load_only(*INTERACTION_LIST_COLUMNS))
+            .filter(Interaction.app_id == app_id)
+        )
+        if version_id is not None:
+            query = query.filter(Interaction.version_id == version_id)
+        async with self.session() as session:
+            result = await session.execute(paginate(query, Interaction, limit, cursor))
+            return result.scalars().all()
+
+    async def list_batch_interactions(self, batch_id: str) -> List[Interaction]:
+        """
+        Retrieve the interactions of a batch run, by batch_index then the earliest
+        first, so the last interaction of an index is its latest run. Only the
+        columns in BATCH_RESULT_COLUMNS are loaded.
+
+        Args:
+            batch_id (str): The ID of the batch run.
+
+        Returns:
+            List[Interaction]: The interactions of the batch run.
+        """
+        async with self.session() as session:
+            result = await session.execute(
+                select(Interaction)
+                .options(load_only(*BATCH_RESULT_COLUMNS))
+                .filter(Interaction.batch_id == batch_id)
+                .order_by(Interaction.batch_index, Interaction.created_at)
+            )
+            return result.scalars().all()
+
+    async def get_version(self, version_id: str) -> Optional[ApplicationVersion]:
+        """
+        Retrieve an application version by its ID.
+
+        Args:
+            version_id (str): The ID of the application version to retrieve.
+
+        Returns:
+            ApplicationVersion: The application version object corresponding to the given ID.
+        """
+        async with self.session() as session:
+            result = await session.execute(
+                select(ApplicationVersion).filter(ApplicationVersion.id == version_id)
+            )
+            return result.scalars().first()
+
+    async def create_version(self, version: ApplicationVersion):
+        """
+        Create a new application version in the database.
+
+        Args:
+            version (ApplicationVersion): The application version object to be added.
+        """
+        async with self.session() as session:
+            session.add(version)
+            await session.commit()
+
+    async def update_version(self, version_id: str, attrs: dict):
+        """
+        Update the attributes of an application version in the database.
+
+        Args:
+            version_id (str): The ID of the version to update.
+            attrs (dict): A dictionary containing the attributes to update and their new values.
+        """
+        async with self.session() as session:
+            await session.execute(
+                update(ApplicationVersion)
+                .filter(ApplicationVersion.id == version_id)
+                .values(attrs)
+            )
+            await session.commit()
+        Database.invalidate("version", version_id)
+
+    async def get_interaction(self, interaction_id: str) -> Optional[Interaction]:
+        """
+        Retrieve an interaction from the database by its ID.
+
+        Args:
+            interaction_id (str): The ID of the interaction to retrieve.
+
+        Returns:
+            Interaction: The retrieved interaction object.
+        """
+        async with self.session() as session:
+            result = await session.execute(
+                select(Interaction).filter(Interaction.id == interaction_id)
+            )
+            return result.scalars().first()
+
+    async def get_interaction_revision(
+        self, interaction_id: str
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Retrieve a revision of an interaction, which changes whenever the interaction
+        or its nodes change, without loading the data of the interaction.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+
+        Returns:
+            Optional[Tuple[str, str]]: The revision and the status of the interaction,
+                None if the interaction is not found.
+        """
+        async with self.session() as session:
+            interaction = (
+                await session.execute(
+                    select(
+                        Interaction.status,
+                        Interaction.updated_at,
+                        Interaction.attempts,
+                    ).filter(Interaction.id == interaction_id)
+                )
+            ).first()
+            if interaction is None:
+                return None
+            count, finished_at = (
+                await session.execute(
+                    select(func.count(), func.max(InteractionNode.finished_at)).filter(
+                        InteractionNode.interaction_id == interaction_id
+                    )
+                )
+            ).one()
+        revision = hashlib.sha1(
+            f"{interaction.status}|{interaction.updated_at}|{interaction.attempts}"
+            f"|{count}|{finished_at}".encode()
+        ).hexdigest()
+        return revision, interaction.status
+
+    async def list_interaction_nodes(
+        self, interaction_id: str, node_ids: Optional[List[str]] = None
+    ) -> List[InteractionNode]:
+        """
+        Retrieve the finished nodes of an interaction.
+
+        Args:
+            interaction_id (str): The ID of the interaction.
+            node_ids (List[str]): Only retrieve these nodes if it's given.
+
+        Returns:
+            List[InteractionNode]: The finished nodes, in the order they finished.
+        """
+        query = select(InteractionNode).filter(
+            InteractionNode.interaction_id == interaction_id
+        )
+        if node_ids is not None:
+            query = query.filter(InteractionNode.node_id.in_(node_ids))
+        async with self.session() as session:
+            result = await session.execute(query.order_by(InteractionNode.finished_at))
+            return result.scalars().all()
+
+    async def get_interaction_data(
+        self, interaction: Interaction, node_ids: Optional[List[str]] = None
+    ) -> Optional[dict]:
+        """
+        Assemble the data of an interaction, which maps the node ids to their outputs.
+
+        Args:
+            interaction (Interaction): The interaction.
+            node_ids (List[str]): Only include these nodes if it's given.
+
+        Returns:
+            Optional[dict]: The data of the interaction.
+        """
+        nodes = await self.list_interaction_nodes(interaction.id, node_ids)
+        if nodes:
+            return {node.node_id: node.value for node in nodes}
+        # recorded before the nodes are stored in their own table
+        data = interaction.data
+        if data is not None and node_ids is not None:
+            data = {k: v for k, v in data.items() if k in node_ids}
+        return data
@@ -99,6 +99,20 @@ class InteractionNotFound(Exception):
         return f"interaction {self.interaction_id} not found"
 
 
+class InteractionNodeNotFound(Exception):
+    """
+    InteractionNodeNotFound indicates that the specified node of an interaction has
+    not finished, or its output is missing.
+    """
+
+    def __init__(self, interaction_id: str, node_id: str):
+        self.interaction_id = interaction_id
+        self.node_id = node_id
+
+    def __str__(self):
+        return f"node {self.node_id} of interaction {self.interaction_id} not found"
+
+
 class InteractionError(Exception):
     """
     InteractionError is used in invoke blocks.
@@ -131,6 +145,72 @@ class ApplicationInputTypeMismatch(Exception):
         return f"the application expect {self.exp} as input, got {self.got}"
 
 
+class ExecutorQueueFull(Exception):
+    """
+    ExecutorQueueFull indicates that too many interactions are waiting for a worker,
+    the new interaction is rejected.
+    """
+
+    def __init__(self, max_queue_size: int):
+        self.max_queue_size = max_queue_size
+
+    def __str__(self):
+        return f"too many interactions are waiting (queue size {self.max_queue_size}), try again later"
+
+
+class ApplicationConcurrencyExceeded(Exception):
+    """
+    ApplicationConcurrencyExceeded indicates that the application has reached its
+    limit of in-flight interactions, the new interaction is rejected.
+    """
+
+    def __init__(self, application_id: str, limit: int):
+        self.application_id = application_id
+        self.limit = limit
+
+    def __str__(self):
+        return f"application {self.application_id} has reached its limit of {self.limit} in-flight interactions"
+
+
+class InteractionLeaseLost(Exception):
+    """
+    InteractionLeaseLost indicates that a worker no longer holds the interaction it's
+    running, it has been requeued or failed because its heartbeat expired, so the
+    writes of the run are discarded.
+    """
+
+    def __init__(self, interaction_id: str):
+        self.interaction_id = interaction_id
+
+    def __str__(self):
+        return f"interaction {self.interaction_id} is no longer held by this worker"
+
+
+class InvalidCursor(Exception):
+    """
+    InvalidCursor indicates that the cursor of a paginated list can not be decoded.
+    """
+
+    def __init__(self, cursor: str):
+        self.cursor = cursor
+
+    def __str__(self):
+        return f"invalid cursor {self.cursor}"
+
+
+class InvalidPersistencePolicy(Exception):
+    """
+    InvalidPersistencePolicy indicates that the persistence policy of an application
+    or a version is not one of the supported ones.
+    """
+
+    def __init__(self, policy: str):
+        self.policy = policy
+
+    def __str__(self):
+        return f"invalid persistence policy {self.policy}, expect all, output_only, on_error or sampled:N"
+
+
 class EmbeddingError(Exception):
     def __init__(self, model_name: str, text: str, msg: str):
         self.model_name = model_name
@@ -194,6 +194,28 @@ def interaction_not_found_handler(request: Request, exc: Exception) -> JSONRespo
     )
 
 
+def interaction_node_not_found_handler(
+    request: Request, exc: Exception
+) -> JSONResponse:
+    """
+    Custom exception handler for interaction node not found.
+
+    Args:
+        request (Request): The incoming request object.
+        exc (Exception): The exception raised.
+
+    Returns:
+        JSONResponse: A JSON response with status code 404 and error details.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={
+            "code": "interaction_node_not_found",
+            "message": str(exc),
+        },
+    )
+
+
 def application_input_mismatch_handler(request, exc):
     """
     Custom exception handler for invalid application input type.
@@ -214,6 +236,91 @@ def application_input_mismatch_handler(request, exc):
     )
 
 
+def invalid_cursor_handler(request: Request, exc: Exception) -> JSONResponse:
+    """
+    Custom exception handler for the cursors of paginated lists which can not be decoded.
+
+    Args:
+        request (Request): The incoming request object.
+        exc (Exception): The exception raised.
+
+    Returns:
+        JSONResponse: A JSON response with status code 400 and error details.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={
+            "code": "invalid_cursor",
+            "message": str(exc),
+        },
+    )
+
+
+def invalid_persistence_policy_handler(
+    request: Request, exc: Exception
+) -> JSONResponse:
+    """
+    Custom exception handler for unsupported persistence policies.
+
+    Args:
+        request (Request): The incoming request object.
+        exc (Exception): The exception raised.
+
+    Returns:
+        JSONResponse: A JSON response with status code 400 and error details.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={
+            "code": "invalid_persistence_policy",
+            "message": str(exc),
+        },
+    )
+
+
+def executor_queue_full_handler(request: Request, exc: Exception) -> JSONResponse:
+    """
+    Custom exception handler for rejected interactions when the executor queue is full.
+
+    Args:
+        request (Request): The incoming request object.
+        exc (Exception): The exception raised.
+
+    Returns:
+        JSONResponse: A JSON response with status code 503 and error details.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "code": "executor_queue_full",
+            "message": str(exc),
+        },
+    )
+
+
+def application_concurrency_exceeded_handler(
+    request: Request, exc: Exception
+) -> JSONResponse:
+    """
+    Custom exception handler for rejected interactions when the application has too
+    many interactions in flight.
+
+    Args:
+        request (Request): The incoming request object.
+        exc (Exception): The exception raised.
+
+    Returns:
+        JSONResponse: A JSON response with status code 429 and error details.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={
+            "code": "app_concurrency_exceeded",
+            "message": str(exc),
+        },
+    )
+
+
 def not_implemented_exception_handler(request: Request, exc: Exception) -> JSONResponse:
     """
     Custom exception handler for handling not implemented exceptions.
@@ -308,8 +415,15 @@ def register_exception_handlers(app):
     app.exception_handler(NodeConstructError)(node_construct_exception_handler)
     app.exception_handler(ApplicationNotFound)(application_not_found_handler)
     app.exception_handler(InteractionNotFound)(interaction_not_found_handler)
+    app.exception_handler(InteractionNodeNotFound)(interaction_node_not_found_handler)
     app.exception_handler(ApplicationInputTypeMismatch)(
         application_input_mismatch_handler
     )
+    app.exception_handler(InvalidCursor)(invalid_cursor_handler)
+    app.exception_handler(InvalidPersistencePolicy)(invalid_persistence_policy_handler)
+    app.exception_handler(ExecutorQueueFull)(executor_queue_full_handler)
+    app.exception_handler(ApplicationConcurrencyExceeded)(
+        application_concurrency_exceeded_handler
+    )
     app.exception_handler(NotImplementedError)(not_implemented_exception_handler)
     app.exception_handler(Exception)(exception_handler)
@@ -0,0 +1,194 @@
+import contextvars
+import logging
+import queue
+import threading
+from typing import Callable, Dict, Optional
+
+from exceptions import ApplicationConcurrencyExceeded, ExecutorQueueFull
+
+
+class Slot:
+    """
+    Slot is a reserved place in the queue of an InvokeExecutor. It should be either
+    submitted with a task or released.
+    """
+
+    def __init__(self, executor: "InvokeExecutor", app_id: str, nested: bool):
+        self.executor = executor
+        self.app_id = app_id
+        # nested slots bypass the queue and run on the thread submitting them
+        self.nested = nested
+        self.used = False
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """
+        Submit a task to the reserved place. A nested task is run before this
+        returns.
+
+        Args:
+            fn (callable): The task to run.
+            *args, **kwargs: The arguments passed to the task.
+        """
+        assert not self.used, "slot has been used"
+        self.used = True
+        self.executor._enqueue(self, fn, args, kwargs)
+
+    def release(self):
+        """
+        Give the reserved place back without submitting any task.
+        """
+        if not self.used:
+            self.used = True
+            self.executor._done(self, started=False)
+
+
+class InvokeExecutor:
+    """
+    InvokeExecutor runs interactions on a fixed number of worker threads with a
+    bounded queue, so a traffic spike is rejected instead of exhausting threads and
+    connections of the process.
+
+    A place in the queue is reserved before the interaction is created, a task is
+    then submitted to it:
+
+    ```
+    slot = executor.reserve(app_id)  # raises if the queue is full
+    try:
+        ...
+    except Exception:
+        slot.release()
+        raise
+    slot.submit(task, input=...)
+    ```
+
+    Each task runs in a fresh context. Tasks submitted from inside a task (nested
+    invocations) are run on the submitting thread instead of being queued, otherwise
+    the workers may all wait for tasks queued behind them. They're bounded by the
+    threads of their parent run, and not limited by max_app_concurrency, which
+    would fail an interaction whose application invokes itself.
+    """
+
+    # set in the context of the tasks run by any InvokeExecutor
+    _in_task = contextvars.ContextVar("in_task", default=False)
+
+    def __init__(
+        self,
+        max_workers: int = 32,
+        max_queue_size: int = 1024,
+        max_app_concurrency: Optional[int] = None,
+    ):
+        """
+        Args:
+            max_workers (int): The number of worker threads.
+            max_queue_size (int): The maximum number of tasks waiting for a worker.
+            max_app_concurrency (int): The maximum number of queued and running tasks
+                of one application, no limit if it is None or 0. Nested tasks are
+                counted but never rejected.
+        """
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_app_concurrency = max_app_concurrency
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._queued = 0
+        self._active = 0
+        self._apps: Dict[str, int] = {}
+        self.rejected = 0
+
+    @classmethod
+    def in_task(cls) -> bool:
+        """
+        Checks if the caller is running inside a task of an InvokeExecutor.
+        """
+        return cls._in_task.get()
+
+    def reserve(self, app_id: str) -> Slot:
+        """
+        Reserve a place for a task of the application. The place of a nested task
+        is always granted.
+
+        Args:
+            app_id (str): The ID of the application the task belongs to.
+
+        Returns:
+            Slot: The reserved place.
+
+        Raises:
+            ExecutorQueueFull: If the queue is full.
+            ApplicationConcurrencyExceeded: If the application has too many tasks in flight.
+        """
+        nested = self.in_task()
+        with self._lock:
+            if not nested and self._queued >= self.max_queue_size:
+                self.rejected += 1
+                raise ExecutorQueueFull(self.max_queue_size)
+            inflight = self._apps.get(app_id, 0)
+            limited = not nested and self.max_app_concurrency
+            if limited and inflight >= self.max_app_concurrency:
+                self.rejected += 1
+                raise ApplicationConcurrencyExceeded(app_id, self.max_app_concurrency)
+            self._apps[app_id] = inflight + 1
+            if not nested:
+                self._queued += 1
+                self._start_workers()
+        return Slot(self, app_id, nested)
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._work,
+                name=f"invoker-{len(self._workers)}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _enqueue(self, slot: Slot, fn: Callable, args: tuple, kwargs: dict):
+        if slot.nested:
+            self._run(slot, fn, args, kwargs)
+        else:
+            self._queue.put((slot, fn, args, kwargs))
+
+    def _work(self):
+        while True:
+            slot, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._queued -= 1
+            self._run(slot, fn, args, kwargs)
+
+    def _run(self, slot: Slot, fn: Callable, args: tuple, kwargs: dict):
+        with self._lock:
+            self._active += 1
+        try:
+            ctx = contextvars.Context()
+            ctx.run(self._in_task.set, True)
+            ctx.run(fn, *args, **kwargs)
+        except Exception:
+            logging.exception(f"invoke task of application {slot.app_id} failed")
+        finally:
+            self._done(slot, started=True)
+
+    def _done(self, slot: Slot, started: bool):
+        with self._lock:
+            if started:
+                self._active -= 1
+            elif not slot.nested:
+                self._queued -= 1
+            self._apps[slot.app_id] -= 1
+            if self._apps[slot.app_id] == 0:
+                del self._apps[slot.app_id]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the gauges and counters of the executor.
+        """
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "active_workers": self._active,
+                "queue_depth": self._queued,
+                "max_queue_size": self.max_queue_size,
+                "inflight_apps": len(self._apps),
+                "rejected": self.rejected,
+            }
@@ -1,8 +1,11 @@
 from datetime import datetime
 
-from sqlalchemy import BOOLEAN, JSON, TEXT, TIMESTAMP, Column, Index, String
+from sqlalchemy import BOOLEAN, JSON, TIMESTAMP, Column, Index, Integer, String
+from sqlalchemy.dialects import mysql
 from sqlalchemy.ext.declarative import declarative_base
 
+from codec import EncodedValue
+
 """
 A base class is required to define models:
 
@@ -19,10 +22,13 @@ Each version (except the first one of every app) contains a parent version, whic
 means the versions construct a tree instead of a list. The version has a configuration
 which stores the DAG. The DAG defines how to interact with LLM and how to deal with
 input data. Each time the DAG is executed, a new iteraction is produced. The iteraction
-stores all data the DAG nodes produced.
+stores all data the DAG nodes produced, one row per node.
 """
 Base = declarative_base()
 
+# TIMESTAMP of MySQL is truncated to seconds by default
+PRECISE_TIMESTAMP = TIMESTAMP().with_variant(mysql.TIMESTAMP(fsp=6), "mysql")
+
 
 class Application(Base):
     """
@@ -39,11 +45,16 @@ class Application(Base):
     langfuse_public_key = Column(String(64), nullable=True)
     langfuse_secret_key = Column(String(64), nullable=True)
     active_version = Column(String(36), nullable=True)
+    # the days the interactions are kept, INTERACTION_RETENTION_DAYS is used if it is None
+    retention_days = Column(Integer, nullable=True)
+    # see PersistencePolicy, INTERACTION_PERSISTENCE is used if it is None
+    persistence_policy = Column(String(32), nullable=True)
     created_at = Column(TIMESTAMP, nullable=False)
     updated_at = Column(TIMESTAMP, nullable=False)
     deleted_at = Column(TIMESTAMP, nullable=True)
 
     deleted_at_index = Index("ix_application_deleted_at", deleted_at)
+    created_at_index = Index("ix_application_created_at", created_at, id)
 
 
 class ApplicationVersion(Base):
@@ -60,18 +71,51 @@ class ApplicationVersion(Base):
     app_id = Column(String(36), nullable=False)
     meta = Column(JSON, nullable=True)
     configuration = Column(JSON, nullable=False)
+    # overrides the persistence_policy of the application if it is set
+    persistence_policy = Column(String(32), nullable=True)
     created_at = Column(TIMESTAMP, nullable=False)
     updated_at = Column(TIMESTAMP, nullable=False)
     deleted_at = Column(TIMESTAMP, nullable=True)
 
-    application_index = Index("ix_version_app_id", app_id)
+    application_index = Index("ix_version_app_id_created_at", app_id, created_at, id)
     created_at_index = Index("ix_version_created_at", created_at)
     deleted_at_index = Index("ix_version_deleted_at", deleted_at)
 
 
+class InteractionStatus:
+    """
+    The status of an interaction:
+
+    PENDING -> RUNNING -> SUCCEEDED / FAILED
+
+    Interactions queued for the standalone workers start with PENDING, a worker
+    claims it and sets it to RUNNING. Interactions run by the API process start
+    with RUNNING directly.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
 class Interaction(Base):
     """
     Interaction records every interaction with a specific app version.
+
+    The input is kept so that a queued interaction can be run by any worker. While
+    a worker is running the interaction, it renews heartbeat_at, so the interaction
+    can be requeued if the worker is lost.
+
+    The output and the data are stored with the codec configured by
+    INTERACTION_CODEC, see codec.py.
+
+    created_at is a part of the primary key, so the table can be partitioned by
+    created_at (MySQL requires the partitioning columns in every unique key), see
+    docs/deployment/self_host.md.
+
+    The interactions run by a batch run have its batch_id, and the position of
+    their input in the batch as batch_index.
     """
 
     __tablename__ = "interactions"
@@ -80,11 +124,66 @@ class Interaction(Base):
     user = Column(String(256), nullable=False)
     app_id = Column(String(36), nullable=False)
     version_id = Column(String(36), nullable=False)
-    created_at = Column(TIMESTAMP, nullable=False)
+    created_at = Column(TIMESTAMP, primary_key=True, nullable=False)
     updated_at = Column(TIMESTAMP, nullable=False)
-    output = Column(TEXT, nullable=True)
-    data = Column(JSON, nullable=True)
+    output = Column(EncodedValue(text=True), nullable=True)
+    data = Column(EncodedValue(), nullable=True)
     error = Column(JSON, nullable=True)
-
-    version_index = Index("ix_interactions_version_id", version_id)
+    input = Column(JSON, nullable=True)
+    session_id = Column(String(256), nullable=True)
+    status = Column(String(16), nullable=True)
+    worker_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(TIMESTAMP, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    batch_id = Column(String(36), nullable=True)
+    batch_index = Column(Integer, nullable=True)
+
+    application_index = Index(
+        "ix_interactions_app_id_created_at", app_id, created_at, id
+    )
+    version_index = Index(
+        "ix_interactions_version_id_created_at", version_id, created_at, id
+    )
     created_at_index = Index("ix_interactions_created_at", created_at)
+    status_index = Index("ix_interactions_status_created_at", status, created_at)
+    batch_index_index = Index(
+        "ix_interactions_batch_id_batch_index", batch_id, batch_index
+    )
+
+
+class InteractionNodeStatus:
+    """
+    The status of a node in an interaction. A node is SKIPPED if it's not run because
+    a required upstream produced nothing, or its case is not matched.
+    """
+
+    SUCCEEDED = "succeeded"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+
+class InteractionNode(Base):
+    """
+    InteractionNode records the output of a node in an interaction. The rows are only
+    inserted once the node is finished, so recording a node costs the same no matter
+    how many nodes the interaction has.
+
+    The data column of interactions is kept for the interactions recorded before
+    this table is introduced. The value is stored with the codec configured by
+    INTERACTION_CODEC.
+
+    The value too large to be stored inline is spilled to the blob store, the row
+    keeps the key of the blob and a preview of the value instead.
+    """
+
+    __tablename__ = "interaction_nodes"
+
+    interaction_id = Column(String(36), primary_key=True, nullable=False)
+    node_id = Column(String(256), primary_key=True, nullable=False)
+    value = Column(EncodedValue(), nullable=True)
+    status = Column(String(16), nullable=False)
+    started_at = Column(PRECISE_TIMESTAMP, nullable=True)
+    finished_at = Column(PRECISE_TIMESTAMP, nullable=False)
+    # the full value is stored in the blob store if it is set
+    blob_key = Column(String(512), nullable=True)
+    blob_size = Column(Integer, nullable=True)
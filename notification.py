@@ -0,0 +1,298 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set
+
+
+class CompletionRegistry:
+    """
+    CompletionRegistry notifies the waiters in the same process when something
+    (an interaction for example) completes.
+
+    To avoid missing a completion happened before waiting, a waiter should watch
+    the key before checking whether it has completed:
+
+    ```
+    event = registry.watch(key)
+    try:
+        if not completed(key):
+            event.wait(timeout)
+    finally:
+        registry.unwatch(key)
+    ```
+
+    And the notifier should notify after the completion is visible:
+
+    ```
+    complete(key)
+    registry.notify(key)
+    ```
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: Dict[Hashable, List] = {}
+
+    def watch(self, key: Hashable) -> threading.Event:
+        """
+        Start watching a key.
+
+        Args:
+            key (Hashable): The key to watch.
+
+        Returns:
+            threading.Event: The event set when the key is notified.
+        """
+        with self._lock:
+            entry = self._events.get(key)
+            if entry is None:
+                entry = self._events[key] = [threading.Event(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def unwatch(self, key: Hashable):
+        """
+        Stop watching a key.
+
+        Args:
+            key (Hashable): The key watched.
+        """
+        with self._lock:
+            entry = self._events.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._events[key]
+
+    def notify(self, key: Hashable):
+        """
+        Wake up all the waiters of a key.
+
+        Args:
+            key (Hashable): The key completed.
+        """
+        with self._lock:
+            entry = self._events.get(key)
+        if entry is not None:
+            entry[0].set()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+class ChangeNotifier:
+    """
+    ChangeNotifier wakes up the asyncio waiters of a key when it's notified from
+    any thread, for example a request long-polling an interaction recorded by a
+    worker thread.
+
+    As with CompletionRegistry, a waiter should watch the key before checking
+    whether it has changed:
+
+    ```
+    future = notifier.watch(key)
+    try:
+        if not changed(key):
+            await asyncio.wait_for(future, timeout)
+    finally:
+        notifier.unwatch(key, future)
+    ```
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[Hashable, Set[asyncio.Future]] = {}
+
+    def watch(self, key: Hashable) -> asyncio.Future:
+        """
+        Start watching a key, it must be called from a running event loop.
+
+        Args:
+            key (Hashable): The key to watch.
+
+        Returns:
+            asyncio.Future: The future resolved when the key is notified.
+        """
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiters.setdefault(key, set()).add(future)
+        return future
+
+    def unwatch(self, key: Hashable, future: asyncio.Future):
+        """
+        Stop watching a key.
+
+        Args:
+            key (Hashable): The key watched.
+            future (asyncio.Future): The future returned by watch.
+        """
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is None:
+                return
+            waiters.discard(future)
+            if not waiters:
+                del self._waiters[key]
+
+    def notify(self, key: Hashable):
+        """
+        Wake up all the waiters of a key, it can be called from any thread.
+
+        Args:
+            key (Hashable): The key changed.
+        """
+        with self._lock:
+            waiters = list(self._waiters.get(key, ()))
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(_resolve, future)
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class EventBus:
+    """
+    EventBus fans out the events of running things (the nodes of an interaction for
+    example) from any thread to the asyncio subscribers in the same process.
+
+    The events published since a key is opened are kept until it's closed, so a
+    subscriber joining late receives all of them. To bound the memory of a long
+    running key, an event can replace the kept events it supersedes:
+
+    ```
+    bus.open(key)
+    bus.publish(key, event)
+    bus.close(key)
+
+    subscription = bus.subscribe(key)
+    if subscription is not None:
+        try:
+            while (event := await subscription.get(timeout)) is not None:
+                ...
+        finally:
+            subscription.close()
+    ```
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics: Dict[Hashable, List] = {}
+
+    def open(self, key: Hashable):
+        """
+        Start keeping the events of a key.
+
+        Args:
+            key (Hashable): The key.
+        """
+        with self._lock:
+            # the events and the subscribers
+            self._topics[key] = [[], set()]
+
+    def publish(
+        self,
+        key: Hashable,
+        event: Any,
+        replaces: Optional[Callable[[Any], bool]] = None,
+    ):
+        """
+        Publish an event of an opened key, it can be called from any thread.
+
+        Args:
+            key (Hashable): The key.
+            event (Any): The event, it must not be None.
+            replaces (Callable[[Any], bool]): The kept events it returns True for
+                are dropped, as the event supersedes them.
+        """
+        with self._lock:
+            topic = self._topics.get(key)
+            if topic is None:
+                return
+            if replaces is not None:
+                topic[0] = [e for e in topic[0] if not replaces(e)]
+            topic[0].append(event)
+            subscriptions = list(topic[1])
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def close(self, key: Hashable):
+        """
+        Stop keeping the events of a key, and end its subscriptions.
+
+        Args:
+            key (Hashable): The key.
+        """
+        with self._lock:
+            topic = self._topics.pop(key, None)
+        if topic is not None:
+            for subscription in topic[1]:
+                subscription.put(None)
+
+    def subscribe(self, key: Hashable) -> Optional["Subscription"]:
+        """
+        Subscribe the events of a key, it must be called from a running event loop.
+
+        Args:
+            key (Hashable): The key.
+
+        Returns:
+            Optional[Subscription]: The subscription, which receives the events
+                published so far first, or None if the key is not opened.
+        """
+        with self._lock:
+            topic = self._topics.get(key)
+            if topic is None:
+                return None
+            subscription = Subscription(self, key, topic[0])
+            topic[1].add(subscription)
+            return subscription
+
+    def unsubscribe(self, key: Hashable, subscription: "Subscription"):
+        with self._lock:
+            topic = self._topics.get(key)
+            if topic is not None:
+                topic[1].discard(subscription)
+
+    def __len__(self) -> int:
+        return len(self._topics)
+
+
+class Subscription:
+    """
+    Subscription receives the events of a key of an EventBus, None is received once
+    the key is closed.
+    """
+
+    def __init__(self, bus: EventBus, key: Hashable, events: List):
+        self.bus = bus
+        self.key = key
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        for event in events:
+            self.queue.put_nowait(event)
+
+    def put(self, event: Any):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Receive the next event.
+
+        Args:
+            timeout (float): The maximum seconds to wait.
+
+        Returns:
+            Any: The event, or None if the key is closed.
+
+        Raises:
+            asyncio.TimeoutError: If no event is received in time.
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.bus.unsubscribe(self.key, self)
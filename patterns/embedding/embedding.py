@@ -22,3 +22,16 @@ class EmbeddingModel(ABC):
             List[float]: The embedding vector for the input text.
         """
         pass
+
+    def embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Convert the given texts into embedding vectors. Models whose API accepts
+        many texts at once should override it to embed them in one request.
+
+        Args:
+            texts (List[str]): The input texts to convert.
+
+        Returns:
+            List[List[float]]: The embedding vectors, in the order of the texts.
+        """
+        return [self.embedding(text) for text in texts]
@@ -79,6 +79,26 @@ class Namespace:
         vec = self._embedding_model.embedding(text)
         return self._db.retrieve(self._name, vec, limit)
 
+    @span(name="retrieve batch")
+    def retrieve_batch(self, texts: List[str], limit: int = 5) -> List[List[dict]]:
+        """
+        Retrieve data based on each of the given texts, the texts are embedded at
+        once.
+
+        Args:
+            texts (List[str]): The texts to retrieve data for.
+            limit (int): The maximum number of results to return for each text.
+                Defaults to 5.
+
+        Returns:
+            List[List[dict]]: The retrieved data, in the order of the texts.
+        """
+        obs = current_observation()
+        if obs:
+            obs.update(metadata={"namespace": self._name})
+        vecs = self._embedding_model.embeddings(texts)
+        return [self._db.retrieve(self._name, vec, limit) for vec in vecs]
+
     def upsert(self, metadata: dict):
         """
         Upsert metadata.
@@ -48,3 +48,24 @@ class OpenAIEmbedding(EmbeddingModel):
             )
         except Exception as e:
             raise EmbeddingError(self.model_name, text, str(e))
+
+    def embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Get the embeddings for the given texts in one request.
+
+        Args:
+            texts (List[str]): The input texts.
+
+        Returns:
+            List[List[float]]: The embedding vectors, in the order of the texts.
+        """
+        if not texts:
+            return []
+        try:
+            data = self.client.embeddings.create(
+                input=texts,
+                model=self.model_name,
+            ).data
+        except Exception as e:
+            raise EmbeddingError(self.model_name, "`, `".join(texts), str(e))
+        return [d.embedding for d in sorted(data, key=lambda d: d.index)]
@@ -1,6 +1,7 @@
-from typing import List
+from typing import Callable, List
 
-from langchain_core.outputs import LLMResult
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.outputs import Generation, LLMResult
 from langchain_core.prompt_values import PromptValue
 from langchain_openai import ChatOpenAI, OpenAI
 
@@ -10,6 +11,101 @@ from resolver import pattern
 from .secret import Secret
 
 
+def trace_generation(name: str, llm: BaseLanguageModel, prompts: List[PromptValue]):
+    """
+    Build a generation decorator to trace a (sync or async) generate_prompt call of llm.
+
+    Args:
+        name (str): The name of the generation.
+        llm (BaseLanguageModel): The OpenAI model to generate with.
+        prompts (List[PromptValue]): The prompts passed to generate_prompt.
+    """
+    input_texts = (
+        [p.to_string() for p in prompts]
+        if len(prompts) != 1
+        else prompts[0].to_string()
+    )
+
+    def parse_output(r: LLMResult):
+        if len(r.generations) == 1:
+            return r.generations[0][0].text
+        else:
+            return [g[0].text for g in r.generations]
+
+    return generation(
+        name=name,
+        input_fn=lambda args, kwargs: input_texts,
+        output_fn=parse_output,
+        usage_fn=lambda r: (r.llm_output or {}).get("token_usage"),
+        model=llm.model_name,
+        model_parameters={
+            "temperature": llm.temperature,
+            "max_tokens": llm.max_tokens,
+        },
+    )
+
+
+def chunk_text(chunk) -> str:
+    # the completion models stream strings, and the chat models stream messages
+    return chunk if isinstance(chunk, str) else chunk.content
+
+
+def stream_generation(
+    name: str,
+    llm: BaseLanguageModel,
+    prompt: PromptValue,
+    callback: Callable[[str], None],
+) -> str:
+    """
+    Generate the completion of a prompt token by token, and trace it as one
+    generation. The token usage is not reported by the streaming API.
+
+    Args:
+        name (str): The name of the generation.
+        llm (BaseLanguageModel): The OpenAI model to generate with.
+        prompt (PromptValue): The prompt.
+        callback (Callable[[str], None]): The callback receiving the tokens.
+
+    Returns:
+        str: The full completion.
+    """
+
+    def generate(prompts: List[PromptValue]) -> LLMResult:
+        tokens = []
+        for chunk in llm.stream(prompts[0]):
+            token = chunk_text(chunk)
+            if token:
+                callback(token)
+                tokens.append(token)
+        return LLMResult(generations=[[Generation(text="".join(tokens))]])
+
+    result = trace_generation(name, llm, [prompt])(generate)([prompt])
+    return result.generations[0][0].text
+
+
+async def astream_generation(
+    name: str,
+    llm: BaseLanguageModel,
+    prompt: PromptValue,
+    callback: Callable[[str], None],
+) -> str:
+    """
+    The async version of stream_generation.
+    """
+
+    async def generate(prompts: List[PromptValue]) -> LLMResult:
+        tokens = []
+        async for chunk in llm.astream(prompts[0]):
+            token = chunk_text(chunk)
+            if token:
+                callback(token)
+                tokens.append(token)
+        return LLMResult(generations=[[Generation(text="".join(tokens))]])
+
+    result = await trace_generation(name, llm, [prompt])(generate)([prompt])
+    return result.generations[0][0].text
+
+
 @pattern(name="OpenAI_Complete_LLM")
 class OpneAIWrapper(OpenAI):
     """
@@ -47,29 +143,26 @@ class OpneAIWrapper(OpenAI):
             )
 
     def generate_prompt(self, prompts: List[PromptValue], *args, **kwargs) -> LLMResult:
-        input_texts = (
-            [p.to_string() for p in prompts]
-            if len(prompts) != 1
-            else prompts[0].to_string()
-        )
-
-        def parse_output(r: LLMResult):
-            if len(r.generations) == 1:
-                return r.generations[0][0].text
-            else:
-                return [g[0].text for g in r.generations]
-
-        return generation(
-            name="OpenAI_Complete_LLM",
-            input_fn=lambda args, kwargs: input_texts,
-            output_fn=parse_output,
-            usage_fn=lambda r: r.llm_output["token_usage"],
-            model=self.model_name,
-            model_parameters={
-                "temperature": self.temperature,
-                "max_tokens": self.max_tokens,
-            },
-        )(super(OpneAIWrapper, self).generate_prompt)(prompts, *args, **kwargs)
+        return trace_generation("OpenAI_Complete_LLM", self, prompts)(
+            super(OpneAIWrapper, self).generate_prompt
+        )(prompts, *args, **kwargs)
+
+    async def agenerate_prompt(
+        self, prompts: List[PromptValue], *args, **kwargs
+    ) -> LLMResult:
+        return await trace_generation("OpenAI_Complete_LLM", self, prompts)(
+            super(OpneAIWrapper, self).agenerate_prompt
+        )(prompts, *args, **kwargs)
+
+    def stream_prompt(
+        self, prompt: PromptValue, callback: Callable[[str], None]
+    ) -> str:
+        return stream_generation("OpenAI_Complete_LLM", self, prompt, callback)
+
+    async def astream_prompt(
+        self, prompt: PromptValue, callback: Callable[[str], None]
+    ) -> str:
+        return await astream_generation("OpenAI_Complete_LLM", self, prompt, callback)
 
 
 @pattern(name="OpenAI_Chat_LLM")
@@ -109,26 +202,23 @@ class ChatOpenAIWrapper(ChatOpenAI):
             )
 
     def generate_prompt(self, prompts: List[PromptValue], *args, **kwargs) -> LLMResult:
-        input_texts = (
-            [p.to_string() for p in prompts]
-            if len(prompts) != 1
-            else prompts[0].to_string()
-        )
-
-        def parse_output(r: LLMResult):
-            if len(r.generations) == 1:
-                return r.generations[0][0].text
-            else:
-                return [g[0].text for g in r.generations]
-
-        return generation(
-            name="OpenAI_Chat_LLM",
-            input_fn=lambda args, kwargs: input_texts,
-            output_fn=parse_output,
-            usage_fn=lambda r: r.llm_output["token_usage"],
-            model=self.model_name,
-            model_parameters={
-                "temperature": self.temperature,
-                "max_tokens": self.max_tokens,
-            },
-        )(super(ChatOpenAIWrapper, self).generate_prompt)(prompts, *args, **kwargs)
+        return trace_generation("OpenAI_Chat_LLM", self, prompts)(
+            super(ChatOpenAIWrapper, self).generate_prompt
+        )(prompts, *args, **kwargs)
+
+    async def agenerate_prompt(
+        self, prompts: List[PromptValue], *args, **kwargs
+    ) -> LLMResult:
+        return await trace_generation("OpenAI_Chat_LLM", self, prompts)(
+            super(ChatOpenAIWrapper, self).agenerate_prompt
+        )(prompts, *args, **kwargs)
+
+    def stream_prompt(
+        self, prompt: PromptValue, callback: Callable[[str], None]
+    ) -> str:
+        return stream_generation("OpenAI_Chat_LLM", self, prompt, callback)
+
+    async def astream_prompt(
+        self, prompt: PromptValue, callback: Callable[[str], None]
+    ) -> str:
+        return await astream_generation("OpenAI_Chat_LLM", self, prompt, callback)
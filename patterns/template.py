@@ -1,3 +1,6 @@
+from typing import List
+
+from langchain_core.prompt_values import PromptValue, StringPromptValue
 from langchain_core.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
@@ -64,9 +67,32 @@ class FewShotPromptTemplate(StringPromptTemplate):
         Returns:
             str: The formatted text.
         """
+        return self.format_examples(self.namespace.retrieve(text), text, **kwargs)
+
+    @span(name="few shot prompt format batch")
+    def format_prompts(self, inputs: List[dict]) -> List[PromptValue]:
+        """
+        Format a batch of inputs, the examples of all the texts are retrieved at
+        once, so their embeddings are computed in one request.
+
+        Args:
+            inputs (List[dict]): The keyword arguments of format for every prompt.
+
+        Returns:
+            List[PromptValue]: The formatted prompts.
+        """
+        examples = self.namespace.retrieve_batch([i["text"] for i in inputs])
+        return [
+            StringPromptValue(text=self.format_examples(e, **i))
+            for e, i in zip(examples, inputs)
+        ]
+
+    def format_examples(self, examples: List[dict], text: str, **kwargs) -> str:
+        """
+        Format the text with the retrieved examples.
+        """
         kwargs["text"] = text
-        examples = self.namespace.retrieve(text)
-        examples.reverse()
+        examples = list(reversed(examples))
         return self.prefix.format(**kwargs) + "\n" "\n".join(
             [self.example_prompt.format(**e) for e in examples]
         ) + "\n" + self.suffix.format(**kwargs)
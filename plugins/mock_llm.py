@@ -23,12 +23,16 @@ class MockLLM(BaseLanguageModel):
         super(MockLLM, self).__init__(mock_output=mock_output)
 
     @generation(name="Mock LLM", output_fn=lambda x: x.generations[0][0].text)
-    async def agenerate_prompt(self, *args, **kwargs) -> LLMResult:
-        return LLMResult(generations=[[Generation(text=self.mock_output)]])
+    async def agenerate_prompt(self, prompts: list, *args, **kwargs) -> LLMResult:
+        return LLMResult(
+            generations=[[Generation(text=self.mock_output)]] * len(prompts)
+        )
 
     @generation(name="Mock LLM", output_fn=lambda x: x.generations[0][0].text)
-    def generate_prompt(self, *args, **kwargs) -> LLMResult:
-        return LLMResult(generations=[[Generation(text=self.mock_output)]])
+    def generate_prompt(self, prompts: list, *args, **kwargs) -> LLMResult:
+        return LLMResult(
+            generations=[[Generation(text=self.mock_output)]] * len(prompts)
+        )
 
     @generation(name="Mock LLM")
     async def apredict(self, *args, **kwargs) -> str:
@@ -0,0 +1,383 @@
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import quote
+
+from blobstore import get_blob_store
+from database import Database, Lease
+from exceptions import InteractionLeaseLost, InvalidPersistencePolicy
+from model import InteractionNode, InteractionNodeStatus, InteractionStatus
+from notification import ChangeNotifier, EventBus
+from settings import EnvSetting
+
+
+class PersistencePolicy:
+    """
+    The policy deciding which node outputs of a successful interaction are persisted,
+    the node outputs of a failed interaction are always persisted for debugging:
+
+    - all: the outputs of all nodes.
+    - output_only: the output of the output node.
+    - on_error: no node output.
+    - sampled:N: the outputs of all nodes for N percent of the interactions, no node
+      output for the others.
+
+    The policy is set by the version, or the application if the version doesn't set
+    it, or INTERACTION_PERSISTENCE (all by default) if neither sets it.
+    """
+
+    ALL = "all"
+    OUTPUT_ONLY = "output_only"
+    ON_ERROR = "on_error"
+    SAMPLED = "sampled"
+
+    @classmethod
+    def validate(cls, policy: str) -> str:
+        """
+        Check a policy.
+
+        Args:
+            policy (str): The policy.
+
+        Returns:
+            str: The policy.
+
+        Raises:
+            InvalidPersistencePolicy: If the policy is not supported.
+        """
+        if policy in (cls.ALL, cls.OUTPUT_ONLY, cls.ON_ERROR):
+            return policy
+        kind, _, percent = policy.partition(":")
+        if kind == cls.SAMPLED:
+            try:
+                if 0 <= float(percent) <= 100:
+                    return policy
+            except ValueError:
+                pass
+        raise InvalidPersistencePolicy(policy)
+
+    @classmethod
+    def persisted_nodes(cls, policy: str, output_node: str) -> Optional[Set[str]]:
+        """
+        Decide the nodes persisted for an interaction if it succeeds.
+
+        Args:
+            policy (str): The policy.
+            output_node (str): The ID of the output node of the graph.
+
+        Returns:
+            Optional[Set[str]]: The IDs of the nodes persisted, None for all nodes.
+        """
+        cls.validate(policy)
+        if policy == cls.ALL:
+            return None
+        if policy == cls.OUTPUT_ONLY:
+            return {output_node}
+        if policy == cls.ON_ERROR:
+            return set()
+        percent = float(policy.partition(":")[2])
+        return None if random.random() * 100 < percent else set()
+
+
+class InteractionRecorder:
+    """
+    InteractionRecorder records the nodes of a running interaction to the database.
+    Every finished node is inserted as a row of interaction_nodes, the rows are
+    coalesced and inserted at most once per flush interval.
+
+    If a blob store is configured, the outputs larger than NODE_OUTPUT_SPILL_SIZE
+    bytes (as JSON, 256KB by default) are written to the blob store, and the row
+    keeps the first NODE_OUTPUT_PREVIEW_SIZE characters (1024 by default) of them
+    as a preview.
+
+    If only some nodes are persisted (see PersistencePolicy), the outputs are kept in
+    memory until the interaction completes, then the outputs of all nodes are written
+    if it failed, and the outputs of the persisted nodes otherwise.
+
+    The interactions run by a standalone worker are recorded under its Lease. Once
+    the lease is lost, nothing more is written, and the run is aborted by raising
+    InteractionLeaseLost from the next record.
+
+    Example:
+
+    ```
+    recorder = InteractionRecorder(database, interaction_id, flush_interval=0.5)
+    graph.run(
+        ...,
+        node_callback=recorder.record,
+        node_start_callback=recorder.start,
+        token_callback=recorder.token,
+    )
+    recorder.close({"output": ..., "status": ...})
+    ```
+    """
+
+    # notified whenever the interactions recorded in this process are written
+    changes = ChangeNotifier()
+
+    # the events of the nodes of the interactions running in this process, they're
+    # published as soon as the nodes finish (or stream a token), before the nodes
+    # are written. The values larger than spill_size are published as their
+    # previews, and the tokens of a node are dropped once it finishes, to bound the
+    # events kept for the subscribers joining later
+    events = EventBus()
+
+    spill_size = EnvSetting(lambda env: env.int("NODE_OUTPUT_SPILL_SIZE", 256 * 1024))
+    preview_size = EnvSetting(lambda env: env.int("NODE_OUTPUT_PREVIEW_SIZE", 1024))
+
+    def __init__(
+        self,
+        database: Database,
+        interaction_id: str,
+        flush_interval: float = 0.5,
+        persisted_nodes: Optional[Set[str]] = None,
+        lease: Optional[Lease] = None,
+    ):
+        """
+        Args:
+            database (Database): The database to store interactions.
+            interaction_id (str): The ID of the interaction.
+            flush_interval (float): The minimum seconds between two writes, every
+                node is written once it's recorded if it is 0.
+            persisted_nodes (Set[str]): The IDs of the nodes persisted if the
+                interaction succeeds, all nodes are persisted as they finish if it
+                is None.
+            lease (Lease): The lease of the worker running the interaction, the
+                writes are fenced by it.
+        """
+        self.database = database
+        self.blob_store = get_blob_store()
+        self.interaction_id = interaction_id
+        self.flush_interval = flush_interval
+        self.persisted_nodes = persisted_nodes
+        self.lease = lease
+        self.started: Dict[str, datetime] = {}
+        self.pending: List[InteractionNode] = []
+        self.last_flush = 0.0
+        self.timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        # keeps the writes in order
+        self._write_lock = threading.Lock()
+        self.events.open(interaction_id)
+
+    def start(self, node_id: str):
+        """
+        Record the start time of a node.
+
+        Args:
+            node_id (str): The ID of the node.
+        """
+        with self._lock:
+            self.started[node_id] = datetime.utcnow()
+
+    def record(self, node_id: str, value: Any):
+        """
+        Record the output of a node, it's written to the database by a later flush.
+        Nodes settled without being started are recorded as skipped.
+
+        Args:
+            node_id (str): The ID of the node.
+            value (Any): The output of the node.
+
+        Raises:
+            InteractionLeaseLost: If the lease of the interaction is lost.
+        """
+        if self.lost:
+            raise InteractionLeaseLost(self.interaction_id)
+        with self._lock:
+            started_at = self.started.pop(node_id, None)
+            self._append(
+                node_id,
+                value,
+                started_at,
+                (
+                    InteractionNodeStatus.SKIPPED
+                    if started_at is None
+                    else InteractionNodeStatus.SUCCEEDED
+                ),
+            )
+            if self.persisted_nodes is not None:
+                # kept until close
+                return
+            if self.flush_interval > 0:
+                if self.timer is None:
+                    delay = self.last_flush + self.flush_interval - time.monotonic()
+                    self.timer = threading.Timer(max(delay, 0), self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+        self.flush()
+
+    def token(self, node_id: str, text: str):
+        """
+        Publish a token of the output of a node streamed before the node finishes,
+        the tokens are not written, the output is recorded once the node finishes.
+
+        Args:
+            node_id (str): The ID of the node.
+            text (str): The token.
+        """
+        self.events.publish(
+            self.interaction_id, {"event": "token", "node_id": node_id, "text": text}
+        )
+
+    def fail(self, node_id: str):
+        """
+        Record a node as failed, it's written by the next flush.
+
+        Args:
+            node_id (str): The ID of the failed node.
+        """
+        with self._lock:
+            started_at = self.started.pop(node_id, None)
+            self._append(node_id, None, started_at, InteractionNodeStatus.FAILED)
+
+    def _append(
+        self, node_id: str, value: Any, started_at: Optional[datetime], status: str
+    ):
+        finished_at = datetime.utcnow()
+        self.pending.append(
+            InteractionNode(
+                interaction_id=self.interaction_id,
+                node_id=node_id,
+                value=value,
+                status=status,
+                started_at=started_at,
+                finished_at=finished_at,
+            )
+        )
+        event = {
+            "event": "node",
+            "node_id": node_id,
+            "status": status,
+            "started_at": started_at.timestamp() if started_at else None,
+            "finished_at": finished_at.timestamp(),
+            "value": value,
+        }
+        try:
+            data = self._encode(value)
+        except (TypeError, ValueError):
+            # not serializable, it fails to be written as well
+            data = None
+        if data is not None:
+            event.update(value=self._preview(value, data), blob_size=len(data))
+        self.events.publish(
+            self.interaction_id,
+            event,
+            replaces=lambda e: e["event"] == "token" and e["node_id"] == node_id,
+        )
+
+    def _encode(self, value: Any) -> Optional[bytes]:
+        """
+        Returns the JSON of a value larger than spill_size, or None if it's not.
+        """
+        if value is None:
+            return None
+        # a character is escaped into 12 bytes at most (a surrogate pair), so the
+        # short strings are never spilled
+        if isinstance(value, str) and len(value) * 12 + 2 <= self.spill_size:
+            return None
+        data = json.dumps(value).encode()
+        return data if len(data) > self.spill_size else None
+
+    def _preview(self, value: Any, data: bytes) -> str:
+        preview = value if isinstance(value, str) else data.decode()
+        return preview[: self.preview_size]
+
+    def _spill(self, node: InteractionNode):
+        data = self._encode(node.value)
+        if data is None:
+            return
+        # the key is the same for every run of the node, so a requeued
+        # interaction overwrites the blobs of its previous attempt
+        key = f"interactions/{self.interaction_id}/{quote(node.node_id, safe='')}.json"
+        self.blob_store.put(key, data)
+        node.value = self._preview(node.value, data)
+        node.blob_key = key
+        node.blob_size = len(data)
+
+    @property
+    def lost(self) -> bool:
+        """
+        Whether the lease of the interaction is lost, the run should be aborted then.
+        """
+        return self.lease is not None and self.lease.lost.is_set()
+
+    def flush(self, attrs: Optional[dict] = None):
+        """
+        Write the pending nodes to the database. The nodes are dropped if the lease of
+        the interaction is lost.
+
+        Args:
+            attrs (dict): The attributes of the interaction to update in the same
+                transaction.
+        """
+        with self._write_lock:
+            with self._lock:
+                self.timer = None
+                self.last_flush = time.monotonic()
+                nodes, self.pending = self.pending, []
+            if self.lost:
+                return
+            try:
+                if self.blob_store is not None:
+                    for node in nodes:
+                        self._spill(node)
+                if nodes:
+                    self.database.add_interaction_nodes(
+                        self.interaction_id, nodes, attrs, lease=self.lease
+                    )
+                elif attrs:
+                    self.database.update_interaction(
+                        self.interaction_id, attrs, lease=self.lease
+                    )
+                else:
+                    return
+            except InteractionLeaseLost:
+                logging.warning(
+                    f"interaction {self.interaction_id} has been requeued, "
+                    "its writes are discarded"
+                )
+                return
+        self.changes.notify(self.interaction_id)
+
+    def close(self, attrs: Optional[dict] = None):
+        """
+        Cancel the scheduled flush, and write the pending nodes together with the
+        final attributes of the interaction. Only the persisted nodes are written
+        unless the status is failed.
+
+        Args:
+            attrs (dict): The final attributes of the interaction, like the output
+                and the status.
+        """
+        with self._lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            failed = (
+                attrs is not None and attrs.get("status") == InteractionStatus.FAILED
+            )
+            if self.persisted_nodes is not None and not failed:
+                self.pending = [
+                    node
+                    for node in self.pending
+                    if node.node_id in self.persisted_nodes
+                ]
+        try:
+            self.flush(attrs)
+        finally:
+            attrs = attrs or {}
+            self.events.publish(
+                self.interaction_id,
+                {
+                    "event": "end",
+                    "status": attrs.get("status"),
+                    "output": attrs.get("output"),
+                    "error": attrs.get("error"),
+                },
+            )
+            self.events.close(self.interaction_id)
@@ -0,0 +1,51 @@
+import logging
+import time
+
+from environs import Env
+
+from codec import EncodedValue
+from database import Database, get_engine
+
+"""
+Rewrite the finished interactions with the codec configured by INTERACTION_CODEC,
+after the columns are converted to binary and the codec is changed:
+
+```
+INTERACTION_CODEC=zstd python reencode.py
+```
+
+The values written with the other codecs stay readable, so the interactions can be
+rewritten while the service is running, and the script can be stopped at any time.
+Pass the cursor it logs as REENCODE_CURSOR to resume from there.
+"""
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+
+
+def main():
+    env = Env()
+    env.read_env()
+    database = Database(get_engine())
+    batch_size = env.int("REENCODE_BATCH_SIZE", 200)
+    batch_pause = env.float("REENCODE_BATCH_PAUSE", 0.1)
+    cursor = env.str("REENCODE_CURSOR", None)
+
+    total = 0
+    while True:
+        count, cursor = database.reencode_interactions(batch_size, cursor)
+        total += count
+        logging.info(
+            f"{total} interactions rewritten, {EncodedValue.stats.stats()}, "
+            f"cursor: {cursor}"
+        )
+        if cursor is None:
+            break
+        time.sleep(batch_pause)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import gzip
+import json
+import logging
+import os
+import signal
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from environs import Env
+
+from blobstore import BlobStore, get_blob_store
+from database import Database, get_engine
+from model import Interaction, InteractionNode
+
+"""
+The retention job deletes the interactions older than the retention of their
+application, optionally archiving them to local files first:
+
+```
+python retention.py
+```
+
+The retention of an application is its retention_days, or INTERACTION_RETENTION_DAYS
+if it's not set. The interactions are kept forever if neither is set (or is 0).
+
+The interactions are deleted in small batches along the (app_id, created_at, id)
+index, so the job never holds many locks or a long transaction.
+"""
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+
+
+class InteractionArchiver:
+    """
+    InteractionArchiver writes interactions, with their nodes, to compressed files
+    on local disk before they're deleted. A file is written per batch:
+
+    ```
+    {directory}/{app_id}/{date of the first interaction}/{batch id}.jsonl.gz
+    ```
+
+    The "parquet" format requires pyarrow, which is not installed by default. The
+    JSON columns (input, error and the node values) are stored as JSON strings in
+    Parquet, since their types differ from row to row.
+    """
+
+    def __init__(self, directory: str, format: str = "jsonl"):
+        """
+        Args:
+            directory (str): The directory the archive files are written to.
+            format (str): "jsonl" for gzipped JSON lines, or "parquet".
+        """
+        if format not in ("jsonl", "parquet"):
+            raise ValueError(f"unknown archive format {format}")
+        if format == "parquet":
+            # fail at startup rather than at the first batch
+            import pyarrow  # noqa: F401
+        self.directory = directory
+        self.format = format
+
+    def record(
+        self, interaction: Interaction, nodes: List[InteractionNode]
+    ) -> Dict[str, object]:
+        """
+        Returns the archived record of an interaction.
+        """
+        return {
+            "id": interaction.id,
+            "user": interaction.user,
+            "app_id": interaction.app_id,
+            "version_id": interaction.version_id,
+            "session_id": interaction.session_id,
+            "status": interaction.status,
+            "created_at": interaction.created_at.isoformat(),
+            "updated_at": interaction.updated_at.isoformat(),
+            "input": interaction.input,
+            "output": interaction.output,
+            "error": interaction.error,
+            "data": interaction.data,
+            "batch_id": interaction.batch_id,
+            "batch_index": interaction.batch_index,
+            "nodes": [
+                {
+                    "node_id": node.node_id,
+                    "value": node.value,
+                    "status": node.status,
+                    "started_at": (
+                        node.started_at.isoformat() if node.started_at else None
+                    ),
+                    "finished_at": node.finished_at.isoformat(),
+                }
+                for node in nodes
+            ],
+        }
+
+    def archive(
+        self,
+        interactions: List[Interaction],
+        nodes: Dict[str, List[InteractionNode]],
+    ) -> str:
+        """
+        Write a batch of interactions of an application to a new file.
+
+        Args:
+            interactions (List[Interaction]): The interactions, the oldest first.
+            nodes (Dict[str, List[InteractionNode]]): The nodes keyed by interaction ID.
+
+        Returns:
+            str: The path of the file.
+        """
+        first = interactions[0]
+        directory = os.path.join(
+            self.directory, first.app_id, first.created_at.strftime("%Y-%m-%d")
+        )
+        os.makedirs(directory, exist_ok=True)
+        records = [self.record(i, nodes.get(i.id, [])) for i in interactions]
+        path = os.path.join(directory, f"{uuid.uuid4().hex}.{self.format}")
+        if self.format == "jsonl":
+            path += ".gz"
+            # write to a temporary file, so a crash never leaves a partial archive
+            with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, default=str) + "\n")
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            for record in records:
+                for key in ("input", "error", "data", "nodes"):
+                    record[key] = json.dumps(record[key], default=str)
+            pq.write_table(
+                pa.Table.from_pylist(records), path + ".tmp", compression="zstd"
+            )
+        os.replace(path + ".tmp", path)
+        return path
+
+
+class RetentionJob:
+    """
+    RetentionJob purges the expired interactions of every application periodically.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        default_days: Optional[int] = None,
+        batch_size: int = 500,
+        batch_pause: float = 0.1,
+        archiver: Optional[InteractionArchiver] = None,
+        sweep_orphans: bool = False,
+        blob_store: Optional[BlobStore] = None,
+    ):
+        """
+        Args:
+            database (Database): The database the interactions are stored in.
+            default_days (int): The retention of the applications without their own
+                retention_days, interactions are kept forever if it is None or 0.
+            batch_size (int): The maximum number of interactions deleted at once.
+            batch_pause (float): The seconds to pause between two batches, to leave
+                room for the other queries.
+            archiver (InteractionArchiver): Archive the interactions before deleting
+                them if it's given.
+            sweep_orphans (bool): Whether to delete the nodes whose interaction has
+                been removed by dropping a partition.
+            blob_store (BlobStore): The blob store the large node outputs are spilled
+                to, the blobs are archived and deleted with their interactions.
+        """
+        self.database = database
+        self.default_days = default_days
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.archiver = archiver
+        self.sweep_orphans = sweep_orphans
+        self.blob_store = blob_store
+        self.stopped = threading.Event()
+
+    def purge(self) -> int:
+        """
+        Delete (and archive) the expired interactions of every application.
+
+        Returns:
+            int: The number of deleted interactions.
+        """
+        total = 0
+        now = datetime.utcnow()
+        for app_id, days in self.database.list_retention_days().items():
+            days = days if days is not None else self.default_days
+            if not days:
+                continue
+            total += self.purge_application(app_id, now - timedelta(days=days))
+        if self.sweep_orphans:
+            while not self.stopped.is_set():
+                if self.database.delete_orphan_interaction_nodes(self.batch_size) == 0:
+                    break
+                self.stopped.wait(self.batch_pause)
+        return total
+
+    def purge_application(self, app_id: str, before: datetime) -> int:
+        """
+        Delete (and archive) the interactions of an application created before a time.
+
+        Args:
+            app_id (str): The ID of the application.
+            before (datetime): The interactions created before it are deleted.
+
+        Returns:
+            int: The number of deleted interactions.
+        """
+        total = 0
+        while not self.stopped.is_set():
+            expired = self.database.list_expired_interactions(
+                app_id, before, self.batch_size
+            )
+            if not expired:
+                break
+            ids = [id for id, _ in expired]
+            blob_keys = []
+            if self.archiver is not None:
+                nodes = self.database.list_nodes_of_interactions(ids)
+                blob_keys = [
+                    node.blob_key
+                    for interaction_nodes in nodes.values()
+                    for node in interaction_nodes
+                    if node.blob_key is not None
+                ]
+                if self.blob_store is not None:
+                    self.load_blobs(nodes)
+                interactions = self.database.list_interactions_by_ids(ids)
+                path = self.archiver.archive(interactions, nodes)
+                logging.info(f"{len(ids)} interactions of {app_id} archived to {path}")
+            elif self.blob_store is not None:
+                # the values are not archived, only the keys of their blobs are read
+                blob_keys = self.database.list_blob_keys_of_interactions(ids)
+            total += self.database.delete_interactions(ids)
+            if blob_keys and self.blob_store is not None:
+                self.blob_store.delete(blob_keys)
+            if len(expired) < self.batch_size:
+                break
+            self.stopped.wait(self.batch_pause)
+        if total:
+            logging.info(f"{total} interactions of {app_id} purged")
+        return total
+
+    def load_blobs(self, nodes: Dict[str, List[InteractionNode]]):
+        """
+        Replace the previews of the nodes spilled to the blob store with their full
+        values, so they're archived in full.
+
+        Args:
+            nodes (Dict[str, List[InteractionNode]]): The nodes keyed by interaction ID.
+        """
+        for interaction_nodes in nodes.values():
+            for node in interaction_nodes:
+                if node.blob_key is None:
+                    continue
+                try:
+                    node.value = json.loads(self.blob_store.get(node.blob_key))
+                except KeyError:
+                    logging.warning(
+                        f"blob {node.blob_key} is missing, keep the preview"
+                    )
+
+    def run_forever(self, interval: float):
+        """
+        Purge the expired interactions every interval seconds until stopped.
+
+        Args:
+            interval (float): The seconds between two purges.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.purge()
+            except Exception:
+                logging.exception("failed to purge interactions")
+            self.stopped.wait(interval)
+
+    def stop(self, *args):
+        self.stopped.set()
+
+
+def main():
+    env = Env()
+    env.read_env()
+
+    archiver = None
+    if env.str("INTERACTION_ARCHIVE_DIR", None):
+        archiver = InteractionArchiver(
+            env.str("INTERACTION_ARCHIVE_DIR"),
+            format=env.str("INTERACTION_ARCHIVE_FORMAT", "jsonl"),
+        )
+    job = RetentionJob(
+        Database(get_engine()),
+        default_days=env.int("INTERACTION_RETENTION_DAYS", 0),
+        batch_size=env.int("RETENTION_BATCH_SIZE", 500),
+        batch_pause=env.float("RETENTION_BATCH_PAUSE", 0.1),
+        archiver=archiver,
+        sweep_orphans=env.bool("RETENTION_SWEEP_ORPHANS", False),
+        blob_store=get_blob_store(),
+    )
+    signal.signal(signal.SIGTERM, job.stop)
+    signal.signal(signal.SIGINT, job.stop)
+    job.run_forever(env.float("RETENTION_INTERVAL", 3600))
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,2 @@
+from .execution import Execution
 from .graph import Edge, Graph
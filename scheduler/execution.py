@@ -0,0 +1,266 @@
+import functools
+import heapq
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .plan import Plan
+
+
+class Execution:
+    """
+    Execution holds all the state of one run of a graph: the input, the global
+    context, the values of the finished steps, which steps are demanded, and which
+    steps are ready to run.
+
+    The steps are demanded the same as pulling the output through the links in
+    order: the output is demanded first, and a demanded step demands the sources of
+    its links one after another. A required link stops the walk until its source is
+    finished, and if the value blocks the link, the step outputs None and the
+    sources of its later links are never demanded. The optional links never stop the
+    walk. Every demanded step is settled and passed to node_callback, even if its
+    consumers have finished without it, so a graph reports the same nodes whether
+    its steps run one after another or concurrently.
+
+    When speculative, the sources behind a required link are started before the link
+    is resolved, so the branches joined by the required links of a step run
+    concurrently. The output of a step which is never demanded is discarded: it's
+    not passed to node_callback, its tokens are not streamed, and its error is not
+    raised.
+
+    The compiled graph itself is never mutated during a run, so one graph can be
+    run concurrently from many threads or tasks, each run with its own Execution.
+    """
+
+    __slots__ = (
+        "plan",
+        "input",
+        "context",
+        "speculative",
+        "values",
+        "errors",
+        "finished",
+        "wanted",
+        "demanded",
+        "queued",
+        "cursor",
+        "waiting",
+        "pending",
+        "ready",
+        "node_callback",
+        "node_start_callback",
+        "token_callback",
+    )
+
+    def __init__(
+        self,
+        plan: Plan,
+        input: Union[str, dict, list],
+        context: dict,
+        node_callback: Callable[[str, Any], None] = None,
+        node_start_callback: Callable[[str], None] = None,
+        token_callback: Callable[[str, str], None] = None,
+        speculative: bool = False,
+    ):
+        """
+        Args:
+            plan (Plan): The plan being run.
+            input (Union[str, dict, list]): The input data for the graph.
+            context (dict): The global context during running.
+            node_callback (callable): Optional callback function to be called after each node is settled.
+            node_start_callback (callable): Optional callback function to be called before each node is run.
+            token_callback (callable): Optional callback function receiving the tokens streamed by the
+                nodes feeding the output.
+            speculative (bool): Whether the sources behind the unresolved required links are
+                run ahead of their demand.
+        """
+        size = len(plan.steps)
+        self.plan = plan
+        self.input = input
+        self.context = context
+        self.speculative = speculative
+        self.node_callback = node_callback
+        self.node_start_callback = node_start_callback
+        self.token_callback = token_callback
+        self.values = [None] * size
+        # the errors of the steps failed before being demanded
+        self.errors: Dict[int, Exception] = {}
+        self.finished = bytearray(size)
+        # the steps to run, the demanded ones and the ones run ahead of their demand
+        self.wanted = bytearray(size)
+        self.demanded = bytearray(size)
+        self.queued = bytearray(size)
+        # the next link of each step whose source is to be demanded
+        self.cursor = array("i", [0] * size)
+        # the number of links of each step whose source is not finished
+        self.waiting = array("i", [len(step.links) for step in plan.steps])
+        # the number of demanded steps which are not settled
+        self.pending = 0
+        # a heap, so the ready steps are popped in topological order
+        self.ready: List[int] = []
+        self.demand(plan.output)
+
+    @property
+    def done(self) -> bool:
+        return self.pending == 0
+
+    @property
+    def output(self) -> Any:
+        return self.values[self.plan.output]
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """
+        Returns a dictionary mapping the ids of the demanded nodes to their outputs.
+        """
+        return dict(
+            (step.node_id, self.values[i])
+            for i, step in enumerate(self.plan.steps)
+            if self.finished[i] and self.demanded[i]
+        )
+
+    def demand(self, index: int):
+        """
+        Demands a step, it will be settled (run, or settled as None) before the run
+        is done.
+
+        Args:
+            index (int): The index of the step.
+
+        Raises:
+            Exception: The error of the step, if it failed while run ahead of its demand.
+        """
+        if self.demanded[index]:
+            return
+        if index in self.errors:
+            raise self.errors.pop(index)
+        self.demanded[index] = 1
+        self.pending += 1
+        self._want(index)
+        if self.finished[index]:
+            self._report(index)
+        self._advance(index)
+
+    def _want(self, index: int):
+        if self.wanted[index]:
+            return
+        self.wanted[index] = 1
+        if self.speculative:
+            for link in self.plan.steps[index].links:
+                self._want(link.source)
+        self._enqueue(index)
+
+    def _enqueue(self, index: int):
+        if (
+            self.wanted[index]
+            and not self.finished[index]
+            and not self.queued[index]
+            and self.waiting[index] == 0
+        ):
+            self.queued[index] = 1
+            heapq.heappush(self.ready, index)
+
+    def _advance(self, index: int):
+        # walks the links of a demanded step from its cursor, demanding their
+        # sources may settle steps and advance this step re-entrantly, so the state
+        # is read again after every demand
+        links = self.plan.steps[index].links
+        while self.cursor[index] < len(links):
+            link = links[self.cursor[index]]
+            if not self.demanded[link.source]:
+                self.demand(link.source)
+                continue
+            if link.required:
+                if not self.finished[link.source]:
+                    return
+                if link.blocks(self.values[link.source]):
+                    # the sources of the later links are never demanded
+                    self.cursor[index] = len(links)
+                    if not self.finished[index]:
+                        self.settle(index, None)
+                    return
+            self.cursor[index] += 1
+
+    def _report(self, index: int):
+        self.pending -= 1
+        if self.node_callback:
+            self.node_callback(self.plan.steps[index].node_id, self.values[index])
+
+    def pop(self) -> List[Tuple[int, dict]]:
+        """
+        Pops the steps which are ready to run.
+
+        Returns:
+            list: The indexes of the ready steps and the parameters to call them with.
+        """
+        runnable = []
+        while self.ready:
+            i = heapq.heappop(self.ready)
+            if self.finished[i]:
+                continue
+            node_params = self.plan.params(i, self.values)
+            if node_params is None:
+                self.settle(i, None)
+                continue
+            runnable.append((i, node_params))
+        return runnable
+
+    def start(self, index: int):
+        """
+        Marks a step as started, it may be called from any thread.
+
+        Args:
+            index (int): The index of the step about to run.
+        """
+        if self.node_start_callback:
+            self.node_start_callback(self.plan.steps[index].node_id)
+
+    def stream(self, index: int) -> Optional[Callable[[str], None]]:
+        """
+        Returns the callback receiving the tokens of a step, or None if the output
+        of the step is not streamed. The steps run ahead of their demand are not
+        streamed, as their output may be discarded.
+
+        Args:
+            index (int): The index of the step about to run.
+        """
+        if (
+            self.token_callback is None
+            or index not in self.plan.streamed
+            or not self.demanded[index]
+        ):
+            return None
+        return functools.partial(self.token_callback, self.plan.steps[index].node_id)
+
+    def settle(self, index: int, value: Any):
+        """
+        Records the output of a step and updates its downstreams.
+
+        Args:
+            index (int): The index of the finished step.
+            value (Any): The output of the step.
+        """
+        self.values[index] = value
+        self.finished[index] = 1
+        if self.demanded[index]:
+            self._report(index)
+        for consumer, _ in self.plan.steps[index].consumers:
+            self.waiting[consumer] -= 1
+            self._enqueue(consumer)
+            if self.demanded[consumer]:
+                self._advance(consumer)
+
+    def fail(self, index: int, error: Exception):
+        """
+        Records the error of a step, it's raised at once if the step is demanded,
+        otherwise only when the step gets demanded.
+
+        Args:
+            index (int): The index of the failed step.
+            error (Exception): The error raised by the step.
+
+        Raises:
+            Exception: The error, if the step is demanded.
+        """
+        if self.demanded[index]:
+            raise error
+        self.errors[index] = error
@@ -1,12 +1,17 @@
-import inspect
+import asyncio
+import contextvars
 from collections import namedtuple
-from typing import Any, Callable, Dict, List, Union
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Tuple, Union
 
 import networkx as nx
 
 from blocks import BaseBlock
+from blocks.base import InputBlock
 from exceptions import NodeException
 
+from .execution import Execution
+from .plan import Plan
 from .rule import (
     EndpointExist,
     ExactlyOneInputAndOutput,
@@ -25,6 +30,8 @@ class Graph:
     The primary class of the scheduler module, which represents a DAG graph.
 
     When executed, it will run each node of the DAG until the last node (OutputBlock).
+    The DAG is validated and compiled into a Plan once on construction, so running it
+    again is cheap.
     """
 
     def __init__(
@@ -56,6 +63,7 @@ class Graph:
                     TypeHasStrMethod(),
                 ]
             )
+        self.plan = Plan(self.g, self.nodes)
 
     def _validate(self, rules: List[Rule]):
         """
@@ -67,87 +75,190 @@ class Graph:
         for r in rules:
             r.check(self.g, self.nodes)
 
-    def _reset(self):
+    def _run_step(self, execution: Execution, index: int, node_params: dict) -> Any:
         """
-        Resets the data attribute of each node in the graph.
+        Calls the block of a step with the given parameters.
+
+        Args:
+            execution (Execution): The state of the run.
+            index (int): The index of the step to call.
+            node_params (dict): The parameters passed to the block.
+
+        Returns:
+            Any: The output of the block.
         """
-        for n in self.g.nodes:
-            if "data" in self.g.nodes[n]:
-                del self.g.nodes[n]["data"]
+        step = self.plan.steps[index]
+        execution.start(index)
+        token = BaseBlock._token_callback.set(execution.stream(index))
+        try:
+            return step.block(**node_params)
+        except Exception as e:
+            raise NodeException(step.node_id) from e
+        finally:
+            BaseBlock._token_callback.reset(token)
 
-    def run_node(
-        self, node_id, node_callback: Callable[[str, Any], None] = None
+    async def _arun_step(
+        self, execution: Execution, index: int, node_params: dict
     ) -> Any:
         """
-        Runs a node in the graph and returns its output.
+        Awaits the async call of the block of a step with the given parameters.
+
+        Args:
+            execution (Execution): The state of the run.
+            index (int): The index of the step to call.
+            node_params (dict): The parameters passed to the block.
+
+        Returns:
+            Any: The output of the block.
+        """
+        step = self.plan.steps[index]
+        execution.start(index)
+        token = BaseBlock._token_callback.set(execution.stream(index))
+        try:
+            return await step.block.acall(**node_params)
+        except Exception as e:
+            raise NodeException(step.node_id) from e
+        finally:
+            BaseBlock._token_callback.reset(token)
+
+    def _run_batch_step(
+        self,
+        index: int,
+        batch: List[Tuple[Execution, dict]],
+        return_exceptions: bool,
+    ) -> List[Any]:
+        """
+        Calls the block of a step over a batch of runs.
 
         Args:
-            node_id (str): The id of the node to run.
-            node_callback (callable): Optional callback function to be called after running the node.
+            index (int): The index of the step to call.
+            batch (list): The runs and the parameters to call the block with.
+            return_exceptions (bool): Whether to return the NodeException of a failed
+                item as its output, instead of raising it.
 
         Returns:
-            Any: The output of the node.
+            list: The outputs of the block, in the order of the batch.
         """
-        node = self.nodes[node_id]
-        in_edges = self.g.in_edges(node_id, data=True)
-        if len(in_edges) == 0:
+        step = self.plan.steps[index]
+        if not step.block.is_input:
             try:
-                return node()
+                outputs = step.block.call_batch([params for _, params in batch])
+                if len(outputs) != len(batch):
+                    raise ValueError(
+                        f"{len(outputs)} outputs returned for {len(batch)} items"
+                    )
+                return outputs
             except Exception as e:
-                raise NodeException(node_id) from e
-
-        signature = inspect.signature(node.__call__)
-        node_params = {}
-
-        # fill default values
-        for k, p in signature.parameters.items():
-            if p.default != inspect.Parameter.empty:
-                node_params[k] = p.default
-
-        # run upstreams and fill values
-        for source_node, _, properties in in_edges:
-            port = properties["port"]
-            if "data" not in self.g.nodes[source_node]:
-                self.g.nodes[source_node]["data"] = self.run_node(
-                    source_node,
-                    node_callback=node_callback,
-                )
-                if node_callback:
-                    node_callback(source_node, self.g.nodes[source_node]["data"])
-
-            if port is None or port not in signature.parameters:
-                # the None port and unknown port is special, it's required
-                if self.g.nodes[source_node]["data"] is None:
-                    return None
-                # if the edge has a filter, check if the value is match with the filter
-                if (
-                    properties["case"] is not None
-                    and properties["case"] != self.g.nodes[source_node]["data"]
-                ):
-                    return None
-                if port is not None:
-                    node_params[port] = self.g.nodes[source_node]["data"]
-            elif self.g.nodes[source_node]["data"] is not None:
-                if (
-                    properties["case"] is not None
-                    and properties["case"] != self.g.nodes[source_node]["data"]
-                ):
-                    continue
-                node_params[port] = self.g.nodes[source_node]["data"]
-
-        # check if required params are filled
-        leak_params = set(
-            [k for k, p in signature.parameters.items() if p.kind != p.VAR_KEYWORD]
-        )
-        leak_params -= set(node_params.keys())
-        if len(leak_params) > 0:
-            # some params leaked
-            return None
+                if not return_exceptions:
+                    raise NodeException(step.node_id) from e
+
+        # the input block reads the input of every run from the context, and a failed
+        # batch is called item by item to find out the failed items
+        outputs = []
+        for execution, params in batch:
+            token = InputBlock._input.set(execution.input)
+            try:
+                outputs.append(step.block(**params))
+            except Exception as e:
+                if not return_exceptions:
+                    raise NodeException(step.node_id) from e
+                error = NodeException(step.node_id)
+                error.__cause__ = e
+                outputs.append(error)
+            finally:
+                InputBlock._input.reset(token)
+        return outputs
+
+    def _run_sequentially(self, execution: Execution):
+        """
+        Runs the ready steps of the plan one after another in topological order.
+
+        Args:
+            execution (Execution): The state of the run.
+        """
+        while not execution.done:
+            runnable = execution.pop()
+            if not runnable:
+                break
+            for i, node_params in runnable:
+                execution.settle(i, self._run_step(execution, i, node_params))
+
+    def _run_concurrently(self, execution: Execution, max_workers: int):
+        """
+        Runs the steps of the plan on a bounded thread pool, every step whose
+        upstreams are finished is scheduled at once, so independent branches run in
+        parallel.
+
+        The context variables (the block context and the observability context) are
+        copied into the workers, and node_callback is called in the calling thread as
+        each node completes.
 
+        Args:
+            execution (Execution): The state of the run.
+            max_workers (int): The maximum number of nodes running at the same time.
+        """
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                while not execution.done:
+                    for i, node_params in execution.pop():
+                        ctx = contextvars.copy_context()
+                        future = executor.submit(
+                            ctx.run, self._run_step, execution, i, node_params
+                        )
+                        running[future] = i
+                    if execution.done or not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = running.pop(future)
+                        try:
+                            value = future.result()
+                        except NodeException as e:
+                            execution.fail(i, e)
+                        else:
+                            execution.settle(i, value)
+            finally:
+                # the steps run ahead of their demand may be left over, the
+                # started ones are waited for on leaving the pool
+                for future in running:
+                    future.cancel()
+
+    async def _arun(self, execution: Execution):
+        """
+        Runs the steps of the plan on the running event loop, every step whose
+        upstreams are finished is awaited at once through its acall method.
+
+        Args:
+            execution (Execution): The state of the run.
+        """
+        running = {}
         try:
-            return node(**node_params)
-        except Exception as e:
-            raise NodeException(node_id) from e
+            while not execution.done:
+                for i, node_params in execution.pop():
+                    task = asyncio.ensure_future(
+                        self._arun_step(execution, i, node_params)
+                    )
+                    running[task] = i
+                if execution.done or not running:
+                    break
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    i = running.pop(task)
+                    try:
+                        value = task.result()
+                    except NodeException as e:
+                        execution.fail(i, e)
+                    else:
+                        execution.settle(i, value)
+        finally:
+            # the steps run ahead of their demand may be left over
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(running)
 
     def input_type(self) -> type:
         """
@@ -156,61 +267,168 @@ class Graph:
         Returns:
             type: The type of the input expected by the graph.
         """
-        input_nodes = [node for node in self.nodes.values() if node.is_input]
-        assert len(input_nodes) == 1, "exactly one input node is required"
+        return self.plan.input_type
+
+    def output_node(self) -> str:
+        """
+        Returns the ID of the output node of the graph.
 
-        signature = inspect.signature(input_nodes[0].input)
-        return list(signature.parameters.values())[0].annotation
+        Returns:
+            str: The ID of the output node.
+        """
+        return self.plan.steps[self.plan.output].node_id
 
     def run(
         self,
         input: Union[str, dict, list],
         context: dict,
         node_callback: Callable[[str, Any], None] = None,
+        max_workers: int = 1,
+        node_start_callback: Callable[[str], None] = None,
+        token_callback: Callable[[str, str], None] = None,
     ) -> str:
         """
         Runs the graph with the given input and returns the output.
 
+        All the state of the run is kept in an Execution, so the same graph can be run
+        concurrently from many threads.
+
         Args:
             input (Union[str, dict, list]): The input data for the graph.
             context (dict): The global context during running.
             node_callback (callable): Optional callback function to be called after running each node.
+            max_workers (int): The maximum number of nodes running concurrently, nodes are
+                run one after another if it is 1 (the default).
+            node_start_callback (callable): Optional callback function to be called before running
+                each node, it's called from the thread running the node.
+            token_callback (callable): Optional callback function receiving the tokens (with the
+                node id) streamed by the node feeding the output, so the output can be sent before
+                it's complete. It's called from the thread running the node.
 
         Returns:
             str: The output of the graph.
         """
-        self._reset()
-        ctx_token = BaseBlock._ctx.set(context)
+        execution = Execution(
+            self.plan,
+            input,
+            context,
+            node_callback,
+            node_start_callback,
+            token_callback,
+            speculative=max_workers > 1,
+        )
+        ctx_token = BaseBlock._ctx.set(execution.context)
+        input_token = InputBlock._input.set(execution.input)
 
         try:
-            input_nodes = [node for node in self.nodes.values() if node.is_input]
-            assert len(input_nodes) == 1, "exactly one input node is required"
+            if max_workers > 1:
+                self._run_concurrently(execution, max_workers)
+            else:
+                self._run_sequentially(execution)
+            return execution.output
+        finally:
+            InputBlock._input.reset(input_token)
+            BaseBlock._ctx.reset(ctx_token)
 
-            output_nodes = [
-                node_id for node_id, node in self.nodes.items() if node.is_output
-            ]
-            assert len(output_nodes) == 1, "exactly one output node is required"
+    def run_batch(
+        self,
+        inputs: List[Union[str, dict, list]],
+        context: dict,
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        """
+        Runs the graph over a batch of inputs and returns their outputs. Every node is
+        called once for the whole batch, through the call_batch method of its block,
+        so the blocks able to process many items at once (one request with many
+        prompts for example) save the round-trips of calling them item by item.
 
-            input_nodes[0].input(input)
+        The nodes are run one after another in topological order, with the items
+        which reach them (the items not skipped by a condition, and not failed). A
+        node demanded by some items only after a later node has run is called
+        again for them.
 
-            self.g.nodes[output_nodes[0]]["data"] = self.run_node(
-                output_nodes[0],
-                node_callback=node_callback,
-            )
-            if node_callback:
-                node_callback(output_nodes[0], self.g.nodes[output_nodes[0]]["data"])
-            return self.g.nodes[output_nodes[0]]["data"]
+        Args:
+            inputs (list): The input data of every run.
+            context (dict): The global context shared by the runs.
+            return_exceptions (bool): Whether the output of a failed item is its
+                NodeException, instead of failing the whole batch. A failed batch
+                call is retried item by item to find out the failed items then.
+
+        Returns:
+            list: The outputs, in the order of the inputs.
+        """
+        executions = [Execution(self.plan, input, context) for input in inputs]
+        errors: Dict[int, NodeException] = {}
+        ctx_token = BaseBlock._ctx.set(context)
+        # the items ready to run, by step index
+        ready: Dict[int, list] = {}
+
+        def collect(n: int, execution: Execution):
+            for i, node_params in execution.pop():
+                ready.setdefault(i, []).append((n, execution, node_params))
+
+        try:
+            for n, execution in enumerate(executions):
+                collect(n, execution)
+            while ready:
+                i = min(ready)
+                batch = ready.pop(i)
+                outputs = self._run_batch_step(
+                    i, [(e, params) for _, e, params in batch], return_exceptions
+                )
+                for (n, execution, _), value in zip(batch, outputs):
+                    if isinstance(value, NodeException):
+                        errors[n] = value
+                    else:
+                        execution.settle(i, value)
+                        collect(n, execution)
+            return [
+                errors[n] if n in errors else execution.output
+                for n, execution in enumerate(executions)
+            ]
         finally:
             BaseBlock._ctx.reset(ctx_token)
 
-    @property
-    def data(self):
+    async def arun(
+        self,
+        input: Union[str, dict, list],
+        context: dict,
+        node_callback: Callable[[str, Any], None] = None,
+        node_start_callback: Callable[[str], None] = None,
+        token_callback: Callable[[str, str], None] = None,
+    ) -> str:
         """
-        Returns a dictionary mapping node ids to their corresponding data values in the graph.
+        Runs the graph with the given input on the running event loop and returns the output.
+
+        Independent nodes are awaited concurrently, blocks without a native async
+        implementation are offloaded to threads (see BaseBlock.acall).
+
+        Args:
+            input (Union[str, dict, list]): The input data for the graph.
+            context (dict): The global context during running.
+            node_callback (callable): Optional callback function to be called after running each node.
+            node_start_callback (callable): Optional callback function to be called before running each node.
+            token_callback (callable): Optional callback function receiving the tokens streamed by the
+                node feeding the output.
 
         Returns:
-            dict: A dictionary mapping node ids to their corresponding data values in the graph.
+            str: The output of the graph.
         """
-        return dict(
-            (node_id, node.get("data")) for node_id, node in self.g.nodes.items()
+        execution = Execution(
+            self.plan,
+            input,
+            context,
+            node_callback,
+            node_start_callback,
+            token_callback,
+            speculative=True,
         )
+        ctx_token = BaseBlock._ctx.set(execution.context)
+        input_token = InputBlock._input.set(execution.input)
+
+        try:
+            await self._arun(execution)
+            return execution.output
+        finally:
+            InputBlock._input.reset(input_token)
+            BaseBlock._ctx.reset(ctx_token)
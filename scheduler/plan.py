@@ -0,0 +1,199 @@
+import inspect
+from typing import Any, Dict, List, Optional, Tuple
+
+import networkx as nx
+
+from blocks import BaseBlock
+
+
+class Link:
+    """
+    Link is a compiled in-edge of a step: it tells which step the value comes from
+    and which port of the sink it fills.
+
+    Links on the None port and on unknown ports (accepted by **kwargs) are required:
+    a None value or an unmatched case on them makes the sink output None without
+    running it. Links on known ports are optional: a None value or an unmatched case
+    just leaves the port to its default value.
+    """
+
+    __slots__ = ("source", "port", "case", "required")
+
+    def __init__(self, source: int, port: Optional[str], case: Any, required: bool):
+        """
+        Args:
+            source (int): The index of the upstream step in the plan.
+            port (str): The port filled by the link, None if it fills nothing.
+            case (Any): The filter of the edge, None if the edge has no filter.
+            required (bool): Whether the link is required by the sink.
+        """
+        self.source = source
+        self.port = port
+        self.case = case
+        self.required = required
+
+    def blocks(self, value: Any) -> bool:
+        """
+        Checks if the value on the link makes the sink output None without running it.
+        """
+        return self.required and (
+            value is None or (self.case is not None and self.case != value)
+        )
+
+    def accepts(self, value: Any) -> bool:
+        """
+        Checks if the value on the link should fill the port.
+        """
+        return self.port is not None and (
+            self.required
+            or (value is not None and (self.case is None or self.case == value))
+        )
+
+
+class Step:
+    """
+    Step is a compiled node of the graph with everything needed to call it.
+    """
+
+    __slots__ = ("node_id", "block", "links", "defaults", "required", "consumers")
+
+    def __init__(
+        self,
+        node_id: str,
+        block: BaseBlock,
+        links: Tuple[Link, ...],
+        defaults: Dict[str, Any],
+        required: frozenset,
+    ):
+        """
+        Args:
+            node_id (str): The id of the node.
+            block (BaseBlock): The block of the node.
+            links (tuple): The in-edges of the node, in the order they were added.
+            defaults (dict): The default values of the ports.
+            required (frozenset): The ports must be filled before calling the block.
+        """
+        self.node_id = node_id
+        self.block = block
+        self.links = links
+        self.defaults = defaults
+        self.required = required
+        # the (step index, link) pairs of the downstreams, filled by Plan
+        self.consumers = ()
+
+
+class Plan:
+    """
+    Plan is the compiled form of a graph: the output node and its upstreams in
+    topological order, with the ports of every node resolved to step indexes.
+
+    It's compiled once when the graph is constructed, so running a graph needs
+    neither networkx nor inspect.
+    """
+
+    __slots__ = ("steps", "input", "output", "input_type", "streamed")
+
+    def __init__(self, g: nx.DiGraph, nodes: Dict[str, BaseBlock]):
+        """
+        Args:
+            g (nx.DiGraph): The (validated) DAG.
+            nodes (dict): the nodes of the DAG, composed of BaseBlock instances and their unique ids.
+        """
+        input_nodes = [node for node in nodes.values() if node.is_input]
+        assert len(input_nodes) == 1, "exactly one input node is required"
+
+        output_nodes = [node_id for node_id, node in nodes.items() if node.is_output]
+        assert len(output_nodes) == 1, "exactly one output node is required"
+
+        self.input = input_nodes[0]
+        signature = inspect.signature(self.input.input)
+        self.input_type = list(signature.parameters.values())[0].annotation
+
+        # only the output node and its upstreams will be run
+        output_node = output_nodes[0]
+        if output_node in g:
+            upstreams = nx.ancestors(g, output_node)
+            order = [n for n in nx.topological_sort(g) if n in upstreams]
+        else:
+            order = []
+        order.append(output_node)
+        index = dict((node_id, i) for i, node_id in enumerate(order))
+
+        steps = []
+        consumers = [[] for _ in order]
+        for i, node_id in enumerate(order):
+            signature = inspect.signature(nodes[node_id].__call__)
+            defaults = {}
+            required = set()
+            for k, p in signature.parameters.items():
+                if p.default != inspect.Parameter.empty:
+                    defaults[k] = p.default
+                elif p.kind != p.VAR_KEYWORD:
+                    required.add(k)
+
+            links = []
+            if node_id in g:
+                for source, _, properties in g.in_edges(node_id, data=True):
+                    port = properties["port"]
+                    link = Link(
+                        source=index[source],
+                        port=port,
+                        case=properties["case"],
+                        # the None port and unknown port is special, it's required
+                        required=port is None or port not in signature.parameters,
+                    )
+                    links.append(link)
+                    consumers[link.source].append((i, link))
+
+            steps.append(
+                Step(
+                    node_id=node_id,
+                    block=nodes[node_id],
+                    links=tuple(links),
+                    defaults=defaults,
+                    required=frozenset(required),
+                )
+            )
+
+        for step, cs in zip(steps, consumers):
+            step.consumers = tuple(cs)
+        self.steps = tuple(steps)
+        self.output = len(self.steps) - 1
+
+        # the steps whose tokens are streamed as the output, see OutputBlock.stream_port
+        stream_port = getattr(nodes[output_node], "stream_port", None)
+        self.streamed = frozenset(
+            link.source
+            for link in self.steps[self.output].links
+            if stream_port is not None and link.port == stream_port
+        )
+
+    def params(self, index: int, values: List[Any]) -> Optional[dict]:
+        """
+        Collects the parameters of a step from the values of its (finished) upstreams.
+
+        Args:
+            index (int): The index of the step.
+            values (list): The values of the steps.
+
+        Returns:
+            Optional[dict]: The parameters to call the step with, or None if the step
+                should be skipped (its output is None).
+        """
+        step = self.steps[index]
+        if not step.links:
+            # source nodes are called without arguments
+            return {}
+
+        node_params = dict(step.defaults)
+        for link in step.links:
+            value = values[link.source]
+            if link.blocks(value):
+                return None
+            if link.accepts(value):
+                node_params[link.port] = value
+
+        # check if required params are filled
+        if not step.required.issubset(node_params):
+            return None
+        return node_params
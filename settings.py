@@ -0,0 +1,44 @@
+import threading
+from typing import Any, Callable
+
+from environs import Env
+
+
+class EnvSetting:
+    """
+    EnvSetting is a class attribute read from the environment on its first access,
+    instead of when the module is imported, so the values of .env loaded by the
+    entrypoint (and the variables set before the first use) are taken into account.
+
+    Assigning the attribute on the class replaces the setting, e.g. in tests.
+
+    Example:
+
+    ```
+    class Invoker:
+        flush_interval = EnvSetting(
+            lambda env: env.float("INTERACTION_FLUSH_INTERVAL", 0.5)
+        )
+    ```
+    """
+
+    def __init__(self, factory: Callable[[Env], Any]):
+        """
+        Args:
+            factory (callable): A function accepts the loaded environment and returns
+                the value of the setting.
+        """
+        self.factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __get__(self, obj, owner) -> Any:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    env = Env()
+                    env.read_env()
+                    self._value = self.factory(env)
+                    self._loaded = True
+        return self._value
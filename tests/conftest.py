@@ -0,0 +1,65 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+import model
+from blobstore import set_blob_store
+from cache import LRUCache
+from database import Database
+
+
+@pytest.fixture
+def engine():
+    # one connection shared by every thread, so they all see the in-memory database
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    model.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def database(engine, monkeypatch) -> Database:
+    set_blob_store(None)
+    # the caches are shared by the process, they must not leak between the tests
+    monkeypatch.setattr(Database, "application_cache", LRUCache(maxsize=16))
+    monkeypatch.setattr(Database, "version_cache", LRUCache(maxsize=16))
+    return Database(engine)
+
+
+@pytest.fixture
+def create_interaction(database):
+    """
+    Returns a function creating an interaction and returning its ID, created_at
+    increases with every call unless it's given.
+    """
+    start = datetime(2024, 1, 1)
+    count = 0
+
+    def create(**attrs) -> str:
+        nonlocal count
+        count += 1
+        now = start + timedelta(seconds=count)
+        id = str(uuid.uuid4())
+        interaction = model.Interaction(
+            **{
+                "id": id,
+                "user": "user",
+                "app_id": "app",
+                "version_id": "version",
+                "created_at": now,
+                "updated_at": now,
+                "status": model.InteractionStatus.RUNNING,
+                **attrs,
+            }
+        )
+        database.create_interaction(interaction)
+        return id
+
+    return create
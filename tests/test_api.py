@@ -0,0 +1,292 @@
+import json
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import model
+from blocks import AsyncInvoker
+from cache import LRUCache
+from database import Database, get_engine
+from recorder import InteractionRecorder
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    Returns a client of the API and the database it serves, a sqlite file.
+    """
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'api.db'}")
+    monkeypatch.setattr(database, "_engine", None)
+    monkeypatch.setattr(database, "_async_engine", None)
+    monkeypatch.setattr(Database, "application_cache", LRUCache(maxsize=16))
+    monkeypatch.setattr(Database, "version_cache", LRUCache(maxsize=16))
+    model.Base.metadata.create_all(get_engine())
+
+    from app import app
+
+    with TestClient(app) as client:
+        yield client, Database(get_engine())
+    get_engine().dispose()
+
+
+def create_interaction(db: Database, status: str = model.InteractionStatus.RUNNING):
+    now = datetime(2024, 1, 1)
+    db.create_interaction(
+        model.Interaction(
+            id="i",
+            user="user",
+            app_id="a",
+            version_id="v",
+            created_at=now,
+            updated_at=now,
+            status=status,
+        )
+    )
+    return "i"
+
+
+def test_get_interaction_is_conditional(api):
+    client, db = api
+    interaction_id = create_interaction(db)
+
+    response = client.get(f"/interactions/{interaction_id}")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = client.get(
+        f"/interactions/{interaction_id}", headers={"If-None-Match": etag}
+    )
+    assert (response.status_code, response.content) == (304, b"")
+    assert response.headers["etag"] == etag
+    # weak and listed ETags match as well
+    response = client.get(
+        f"/interactions/{interaction_id}",
+        headers={"If-None-Match": f'"other", W/{etag}'},
+    )
+    assert response.status_code == 304
+
+    InteractionRecorder(db, interaction_id, flush_interval=0).record("n", 1)
+    response = client.get(
+        f"/interactions/{interaction_id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["interaction"]["data"] == {"n": 1}
+
+
+def test_long_poll_wakes_up_on_write(api):
+    client, db = api
+    interaction_id = create_interaction(db)
+    etag = client.get(f"/interactions/{interaction_id}").headers["etag"]
+
+    def record():
+        # between two polls of the backoff (at 0.75 and 1.55 seconds), so only the
+        # notification wakes the request up in time
+        time.sleep(0.9)
+        InteractionRecorder(db, interaction_id, flush_interval=0).record("n", 1)
+
+    thread = threading.Thread(target=record)
+    thread.start()
+    start = time.monotonic()
+    response = client.get(
+        f"/interactions/{interaction_id}",
+        params={"wait": 10},
+        headers={"If-None-Match": etag},
+    )
+    elapsed = time.monotonic() - start
+    thread.join()
+    assert response.status_code == 200
+    assert response.json()["interaction"]["data"] == {"n": 1}
+    assert 0.85 < elapsed < 1.5
+
+
+def test_long_poll_times_out_unchanged(api):
+    client, db = api
+    interaction_id = create_interaction(db)
+    etag = client.get(f"/interactions/{interaction_id}").headers["etag"]
+    start = time.monotonic()
+    response = client.get(
+        f"/interactions/{interaction_id}",
+        params={"wait": 0.3},
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 304
+    assert time.monotonic() - start >= 0.3
+
+
+def test_long_poll_returns_completed_interactions_at_once(api):
+    client, db = api
+    interaction_id = create_interaction(db, model.InteractionStatus.SUCCEEDED)
+    start = time.monotonic()
+    response = client.get(f"/interactions/{interaction_id}", params={"wait": 10})
+    assert response.status_code == 200
+    assert response.json()["interaction"]["status"] == "succeeded"
+    assert time.monotonic() - start < 5
+
+
+CONFIG = {
+    "nodes": [
+        {"id": "in", "name": "Text_Input"},
+        {"id": "out", "name": "Text_Output"},
+    ],
+    "edges": [{"src_block": "in", "dst_block": "out", "dst_port": "input"}],
+}
+
+
+def create_application(db: Database) -> str:
+    now = datetime(2024, 1, 1)
+    db.create_application(
+        model.Application(
+            id="a",
+            name="a",
+            user="user",
+            active_version="v",
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    db.create_version(
+        model.ApplicationVersion(
+            id="v",
+            name="v",
+            user="user",
+            app_id="a",
+            configuration=CONFIG,
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    return "a"
+
+
+def batch_run(client: TestClient, app_id: str, inputs: list, **params):
+    response = client.post(
+        f"/applications/{app_id}/batch_run",
+        content="".join(json.dumps(input) + "\n" for input in inputs),
+        headers={"Content-Type": "application/x-ndjson"},
+        params=params,
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    return response.headers["x-batch-id"], results
+
+
+def test_batch_run_streams_a_status_per_item(api):
+    client, db = api
+    app_id = create_application(db)
+    # the input of the second item is not text
+    batch_id, results = batch_run(client, app_id, ["a", {"x": 1}, "c"])
+    assert len(results) == 3
+    results = {result["index"]: result for result in results}
+    assert [results[i]["status"] for i in range(3)] == [
+        "succeeded",
+        "failed",
+        "succeeded",
+    ]
+    assert (results[0]["output"], results[2]["output"]) == ("a", "c")
+    assert results[1]["error"]["status_code"] == 400
+
+    # the item failed before it's run is recorded as well
+    response = client.get(f"/batches/{batch_id}/results")
+    recorded = [json.loads(line) for line in response.text.splitlines()]
+    assert recorded == [results[i] for i in range(3)]
+
+
+def test_batch_run_resumes_by_batch_id(api):
+    client, db = api
+    app_id = create_application(db)
+    batch_id, first = batch_run(client, app_id, ["a", {"x": 1}, "c"])
+    first = {result["index"]: result for result in first}
+
+    resumed_id, results = batch_run(client, app_id, ["a", "b", "c"], batch_id=batch_id)
+    assert resumed_id == batch_id
+    # the succeeded items are sent first without being run again
+    assert [(r["index"], r["id"]) for r in results[:2]] == [
+        (0, first[0]["id"]),
+        (2, first[2]["id"]),
+    ]
+    assert (results[2]["index"], results[2]["status"]) == (1, "succeeded")
+    assert results[2]["output"] == "b"
+
+
+def test_run_returns_the_output(api):
+    client, db = api
+    app_id = create_application(db)
+    response = client.post(f"/applications/{app_id}/run", json={"input": "a"})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["status"], body["output"]) == ("succeeded", "a")
+    assert db.get_interaction(body["id"]) is not None
+
+
+def test_run_answers_202_with_a_created_interaction(api, monkeypatch):
+    client, db = api
+    app_id = create_application(db)
+    release = threading.Event()
+    execute = AsyncInvoker.execute
+
+    def slow_execute(self, *args, **kwargs):
+        release.wait(5)
+        return execute(self, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncInvoker, "execute", slow_execute)
+    response = client.post(
+        f"/applications/{app_id}/run", json={"input": "a"}, params={"timeout": 0.1}
+    )
+    assert response.status_code == 202
+    interaction_id = response.json()["id"]
+    # created before the run is submitted, so it's polled at once
+    response = client.get(f"/interactions/{interaction_id}")
+    assert response.json()["interaction"]["status"] == "running"
+
+    release.set()
+    response = client.get(f"/interactions/{interaction_id}", params={"wait": 10})
+    assert response.json()["interaction"]["output"] == "a"
+
+
+def parse_events(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        name, data = block.split("\n")
+        events.append((name[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+def test_stored_events_truncate_large_values(api, monkeypatch):
+    client, db = api
+    monkeypatch.setattr(InteractionRecorder, "spill_size", 64)
+    monkeypatch.setattr(InteractionRecorder, "preview_size", 5)
+    interaction_id = create_interaction(db)
+    recorder = InteractionRecorder(db, interaction_id, flush_interval=0)
+    recorder.record("small", "small")
+    recorder.record("large", "large " * 20)
+    recorder.close({"output": "out", "status": model.InteractionStatus.SUCCEEDED})
+
+    response = client.get(f"/interactions/{interaction_id}/events")
+    events = parse_events(response.text)
+    nodes = {event["node_id"]: event for name, event in events if name == "node"}
+    assert (nodes["small"]["value"], nodes["small"]["blob_size"]) == ("small", None)
+    assert nodes["large"]["value"] == "large"
+    assert nodes["large"]["blob_size"] == len(json.dumps("large " * 20))
+    assert events[-1] == (
+        "end",
+        {"status": "succeeded", "output": "out", "error": None},
+    )
+
+
+def test_stream_run_sends_the_events_of_the_run(api):
+    client, db = api
+    app_id = create_application(db)
+    response = client.post(f"/applications/{app_id}/stream_run", json={"input": "a"})
+    events = parse_events(response.text)
+    assert events[0][0] == "interaction"
+    assert {event["node_id"] for name, event in events if name == "node"} == {
+        "in",
+        "out",
+    }
+    assert events[-1][0] == "end"
+    assert (events[-1][1]["status"], events[-1][1]["output"]) == ("succeeded", "a")
@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import model
+from database import AsyncDatabase, Database, next_cursor
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def databases(tmp_path):
+    """
+    Returns a Database and an AsyncDatabase of the same sqlite file, so the rows
+    written by one are read by the other.
+    """
+    path = tmp_path / "db.sqlite"
+    engine = create_engine(f"sqlite:///{path}")
+    model.Base.metadata.create_all(engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    yield Database(engine), AsyncDatabase(async_engine)
+    asyncio.run(async_engine.dispose())
+    engine.dispose()
+
+
+def application(id: str, seconds: int) -> model.Application:
+    now = START + timedelta(seconds=seconds)
+    return model.Application(
+        id=id, name=id, user="user", created_at=now, updated_at=now
+    )
+
+
+def version(id: str, app_id: str, seconds: int) -> model.ApplicationVersion:
+    now = START + timedelta(seconds=seconds)
+    return model.ApplicationVersion(
+        id=id,
+        name=id,
+        user="user",
+        app_id=app_id,
+        configuration={"nodes": [], "edges": []},
+        created_at=now,
+        updated_at=now,
+    )
+
+
+def test_get_and_list_applications(databases):
+    _, db = databases
+
+    async def check():
+        await db.create_application(application("a", 1))
+        await db.create_application(application("b", 2))
+        await db.create_application(application("c", 3))
+        await db.update_application("c", {"deleted_at": START})
+
+        assert (await db.get_application("a")).name == "a"
+        assert await db.get_application("missing") is None
+        # the deleted ones are left out, the newest first
+        assert [app.id for app in await db.list_applications()] == ["b", "a"]
+
+        await db.update_application("a", {"name": "renamed"})
+        assert (await db.get_application("a")).name == "renamed"
+
+    asyncio.run(check())
+
+
+def test_get_and_list_versions(databases):
+    _, db = databases
+
+    async def check():
+        await db.create_version(version("v1", "a", 1))
+        await db.create_version(version("v2", "a", 2))
+        await db.create_version(version("v3", "a", 3))
+        await db.create_version(version("w1", "b", 4))
+        await db.update_version("v3", {"deleted_at": START})
+
+        assert (await db.get_version("v1")).configuration == {
+            "nodes": [],
+            "edges": [],
+        }
+        assert await db.get_version("missing") is None
+        assert [v.id for v in await db.list_versions("a")] == ["v2", "v1"]
+
+        await db.update_version("v1", {"name": "renamed"})
+        assert (await db.get_version("v1")).name == "renamed"
+
+    asyncio.run(check())
+
+
+def test_get_interactions_and_their_nodes(databases):
+    sync_db, db = databases
+    sync_db.create_interaction(
+        model.Interaction(
+            id="i",
+            user="user",
+            app_id="a",
+            version_id="v1",
+            created_at=START,
+            updated_at=START,
+            status=model.InteractionStatus.RUNNING,
+        )
+    )
+    sync_db.add_interaction_nodes(
+        "i",
+        [
+            model.InteractionNode(
+                interaction_id="i",
+                node_id=node_id,
+                value=node_id.upper(),
+                status=model.InteractionNodeStatus.SUCCEEDED,
+                finished_at=START + timedelta(seconds=seconds),
+            )
+            for node_id, seconds in [("out", 2), ("in", 1)]
+        ],
+    )
+
+    async def check():
+        interaction = await db.get_interaction("i")
+        assert interaction.status == model.InteractionStatus.RUNNING
+        assert await db.get_interaction("missing") is None
+
+        nodes = await db.list_interaction_nodes("i")
+        assert [node.node_id for node in nodes] == ["in", "out"]
+        assert await db.get_interaction_data(interaction) == {"in": "IN", "out": "OUT"}
+        assert await db.get_interaction_data(interaction, ["out"]) == {"out": "OUT"}
+
+    asyncio.run(check())
+
+
+def test_get_interaction_data_of_legacy_interactions(databases):
+    _, db = databases
+    interaction = model.Interaction(id="legacy", data={"in": "IN", "out": "OUT"})
+
+    async def check():
+        assert await db.get_interaction_data(interaction) == {"in": "IN", "out": "OUT"}
+        assert await db.get_interaction_data(interaction, ["in"]) == {"in": "IN"}
+
+    asyncio.run(check())
+
+
+def test_list_interactions_by_page(databases):
+    sync_db, db = databases
+    for i in range(5):
+        now = START + timedelta(seconds=i)
+        sync_db.create_interaction(
+            model.Interaction(
+                id=f"i{i}",
+                user="user",
+                app_id="a" if i < 4 else "b",
+                version_id="v1" if i % 2 else "v2",
+                created_at=now,
+                updated_at=now,
+                output=f"out{i}",
+                data={"large": "data"},
+                status=model.InteractionStatus.SUCCEEDED,
+            )
+        )
+
+    async def check():
+        first = await db.list_interactions("a", limit=3)
+        assert [i.id for i in first] == ["i3", "i2", "i1"]
+        rest = await db.list_interactions("a", limit=3, cursor=next_cursor(first, 3))
+        assert [i.id for i in rest] == ["i0"]
+        assert next_cursor(rest, 3) is None
+
+        versions = await db.list_interactions("a", version_id="v1")
+        assert [(i.id, i.output) for i in versions] == [("i3", "out3"), ("i1", "out1")]
+
+    asyncio.run(check())
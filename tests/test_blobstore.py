@@ -0,0 +1,151 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from blobstore import BlobStore, LocalBlobStore, get_blob_store, set_blob_store
+from model import Application
+from recorder import InteractionRecorder
+from retention import InteractionArchiver, RetentionJob
+
+LARGE = "large output " * 10
+
+
+@pytest.fixture
+def blob_store(database, tmp_path, monkeypatch):
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+    set_blob_store(store)
+    monkeypatch.setattr(InteractionRecorder, "spill_size", 64)
+    monkeypatch.setattr(InteractionRecorder, "preview_size", 5)
+    yield store
+    set_blob_store(None)
+
+
+def test_local_blob_store(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    store.put("interactions/i/a.json", b"0123456789")
+    assert store.get("interactions/i/a.json") == b"0123456789"
+    assert list(store.open("interactions/i/a.json", chunk_size=4)) == [
+        b"0123",
+        b"4567",
+        b"89",
+    ]
+    store.put("interactions/i/a.json", b"replaced")
+    assert store.get("interactions/i/a.json") == b"replaced"
+
+    store.delete(["interactions/i/a.json", "interactions/i/missing.json"])
+    with pytest.raises(KeyError):
+        store.open("interactions/i/a.json")
+    # the keys can't point outside the directory
+    with pytest.raises(KeyError):
+        store.put("../outside.json", b"")
+
+
+def test_blob_stores_implement_every_method():
+    class Incomplete(BlobStore):
+        def put(self, key, data):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_recorder_spills_large_outputs(database, create_interaction, blob_store):
+    interaction_id = create_interaction()
+    recorder = InteractionRecorder(database, interaction_id, flush_interval=0)
+    recorder.record("small", "small")
+    recorder.record("large/node", LARGE)
+    recorder.record("dict", {"text": LARGE})
+
+    nodes = {n.node_id: n for n in database.list_interaction_nodes(interaction_id)}
+    assert (nodes["small"].value, nodes["small"].blob_key) == ("small", None)
+    assert nodes["large/node"].value == LARGE[:5]
+    # the preview of other values is their JSON
+    assert nodes["dict"].value == '{"tex'
+    for node_id, value in [("large/node", LARGE), ("dict", {"text": LARGE})]:
+        node = nodes[node_id]
+        data = blob_store.get(node.blob_key)
+        assert json.loads(data) == value
+        assert node.blob_size == len(data)
+    # the key of a node is escaped into a single file name
+    assert nodes["large/node"].blob_key == (
+        f"interactions/{interaction_id}/large%2Fnode.json"
+    )
+
+
+def test_blob_store_is_configured_by_env(monkeypatch, tmp_path):
+    monkeypatch.setattr("blobstore._blob_store_loaded", False)
+    monkeypatch.setenv("BLOB_STORE_DIR", str(tmp_path))
+    store = get_blob_store()
+    assert isinstance(store, LocalBlobStore)
+    assert store.directory == str(tmp_path.resolve())
+    set_blob_store(None)
+
+
+def test_retention_archives_and_deletes_blobs(
+    database, create_interaction, blob_store, tmp_path
+):
+    now = datetime(2024, 1, 1)
+    database.create_application(
+        Application(
+            id="app",
+            name="app",
+            user="user",
+            retention_days=1,
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    interaction_id = create_interaction(app_id="app")
+    recorder = InteractionRecorder(database, interaction_id, flush_interval=0)
+    recorder.record("large", LARGE)
+    (node,) = database.list_interaction_nodes(interaction_id)
+
+    job = RetentionJob(
+        database,
+        batch_pause=0,
+        archiver=InteractionArchiver(str(tmp_path / "archive")),
+        blob_store=blob_store,
+    )
+    assert job.purge() == 1
+    with pytest.raises(KeyError):
+        blob_store.get(node.blob_key)
+
+    (path,) = (tmp_path / "archive" / "app" / "2024-01-01").iterdir()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        (record,) = [json.loads(line) for line in f]
+    # archived in full rather than the preview
+    assert record["nodes"][0]["value"] == LARGE
+
+
+def test_retention_deletes_blobs_without_reading_the_nodes(
+    database, create_interaction, blob_store, monkeypatch
+):
+    now = datetime(2024, 1, 1)
+    database.create_application(
+        Application(
+            id="app",
+            name="app",
+            user="user",
+            retention_days=1,
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    interaction_id = create_interaction(app_id="app")
+    recorder = InteractionRecorder(database, interaction_id, flush_interval=0)
+    recorder.record("small", "small")
+    recorder.record("large", LARGE)
+    assert database.list_blob_keys_of_interactions([interaction_id]) == [
+        f"interactions/{interaction_id}/large.json"
+    ]
+
+    def list_nodes(ids):
+        raise AssertionError("the nodes are read")
+
+    monkeypatch.setattr(database, "list_nodes_of_interactions", list_nodes)
+    job = RetentionJob(database, batch_pause=0, blob_store=blob_store)
+    assert job.purge() == 1
+    with pytest.raises(KeyError):
+        blob_store.get(f"interactions/{interaction_id}/large.json")
@@ -0,0 +1,234 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
+
+import cache
+import model
+from blocks import AsyncInvoker
+from cache import LRUCache
+from database import AsyncDatabase, Database
+from model import Application, ApplicationVersion
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_lru_counts_hits_and_misses():
+    lru = LRUCache(maxsize=2)
+    lru.put("a", 1)
+    assert lru.get("a") == 1
+    assert lru.get("b") is None
+    assert lru.get("b", 2) == 2
+    assert lru.stats() == {
+        "size": 1,
+        "maxsize": 2,
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+    }
+
+
+def test_lru_evicts_the_least_recently_used():
+    lru = LRUCache(maxsize=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    # a is used, so b is the least recently used one
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+    assert lru.evictions == 1
+    assert len(lru) == 2
+
+
+def test_lru_expires_entries_after_ttl(clock):
+    lru = LRUCache(maxsize=2, ttl=10)
+    lru.put("a", 1)
+    clock.now = 10
+    assert lru.get("a") == 1
+    clock.now = 10.5
+    assert lru.get("a") is None
+    assert len(lru) == 0
+    # putting an entry again restarts its ttl
+    lru.put("a", 2)
+    clock.now = 20
+    assert lru.get("a") == 2
+
+
+def test_lru_pop_and_invalidate():
+    lru = LRUCache(maxsize=8)
+    for key in [("v1", "x"), ("v1", "y"), ("v2", "x")]:
+        lru.put(key, key)
+    assert lru.pop(("v2", "x")) == ("v2", "x")
+    assert lru.pop(("v2", "x")) is None
+    assert lru.invalidate(lambda key: key[0] == "v1") == 2
+    assert len(lru) == 0
+
+
+CONFIG = {
+    "nodes": [
+        {"id": "in", "name": "Text_Input"},
+        {"id": "out", "name": "Text_Output"},
+    ],
+    "edges": [{"src_block": "in", "dst_block": "out", "dst_port": "input"}],
+}
+
+
+def version(id: str, configuration: dict) -> ApplicationVersion:
+    return ApplicationVersion(id=id, configuration=configuration)
+
+
+@pytest.fixture
+def invoker(monkeypatch):
+    monkeypatch.setattr(AsyncInvoker, "graph_cache", LRUCache(maxsize=2))
+    return AsyncInvoker(None)
+
+
+def test_graph_cache_reuses_the_graph_of_a_version(invoker):
+    graph = invoker.get_graph(version("v1", CONFIG))
+    assert invoker.get_graph(version("v1", CONFIG)) is graph
+    assert graph.run("hi", {}) == "hi"
+    assert invoker.graph_cache.stats()["hits"] == 1
+
+
+def test_graph_cache_misses_on_a_changed_configuration(invoker):
+    graph = invoker.get_graph(version("v1", CONFIG))
+    changed = {
+        "nodes": [
+            {"id": "in", "name": "Text_Input"},
+            {"id": "result", "name": "Text_Output"},
+        ],
+        "edges": [{"src_block": "in", "dst_block": "result", "dst_port": "input"}],
+    }
+    assert invoker.get_graph(version("v1", changed)) is not graph
+    assert invoker.graph_cache.stats()["misses"] == 2
+
+
+def test_graph_cache_evicts_and_invalidates_versions(invoker):
+    graph = invoker.get_graph(version("v1", CONFIG))
+    invoker.get_graph(version("v2", CONFIG))
+    invoker.get_graph(version("v3", CONFIG))
+    assert invoker.graph_cache.evictions == 1
+    assert invoker.get_graph(version("v1", CONFIG)) is not graph
+
+    graph = invoker.get_graph(version("v1", CONFIG))
+    AsyncInvoker.invalidate_graph("v1")
+    assert invoker.get_graph(version("v1", CONFIG)) is not graph
+
+
+@pytest.fixture
+def caches(monkeypatch, clock):
+    monkeypatch.setattr(Database, "application_cache", LRUCache(maxsize=2, ttl=10))
+    monkeypatch.setattr(Database, "version_cache", LRUCache(maxsize=2, ttl=10))
+    invalidated = []
+    monkeypatch.setattr(
+        Database, "invalidation_hooks", [lambda *args: invalidated.append(args)]
+    )
+    return invalidated
+
+
+def create_application(database: Database, id: str):
+    now = datetime(2024, 1, 1)
+    database.create_application(
+        Application(id=id, name=id, user="user", created_at=now, updated_at=now)
+    )
+
+
+def rename_behind_the_cache(database: Database, id: str, name: str):
+    with Session(database.engine) as session:
+        session.query(Application).filter(Application.id == id).update({"name": name})
+        session.commit()
+
+
+def test_database_caches_applications_until_ttl(database, caches, clock):
+    create_application(database, "a")
+    assert database.get_application("a").name == "a"
+    rename_behind_the_cache(database, "a", "renamed")
+    assert database.get_application("a").name == "a"
+    assert Database.application_cache.stats()["hits"] == 1
+    # missing applications are not cached
+    assert database.get_application("missing") is None
+    assert len(Database.application_cache) == 1
+
+    clock.now = 11
+    assert database.get_application("a").name == "renamed"
+
+
+def test_database_caches_versions(database, caches):
+    now = datetime(2024, 1, 1)
+    database.create_version(
+        ApplicationVersion(
+            id="v1",
+            name="v1",
+            user="user",
+            app_id="a",
+            configuration=CONFIG,
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    assert database.get_version("v1") is database.get_version("v1")
+    database.update_version("v1", {"deleted_at": now})
+    assert database.get_version("v1").deleted_at == now
+    assert caches == [("version", "v1")]
+
+
+def test_database_updates_invalidate_and_broadcast(database, caches):
+    create_application(database, "a")
+    database.get_application("a")
+    database.update_application("a", {"name": "renamed"})
+    assert database.get_application("a").name == "renamed"
+    assert caches == [("application", "a")]
+
+    # an invalidation received from another process is not broadcast again
+    Database.invalidate("application", "a", broadcast=False)
+    assert Database.application_cache.get("a") is None
+    assert caches == [("application", "a")]
+
+
+def test_async_database_updates_invalidate(caches, tmp_path):
+    path = tmp_path / "db.sqlite"
+    engine = create_engine(f"sqlite:///{path}")
+    model.Base.metadata.create_all(engine)
+    database = Database(engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async_database = AsyncDatabase(async_engine)
+
+    create_application(database, "a")
+    database.get_application("a")
+
+    async def delete():
+        await async_database.update_application("a", {"deleted_at": datetime.now()})
+        await async_engine.dispose()
+
+    asyncio.run(delete())
+    assert database.get_application("a").deleted_at is not None
+    assert caches == [("application", "a")]
+    engine.dispose()
+
+
+def test_failed_invalidation_hook_is_logged(caches, caplog):
+    def fail(kind, key):
+        raise ConnectionError("down")
+
+    Database.invalidation_hooks.insert(0, fail)
+    Database.invalidate("version", "v1")
+    assert caches == [("version", "v1")]
+    assert "failed to broadcast invalidation of version v1" in caplog.text
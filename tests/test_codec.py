@@ -0,0 +1,99 @@
+import pytest
+from sqlalchemy import text
+
+from codec import HEADER, Codec, EncodedValue, ZlibCodec, create_codec
+
+DATA = {"node": {"text": "hello " * 100, "items": [1, 2.5, None, True]}}
+OUTPUT = "hello, world " * 100
+
+
+def codec_names():
+    names = ["none", "zlib"]
+    try:
+        create_codec("zstd")
+        names.append("zstd")
+    except ImportError:
+        pass
+    return names
+
+
+def set_codec(monkeypatch, name: str):
+    monkeypatch.setattr(EncodedValue, "codec", create_codec(name))
+
+
+def stored(engine, interaction_id: str) -> tuple:
+    with engine.connect() as connection:
+        return tuple(
+            connection.execute(
+                text("SELECT output, data FROM interactions WHERE id = :id"),
+                {"id": interaction_id},
+            ).one()
+        )
+
+
+@pytest.mark.parametrize("name", codec_names())
+def test_round_trip(monkeypatch, engine, database, create_interaction, name):
+    set_codec(monkeypatch, name)
+    interaction_id = create_interaction(output=OUTPUT, data=DATA)
+    interaction = database.get_interaction(interaction_id)
+    assert (interaction.output, interaction.data) == (OUTPUT, DATA)
+
+    output, data = stored(engine, interaction_id)
+    if name == "none":
+        assert bytes(output) == OUTPUT.encode()
+    else:
+        codec = EncodedValue.codec
+        assert bytes(output)[:2] == HEADER + bytes([codec.id])
+        assert bytes(data)[:2] == HEADER + bytes([codec.id])
+        assert len(output) < len(OUTPUT)
+
+
+@pytest.mark.parametrize("written", codec_names())
+@pytest.mark.parametrize("configured", codec_names())
+def test_read_with_other_codec(
+    monkeypatch, database, create_interaction, written, configured
+):
+    set_codec(monkeypatch, written)
+    interaction_id = create_interaction(output=OUTPUT, data=DATA)
+    set_codec(monkeypatch, configured)
+    interaction = database.get_interaction(interaction_id)
+    assert (interaction.output, interaction.data) == (OUTPUT, DATA)
+
+
+def test_read_plain_text(engine, database, create_interaction):
+    # written as text before the columns are converted to binary
+    interaction_id = create_interaction()
+    with engine.begin() as connection:
+        connection.execute(
+            text("UPDATE interactions SET output = :output, data = :data"),
+            {"output": OUTPUT, "data": '{"a": 1}'},
+        )
+    interaction = database.get_interaction(interaction_id)
+    assert (interaction.output, interaction.data) == (OUTPUT, {"a": 1})
+
+
+def test_stats_count_stored_bytes(monkeypatch, create_interaction):
+    set_codec(monkeypatch, "zlib")
+    monkeypatch.setattr(EncodedValue, "stats", type(EncodedValue.stats)())
+    create_interaction(output=OUTPUT)
+    stats = EncodedValue.stats.stats()
+    assert stats["values"] == 1
+    assert stats["raw_bytes"] == len(OUTPUT.encode())
+    assert stats["stored_bytes"] == len(
+        HEADER + bytes([ZlibCodec.id]) + ZlibCodec().compress(OUTPUT.encode())
+    )
+    assert stats["ratio"] > 1
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        create_codec("lz4")
+
+
+def test_codecs_implement_every_method():
+    class Incomplete(Codec):
+        def serialize(self, value):
+            return b""
+
+    with pytest.raises(TypeError):
+        Incomplete()
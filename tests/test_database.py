@@ -0,0 +1,138 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import Lease, decode_cursor, encode_cursor, next_cursor
+from exceptions import InteractionLeaseLost, InvalidCursor
+from model import Application, InteractionNode, InteractionStatus
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 1, 2, 3, 4, 5, 6)
+    assert decode_cursor(encode_cursor(created_at, "id")) == (created_at, "id")
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not a cursor")
+
+
+def test_paginate_walks_every_row_once(database):
+    now = datetime(2024, 1, 1)
+    # pairs of rows share created_at, so the ties are ordered by id
+    ids = []
+    for i in range(7):
+        id, created_at = str(uuid.uuid4()), now + timedelta(seconds=i // 2)
+        database.create_application(
+            Application(
+                id=id,
+                name=f"app{i}",
+                user="user",
+                created_at=created_at,
+                updated_at=now,
+            )
+        )
+        ids.append((created_at, id))
+    expected = [id for _, id in sorted(ids, reverse=True)]
+
+    pages, cursor = [], None
+    while True:
+        page = database.list_applications(limit=3, cursor=cursor)
+        pages.append([app.id for app in page])
+        cursor = next_cursor(page, 3)
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == expected
+    assert [app.id for app in database.list_applications()] == expected
+
+
+def test_next_cursor_of_last_page():
+    assert next_cursor([], 3) is None
+    assert next_cursor([object()], 3) is None
+    assert next_cursor([object()], None) is None
+
+
+def test_claim_oldest_pending(database, create_interaction):
+    first = create_interaction(status=InteractionStatus.PENDING)
+    second = create_interaction(status=InteractionStatus.PENDING)
+    create_interaction(status=InteractionStatus.PENDING)
+    create_interaction(status=InteractionStatus.SUCCEEDED)
+
+    claimed = database.claim_interactions("worker", 2)
+    assert [i.id for i in claimed] == [first, second]
+    for interaction in claimed:
+        stored = database.get_interaction(interaction.id)
+        assert stored.status == InteractionStatus.RUNNING
+        assert stored.worker_id == "worker"
+        assert stored.attempts == 1
+    assert len(database.claim_interactions("other", 10)) == 1
+    assert database.claim_interactions("other", 10) == []
+
+
+def expire_heartbeat(database, interaction_id: str):
+    database.update_interaction(
+        interaction_id, {"heartbeat_at": datetime.utcnow() - timedelta(hours=1)}
+    )
+
+
+def test_requeue_stale_interactions(database, create_interaction):
+    interaction = create_interaction(status=InteractionStatus.PENDING)
+    fresh = create_interaction(status=InteractionStatus.PENDING)
+    database.claim_interactions("worker", 2)
+    database.add_interaction_nodes(
+        interaction,
+        [
+            InteractionNode(
+                interaction_id=interaction,
+                node_id="node",
+                value="value",
+                status="succeeded",
+                finished_at=datetime.utcnow(),
+            )
+        ],
+    )
+    expire_heartbeat(database, interaction)
+
+    assert database.requeue_interactions(timedelta(minutes=1), max_attempts=2) == 1
+    stored = database.get_interaction(interaction)
+    assert stored.status == InteractionStatus.PENDING
+    assert stored.worker_id is None
+    assert database.list_interaction_nodes(interaction) == []
+    assert database.get_interaction(fresh).status == InteractionStatus.RUNNING
+
+    # the second attempt is the last one
+    assert [i.id for i in database.claim_interactions("other", 1)] == [interaction]
+    expire_heartbeat(database, interaction)
+    assert database.requeue_interactions(timedelta(minutes=1), max_attempts=2) == 1
+    stored = database.get_interaction(interaction)
+    assert stored.status == InteractionStatus.FAILED
+    assert stored.error["content"]["code"] == "worker_lost"
+
+
+def test_heartbeat_keeps_interactions_claimed(database, create_interaction):
+    interaction = create_interaction(status=InteractionStatus.PENDING)
+    database.claim_interactions("worker", 1)
+    expire_heartbeat(database, interaction)
+    assert database.heartbeat_interactions("worker", [interaction]) == []
+    assert database.requeue_interactions(timedelta(minutes=1), max_attempts=3) == 0
+    assert database.get_interaction(interaction).status == InteractionStatus.RUNNING
+
+
+def test_lease_fences_requeued_interaction(database, create_interaction):
+    interaction = create_interaction(status=InteractionStatus.PENDING)
+    (claimed,) = database.claim_interactions("worker", 1)
+    lease = Lease("worker", claimed.attempts)
+    database.update_interaction(interaction, {"output": "first"}, lease=lease)
+
+    expire_heartbeat(database, interaction)
+    database.requeue_interactions(timedelta(minutes=1), max_attempts=3)
+    assert database.heartbeat_interactions("worker", [interaction]) == [interaction]
+    (reclaimed,) = database.claim_interactions("worker", 1)
+    new_lease = Lease("worker", reclaimed.attempts)
+
+    # the same worker, but the previous attempt
+    with pytest.raises(InteractionLeaseLost):
+        database.update_interaction(interaction, {"output": "stale"}, lease=lease)
+    assert lease.lost.is_set()
+    database.update_interaction(interaction, {"output": "second"}, lease=new_lease)
+    assert database.get_interaction(interaction).output == "second"
+    assert not new_lease.lost.is_set()
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+from exceptions import (
+    ApplicationConcurrencyExceeded,
+    AsyncExceptionHandler,
+    ExecutorQueueFull,
+    register_exception_handlers,
+)
+from executor import InvokeExecutor
+
+
+def status_code(e: Exception) -> int:
+    h = AsyncExceptionHandler()
+    register_exception_handlers(h)
+    return h.render(e).status_code
+
+
+def start_blocking(executor: InvokeExecutor, app_id: str) -> threading.Event:
+    """
+    Submits a task which holds its worker until the returned event is set.
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def task():
+        started.set()
+        release.wait(5)
+
+    executor.reserve(app_id).submit(task)
+    assert started.wait(5)
+    return release
+
+
+def wait_until(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def wait_idle(executor: InvokeExecutor):
+    done = threading.Event()
+    executor.reserve("idle").submit(done.set)
+    assert done.wait(5)
+
+
+def test_full_queue_rejects_with_503():
+    executor = InvokeExecutor(max_workers=1, max_queue_size=1)
+    release = start_blocking(executor, "a")
+    queued = executor.reserve("a")
+    with pytest.raises(ExecutorQueueFull) as e:
+        executor.reserve("b")
+    assert status_code(e.value) == 503
+    assert executor.stats()["queue_depth"] == 1
+    assert executor.stats()["rejected"] == 1
+
+    queued.release()
+    release.set()
+    wait_idle(executor)
+    assert executor.stats()["queue_depth"] == 0
+
+
+def test_application_limit_rejects_with_429():
+    executor = InvokeExecutor(max_workers=2, max_queue_size=8, max_app_concurrency=1)
+    release = start_blocking(executor, "a")
+    with pytest.raises(ApplicationConcurrencyExceeded) as e:
+        executor.reserve("a")
+    assert status_code(e.value) == 429
+    # other applications are not limited by a
+    executor.reserve("b").release()
+
+    release.set()
+    # the place of a is given back once its task returns
+    wait_until(lambda: executor.stats()["inflight_apps"] == 0)
+    executor.reserve("a").release()
+
+
+def test_released_and_failed_slots_are_given_back():
+    executor = InvokeExecutor(max_workers=1, max_queue_size=1, max_app_concurrency=1)
+    executor.reserve("a").release()
+
+    failed = threading.Event()
+
+    def fail():
+        failed.set()
+        raise ValueError("boom")
+
+    executor.reserve("a").submit(fail)
+    assert failed.wait(5)
+    wait_idle(executor)
+    stats = executor.stats()
+    assert (stats["active_workers"], stats["queue_depth"]) == (0, 0)
+    assert stats["inflight_apps"] == 0
+    # both places of a are free again
+    executor.reserve("a").release()
+
+
+def test_nested_tasks_bypass_the_queue_and_the_limit():
+    executor = InvokeExecutor(max_workers=1, max_queue_size=1, max_app_concurrency=1)
+    full = threading.Event()
+    result = {}
+
+    def inner():
+        result["nested"] = InvokeExecutor.in_task()
+        result["thread"] = threading.get_ident()
+
+    def outer():
+        # the only worker is taken by this task and the queue is full, the
+        # nested task of the same application still gets a place
+        full.wait(5)
+        slot = executor.reserve("a")
+        result["apps"] = executor.stats()["inflight_apps"]
+        slot.submit(inner)
+        # run before submit returns, on the thread of the parent
+        result["outer"] = threading.get_ident()
+
+    release = start_blocking(executor, "b")
+    executor.reserve("a").submit(outer)
+    release.set()
+    # the outer task is dequeued before it waits for the queue to be full
+    wait_until(lambda: executor.stats()["queue_depth"] == 0)
+    queued = executor.reserve("c")
+    full.set()
+    wait_until(lambda: "outer" in result)
+    queued.release()
+    wait_until(lambda: executor.stats()["inflight_apps"] == 0)
+    assert result["nested"] is True
+    assert result["apps"] == 2
+    assert result["thread"] == result["outer"]
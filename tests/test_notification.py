@@ -0,0 +1,47 @@
+import asyncio
+
+from notification import EventBus
+
+
+def received(bus: EventBus, key: str) -> list:
+    async def receive():
+        subscription = bus.subscribe(key)
+        events = []
+        try:
+            while (event := await subscription.get(1)) is not None:
+                events.append(event)
+        finally:
+            subscription.close()
+        return events
+
+    async def run():
+        task = asyncio.create_task(receive())
+        await asyncio.sleep(0)
+        bus.close(key)
+        return await task
+
+    return asyncio.run(run())
+
+
+def test_late_subscribers_receive_the_kept_events():
+    bus = EventBus()
+    bus.open("k")
+    bus.publish("k", "a")
+    bus.publish("k", "b")
+    assert received(bus, "k") == ["a", "b"]
+    assert len(bus) == 0
+
+
+def test_events_replace_the_ones_they_supersede():
+    bus = EventBus()
+    bus.open("k")
+    for event in ["token:a", "token:b", "token:a", "other"]:
+        bus.publish("k", event)
+    bus.publish("k", "node:a", replaces=lambda e: e == "token:a")
+    assert received(bus, "k") == ["token:b", "other", "node:a"]
+
+
+def test_publish_ignores_keys_not_opened():
+    bus = EventBus()
+    bus.publish("k", "a")
+    assert bus.subscribe("k") is None
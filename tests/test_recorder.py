@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from blocks import AsyncInvoker
+from database import Lease
+from exceptions import InteractionLeaseLost, InvalidPersistencePolicy
+from model import (
+    Application,
+    ApplicationVersion,
+    InteractionNodeStatus,
+    InteractionStatus,
+)
+from recorder import InteractionRecorder, PersistencePolicy
+
+
+@pytest.mark.parametrize(
+    "policy", ["all", "output_only", "on_error", "sampled:0", "sampled:12.5"]
+)
+def test_validate_policy(policy):
+    assert PersistencePolicy.validate(policy) == policy
+
+
+@pytest.mark.parametrize("policy", ["none", "sampled", "sampled:x", "sampled:101"])
+def test_validate_invalid_policy(policy):
+    with pytest.raises(InvalidPersistencePolicy):
+        PersistencePolicy.validate(policy)
+
+
+def test_persisted_nodes():
+    assert PersistencePolicy.persisted_nodes("all", "out") is None
+    assert PersistencePolicy.persisted_nodes("output_only", "out") == {"out"}
+    assert PersistencePolicy.persisted_nodes("on_error", "out") == set()
+    assert PersistencePolicy.persisted_nodes("sampled:100", "out") is None
+    assert PersistencePolicy.persisted_nodes("sampled:0", "out") == set()
+
+
+@pytest.mark.parametrize(
+    "app_policy,version_policy,policy",
+    [
+        (None, None, "all"),
+        ("on_error", None, "on_error"),
+        ("on_error", "output_only", "output_only"),
+    ],
+)
+def test_version_policy_overrides_application(
+    monkeypatch, app_policy, version_policy, policy
+):
+    monkeypatch.setattr(AsyncInvoker, "persistence_policy", "all")
+    app = Application(id="a", persistence_policy=app_policy)
+    version = ApplicationVersion(id="v1", persistence_policy=version_policy)
+    assert AsyncInvoker(None).get_persistence_policy(app, version) == policy
+
+
+def stored_nodes(database, interaction_id: str) -> dict:
+    return {
+        node.node_id: (node.value, node.status)
+        for node in database.list_interaction_nodes(interaction_id)
+    }
+
+
+def test_flush_every_record(database, create_interaction):
+    interaction_id = create_interaction()
+    recorder = InteractionRecorder(database, interaction_id, flush_interval=0)
+    recorder.start("a")
+    recorder.record("a", {"x": 1})
+    # settled without being started
+    recorder.record("b", None)
+    assert stored_nodes(database, interaction_id) == {
+        "a": ({"x": 1}, InteractionNodeStatus.SUCCEEDED),
+        "b": (None, InteractionNodeStatus.SKIPPED),
+    }
+    recorder.close({"output": "done", "status": InteractionStatus.SUCCEEDED})
+    interaction = database.get_interaction(interaction_id)
+    assert (interaction.output, interaction.status) == (
+        "done",
+        InteractionStatus.SUCCEEDED,
+    )
+
+
+def wait_for_nodes(database, interaction_id: str, count: int):
+    deadline = time.monotonic() + 5
+    while len(stored_nodes(database, interaction_id)) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_flush_is_coalesced(database, create_interaction):
+    interaction_id = create_interaction()
+    recorder = InteractionRecorder(database, interaction_id, flush_interval=1)
+    # the first record is written at once, the next ones a flush interval later
+    recorder.record("a", "a")
+    wait_for_nodes(database, interaction_id, 1)
+    recorder.record("b", "b")
+    recorder.record("c", "c")
+    assert set(stored_nodes(database, interaction_id)) == {"a"}
+    wait_for_nodes(database, interaction_id, 3)
+
+
+def test_close_writes_pending_nodes(database, create_interaction):
+    interaction_id = create_interaction()
+    recorder = InteractionRecorder(database, interaction_id, flush_interval=60)
+    recorder.record("a", "a")
+    recorder.close({"output": "a", "status": InteractionStatus.SUCCEEDED})
+    assert set(stored_nodes(database, interaction_id)) == {"a"}
+    assert database.get_interaction(interaction_id).output == "a"
+
+
+@pytest.mark.parametrize(
+    "status,nodes",
+    [
+        (InteractionStatus.SUCCEEDED, {"out"}),
+        (InteractionStatus.FAILED, {"in", "out"}),
+    ],
+)
+def test_close_writes_persisted_nodes(database, create_interaction, status, nodes):
+    interaction_id = create_interaction()
+    recorder = InteractionRecorder(
+        database, interaction_id, flush_interval=0, persisted_nodes={"out"}
+    )
+    recorder.record("in", "in")
+    recorder.record("out", "out")
+    assert stored_nodes(database, interaction_id) == {}
+    recorder.close({"status": status})
+    assert set(stored_nodes(database, interaction_id)) == nodes
+
+
+def test_lost_lease_discards_writes(database, create_interaction):
+    interaction_id = create_interaction(status=InteractionStatus.PENDING)
+    (claimed,) = database.claim_interactions("worker", 1)
+    recorder = InteractionRecorder(
+        database,
+        interaction_id,
+        flush_interval=0,
+        lease=Lease("worker", claimed.attempts),
+    )
+    recorder.record("a", "a")
+    assert set(stored_nodes(database, interaction_id)) == {"a"}
+
+    # failed by another worker
+    database.update_interaction(interaction_id, {"status": InteractionStatus.FAILED})
+    recorder.record("b", "b")
+    assert recorder.lost
+    with pytest.raises(InteractionLeaseLost):
+        recorder.record("c", "c")
+    recorder.close({"output": "late", "status": InteractionStatus.SUCCEEDED})
+    interaction = database.get_interaction(interaction_id)
+    assert (interaction.output, interaction.status) == (None, InteractionStatus.FAILED)
+    assert set(stored_nodes(database, interaction_id)) == {"a"}
+
+
+def test_events_publish_previews_and_drop_tokens(database, monkeypatch):
+    monkeypatch.setattr(InteractionRecorder, "spill_size", 64)
+    monkeypatch.setattr(InteractionRecorder, "preview_size", 5)
+    recorder = InteractionRecorder(database, "i", persisted_nodes=set())
+    recorder.token("out", "large ")
+    recorder.token("other", "token")
+    recorder.start("out")
+    recorder.record("out", "large " * 20)
+
+    async def subscribe():
+        subscription = InteractionRecorder.events.subscribe("i")
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        subscription.close()
+        return events
+
+    token, node = asyncio.run(subscribe())
+    assert token["node_id"] == "other"
+    assert (node["node_id"], node["value"], node["blob_size"]) == (
+        "out",
+        "large",
+        len(json.dumps("large " * 20)),
+    )
+    recorder.close()
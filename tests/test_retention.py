@@ -0,0 +1,131 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from model import Application, InteractionNode, InteractionNodeStatus
+from retention import InteractionArchiver, RetentionJob
+
+
+@pytest.fixture
+def create_application(database):
+    def create(id: str, retention_days=None):
+        now = datetime(2024, 1, 1)
+        database.create_application(
+            Application(
+                id=id,
+                name=id,
+                user="user",
+                retention_days=retention_days,
+                created_at=now,
+                updated_at=now,
+            )
+        )
+
+    return create
+
+
+def add_node(database, interaction_id: str, node_id: str = "out"):
+    database.add_interaction_nodes(
+        interaction_id,
+        [
+            InteractionNode(
+                interaction_id=interaction_id,
+                node_id=node_id,
+                value=node_id.upper(),
+                status=InteractionNodeStatus.SUCCEEDED,
+                finished_at=datetime(2024, 1, 1),
+            )
+        ],
+    )
+
+
+def test_purge_deletes_expired_interactions_by_batch(
+    database, create_application, create_interaction
+):
+    create_application("default")
+    create_application("own", retention_days=30)
+    create_application("forever", retention_days=0)
+    expired = [create_interaction(app_id="default") for _ in range(5)]
+    for id in expired:
+        add_node(database, id)
+    kept = [
+        create_interaction(app_id="default", created_at=datetime.utcnow()),
+        create_interaction(app_id="forever"),
+    ]
+    own = create_interaction(app_id="own")
+
+    job = RetentionJob(database, default_days=7, batch_size=2, batch_pause=0)
+    assert job.purge() == 6
+    for id in expired + [own]:
+        assert database.get_interaction(id) is None
+    assert database.list_nodes_of_interactions(expired) == {}
+    for id in kept:
+        assert database.get_interaction(id) is not None
+
+
+def test_purge_keeps_everything_without_retention(
+    database, create_application, create_interaction
+):
+    create_application("app")
+    id = create_interaction(app_id="app")
+    assert RetentionJob(database).purge() == 0
+    assert database.get_interaction(id) is not None
+
+
+def test_archiver_writes_a_file_per_batch(
+    database, create_application, create_interaction, tmp_path
+):
+    create_application("app", retention_days=1)
+    ids = [create_interaction(app_id="app", output=f"out{i}") for i in range(3)]
+    add_node(database, ids[0], "in")
+    add_node(database, ids[0], "out")
+
+    job = RetentionJob(
+        database,
+        batch_size=2,
+        batch_pause=0,
+        archiver=InteractionArchiver(str(tmp_path)),
+    )
+    assert job.purge() == 3
+
+    paths = sorted((tmp_path / "app" / "2024-01-01").iterdir())
+    assert all(path.name.endswith(".jsonl.gz") for path in paths)
+    records = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            records.append([json.loads(line) for line in f])
+    assert sorted(len(batch) for batch in records) == [1, 2]
+    records = {r["id"]: r for r in sum(records, [])}
+    assert [records[id]["output"] for id in ids] == ["out0", "out1", "out2"]
+    assert sorted(n["node_id"] for n in records[ids[0]]["nodes"]) == ["in", "out"]
+    assert records[ids[1]]["nodes"] == []
+
+
+def test_archiver_rejects_unknown_formats(tmp_path):
+    with pytest.raises(ValueError):
+        InteractionArchiver(str(tmp_path), format="csv")
+
+
+def test_parquet_archiver_requires_pyarrow(tmp_path):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        with pytest.raises(ImportError):
+            InteractionArchiver(str(tmp_path), format="parquet")
+    else:
+        pytest.skip("pyarrow is installed")
+
+
+def test_sweep_deletes_orphan_nodes(database, create_interaction):
+    id = create_interaction()
+    add_node(database, id)
+    for orphan in ["gone1", "gone2", "gone3"]:
+        add_node(database, orphan)
+
+    job = RetentionJob(database, batch_size=2, batch_pause=0, sweep_orphans=True)
+    assert job.purge() == 0
+    assert list(
+        database.list_nodes_of_interactions([id, "gone1", "gone2", "gone3"])
+    ) == [id]
@@ -0,0 +1,439 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from blocks.base import BaseBlock, InputBlock
+from blocks.condition import TextCondition
+from blocks.input import TextInput
+from blocks.output import TextOutput
+from blocks.text import ComposeDict
+from exceptions import NodeException
+from patterns.comparator import TextContains
+from scheduler import Edge, Graph
+
+
+class Upper(BaseBlock):
+    def __call__(self, input: str) -> str:
+        return input.upper()
+
+
+class Boom(BaseBlock):
+    def __call__(self, input: str) -> str:
+        raise ValueError(input)
+
+
+class Meet(BaseBlock):
+    """
+    Meet waits for the other nodes sharing its barrier, so it only returns if they
+    run at the same time.
+    """
+
+    def __init__(self, barrier: threading.Barrier):
+        self.barrier = barrier
+
+    def __call__(self, input: str) -> str:
+        self.barrier.wait()
+        return input
+
+
+class Tag(BaseBlock):
+    """
+    Tag appends the tag of the run, read from the global context, after a pause, so
+    the runs sharing the graph overlap.
+    """
+
+    def __call__(self, input: str) -> str:
+        time.sleep(0.01)
+        return f"{input}:{self.context['tag']}"
+
+
+def run_sequentially(graph: Graph, input: str, callback) -> str:
+    return graph.run(input, {}, node_callback=callback)
+
+
+def run_concurrently(graph: Graph, input: str, callback) -> str:
+    return graph.run(input, {}, node_callback=callback, max_workers=4)
+
+
+def run_async(graph: Graph, input: str, callback) -> str:
+    return asyncio.run(graph.arun(input, {}, node_callback=callback))
+
+
+RUNNERS = [run_sequentially, run_concurrently, run_async]
+
+
+def run(runner, nodes: dict, edges: list, input: str):
+    settled = {}
+    output = runner(
+        Graph(nodes, edges, skip_validation=True),
+        input,
+        lambda node_id, value: settled.__setitem__(node_id, value),
+    )
+    return output, settled
+
+
+def branches(good: BaseBlock, bad: BaseBlock) -> dict:
+    return {
+        "in": TextInput(),
+        "cond": TextCondition(TextContains("good")),
+        "good": good,
+        "bad": bad,
+        "join": ComposeDict(),
+        "out": TextOutput(),
+    }
+
+
+# the cases send the input to one of the branches
+CASES = [
+    Edge("in", "cond", "input", None),
+    Edge("cond", "good", None, True),
+    Edge("cond", "bad", None, False),
+    Edge("in", "good", "input", None),
+    Edge("in", "bad", "input", None),
+]
+
+
+@pytest.mark.parametrize("runner", RUNNERS)
+@pytest.mark.parametrize(
+    "input,output,settled",
+    [
+        (
+            "good",
+            "GOOD",
+            {"in": "good", "cond": True, "good": "GOOD", "bad": None, "out": "GOOD"},
+        ),
+        (
+            "bad",
+            "BAD",
+            {"in": "bad", "cond": False, "good": None, "bad": "BAD", "out": "BAD"},
+        ),
+    ],
+)
+def test_optional_links_settle_every_branch(runner, input, output, settled):
+    # the ports of the output are optional, so the branch skipped by its case is
+    # still settled (as None)
+    edges = CASES + [
+        Edge("good", "out", "input", None),
+        Edge("bad", "out", "input", None),
+    ]
+    assert run(runner, branches(Upper(), Upper()), edges, input) == (output, settled)
+
+
+@pytest.mark.parametrize("runner", RUNNERS)
+@pytest.mark.parametrize(
+    "input,settled",
+    [
+        (
+            "good",
+            {"in": "good", "cond": True, "good": "GOOD", "bad": None, "join": None},
+        ),
+        # the later links of a blocked step are never pulled
+        ("bad", {"in": "bad", "cond": False, "good": None, "join": None}),
+    ],
+)
+def test_blocked_required_link_stops_pulling(runner, input, settled):
+    edges = CASES + [
+        Edge("good", "join", "good", None),
+        Edge("bad", "join", "bad", None),
+        Edge("join", "out", "input", None),
+    ]
+    _, actual = run(runner, branches(Upper(), Upper()), edges, input)
+    actual.pop("out")
+    assert actual == settled
+
+
+@pytest.mark.parametrize("runner", RUNNERS)
+def test_unpulled_step_error_is_discarded(runner):
+    # the failing step is only reached through the later link of a blocked step,
+    # it may be run ahead by the concurrent runners, but its error is not raised
+    edges = CASES + [
+        Edge("good", "join", "good", None),
+        Edge("bad", "join", "bad", None),
+        Edge("join", "out", "input", None),
+    ]
+    _, settled = run(runner, branches(Upper(), Boom()), edges, "bad")
+    assert "bad" not in settled
+    with pytest.raises(NodeException):
+        run(runner, branches(Boom(), Upper()), edges, "good")
+
+
+@pytest.mark.parametrize("runner", [run_concurrently, run_async])
+def test_required_links_run_concurrently(runner):
+    barrier = threading.Barrier(2, timeout=5)
+    nodes = {
+        "in": TextInput(),
+        "a": Meet(barrier),
+        "b": Meet(barrier),
+        "join": ComposeDict(),
+        "out": TextOutput(),
+    }
+    edges = [
+        Edge("in", "a", "input", None),
+        Edge("in", "b", "input", None),
+        Edge("a", "join", "a", None),
+        Edge("b", "join", "b", None),
+        Edge("join", "out", "input", None),
+    ]
+    _, settled = run(runner, nodes, edges, "hi")
+    assert settled["join"] == {"a": "hi", "b": "hi"}
+
+
+class Const(BaseBlock):
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, x=None, **kwargs):
+        return self.value
+
+
+class Pass(BaseBlock):
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, x, y=None, **kwargs):
+        return x if self.value is None else self.value
+
+
+def random_graph(seed: int):
+    rnd = random.Random(seed)
+    ids = ["in"] + [f"n{i}" for i in range(rnd.randint(1, 8))] + ["out"]
+    blocks = [
+        (rnd.choice([Const, Pass]), rnd.choice([None, True, False, "s"]))
+        for _ in ids[1:-1]
+    ]
+    edges = []
+    for j in range(1, len(ids)):
+        for i in rnd.sample(range(j), rnd.randint(1, min(3, j))):
+            port = rnd.choice([None, "x", "y", "z", "input"])
+            edges.append(Edge(ids[i], ids[j], port, rnd.choice([None, True, False])))
+    rnd.shuffle(edges)
+
+    def nodes() -> dict:
+        return {
+            "in": TextInput(),
+            "out": TextOutput(),
+            **{id: cls(value) for id, (cls, value) in zip(ids[1:-1], blocks)},
+        }
+
+    return nodes, edges
+
+
+def pull(graph: Graph, input: str) -> dict:
+    """
+    The reference semantics: the output is pulled recursively through the links in
+    order, and a blocked required link stops the pull of its sink.
+    """
+    plan = graph.plan
+    values = [None] * len(plan.steps)
+    settled = {}
+
+    def run(index: int):
+        step = plan.steps[index]
+        if step.node_id in settled:
+            return
+        for link in step.links:
+            run(link.source)
+            if link.blocks(values[link.source]):
+                settled[step.node_id] = None
+                return
+        params = plan.params(index, values)
+        if params is not None:
+            token = InputBlock._input.set(input)
+            try:
+                values[index] = step.block(**params)
+            finally:
+                InputBlock._input.reset(token)
+        settled[step.node_id] = values[index]
+
+    run(plan.output)
+    return settled
+
+
+@pytest.mark.parametrize("runner", RUNNERS)
+def test_runners_settle_the_pulled_nodes(runner):
+    for seed in range(300):
+        nodes, edges = random_graph(seed)
+        expected = pull(Graph(nodes(), edges, skip_validation=True), "hi")
+        output, settled = run(runner, nodes(), edges, "hi")
+        assert (output, settled) == (expected["out"], expected), seed
+
+
+def test_run_batch_settles_the_pulled_nodes():
+    for seed in range(300):
+        nodes, edges = random_graph(seed)
+        graph = Graph(nodes(), edges, skip_validation=True)
+        inputs = ["hi", "there"]
+        expected = [pull(graph, input)["out"] for input in inputs]
+        assert graph.run_batch(inputs, {}) == expected, seed
+
+
+class BatchUpper(BaseBlock):
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, input: str) -> str:
+        if input == "boom":
+            raise ValueError(input)
+        return input.upper()
+
+    def call_batch(self, batch: list) -> list:
+        self.batches.append(len(batch))
+        return [self(**kwargs) for kwargs in batch]
+
+
+def test_run_batch_calls_every_node_once():
+    upper = BatchUpper()
+    graph = Graph(
+        {"in": TextInput(), "upper": upper, "out": TextOutput()},
+        [Edge("in", "upper", "input", None), Edge("upper", "out", "input", None)],
+    )
+    assert graph.run_batch(["a", "b", "c"], {}) == ["A", "B", "C"]
+    assert upper.batches == [3]
+
+    # a failed batch call is retried item by item to find the failed items
+    outputs = graph.run_batch(["a", "boom"], {}, return_exceptions=True)
+    assert outputs[0] == "A"
+    assert isinstance(outputs[1], NodeException)
+    with pytest.raises(NodeException):
+        graph.run_batch(["a", "boom"], {})
+
+
+def isolation_graph() -> Graph:
+    nodes = {
+        "in": TextInput(),
+        "upper": Upper(),
+        "tag": Tag(),
+        "out": TextOutput(),
+    }
+    edges = [
+        Edge("in", "upper", "input", None),
+        Edge("upper", "tag", "input", None),
+        Edge("tag", "out", "input", None),
+    ]
+    return Graph(nodes, edges)
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_concurrent_runs_from_threads_are_isolated(max_workers):
+    graph = isolation_graph()
+
+    def run_one(n: int):
+        settled = {}
+        output = graph.run(
+            f"in{n}",
+            {"tag": n},
+            node_callback=lambda node_id, value: settled.__setitem__(node_id, value),
+            max_workers=max_workers,
+        )
+        return output, settled
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(run_one, range(32)))
+
+    for n, (output, settled) in enumerate(results):
+        assert output == f"IN{n}:{n}"
+        assert settled == {
+            "in": f"in{n}",
+            "upper": f"IN{n}",
+            "tag": f"IN{n}:{n}",
+            "out": f"IN{n}:{n}",
+        }
+
+
+def test_concurrent_runs_from_tasks_are_isolated():
+    graph = isolation_graph()
+
+    async def run_one(n: int):
+        settled = {}
+        output = await graph.arun(
+            f"in{n}",
+            {"tag": n},
+            node_callback=lambda node_id, value: settled.__setitem__(node_id, value),
+        )
+        return output, settled
+
+    async def run_all():
+        return await asyncio.gather(*(run_one(n) for n in range(32)))
+
+    for n, (output, settled) in enumerate(asyncio.run(run_all())):
+        assert output == f"IN{n}:{n}"
+        assert settled["tag"] == f"IN{n}:{n}"
+
+
+def test_run_restores_the_context_and_input():
+    graph = isolation_graph()
+    assert graph.run("a", {"tag": 1}) == "A:1"
+    assert BaseBlock._ctx.get(None) is None
+    assert InputBlock._input.get(None) is None
+
+
+class Words(BaseBlock):
+    """
+    Words streams its output word by word if it's streamed.
+    """
+
+    def __call__(self, input: str) -> str:
+        callback = self.token_callback
+        if callback is not None:
+            for word in input.split(" "):
+                callback(word)
+        return input
+
+
+@pytest.mark.parametrize("runner", ["run", "run_concurrently", "arun"])
+def test_tokens_of_the_output_are_streamed(runner):
+    nodes = {
+        "in": TextInput(),
+        "inner": Words(),
+        "words": Words(),
+        "out": TextOutput(),
+    }
+    edges = [
+        Edge("in", "inner", "input", None),
+        Edge("inner", "words", "input", None),
+        Edge("words", "out", "input", None),
+    ]
+    graph = Graph(nodes, edges)
+    tokens = []
+
+    def callback(node_id: str, token: str):
+        tokens.append((node_id, token))
+
+    if runner == "arun":
+        output = asyncio.run(graph.arun("a b", {}, token_callback=callback))
+    else:
+        max_workers = 4 if runner == "run_concurrently" else 1
+        output = graph.run("a b", {}, max_workers=max_workers, token_callback=callback)
+    assert output == "a b"
+    # only the node feeding the output is streamed
+    assert tokens == [("words", "a"), ("words", "b")]
+
+
+def test_tokens_of_undemanded_steps_are_not_streamed():
+    # the words node is run ahead of its demand, then the link of the output to it is
+    # never pulled, as the case of the output is not matched
+    nodes = {
+        "in": TextInput(),
+        "cond": TextCondition(TextContains("good")),
+        "words": Words(),
+        "out": TextOutput(),
+    }
+    edges = [
+        Edge("in", "cond", "input", None),
+        Edge("in", "words", "input", None),
+        Edge("cond", "out", None, True),
+        Edge("words", "out", "input", None),
+    ]
+    graph = Graph(nodes, edges, skip_validation=True)
+    tokens = []
+    graph.run(
+        "bad words",
+        {},
+        max_workers=4,
+        token_callback=lambda node_id, token: tokens.append(token),
+    )
+    assert tokens == []
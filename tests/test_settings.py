@@ -0,0 +1,22 @@
+from settings import EnvSetting
+
+
+def test_setting_is_read_on_first_access(monkeypatch):
+    class Settings:
+        size = EnvSetting(lambda env: env.int("TEST_SETTING_SIZE", 1))
+
+    # set after the class is defined, as .env is loaded after the imports
+    monkeypatch.setenv("TEST_SETTING_SIZE", "8")
+    assert Settings.size == 8
+    assert Settings().size == 8
+    # the value is kept once it's read
+    monkeypatch.setenv("TEST_SETTING_SIZE", "16")
+    assert Settings.size == 8
+
+
+def test_setting_is_replaced_by_assignment(monkeypatch):
+    class Settings:
+        size = EnvSetting(lambda env: env.int("TEST_SETTING_SIZE", 1))
+
+    monkeypatch.setattr(Settings, "size", 4)
+    assert Settings.size == 4
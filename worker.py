@@ -0,0 +1,243 @@
+import json
+import logging
+import signal
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Dict
+
+from environs import Env
+
+import patterns
+import plugins
+from blocks import AsyncInvoker
+from database import Database, Lease, get_engine
+from exceptions import (
+    AsyncExceptionHandler,
+    InteractionLeaseLost,
+    register_exception_handlers,
+)
+from executor import InvokeExecutor
+from model import Application, ApplicationVersion, Interaction, InteractionStatus
+from scheduler import Graph
+
+"""
+The standalone worker runs the interactions queued by the API server when it's
+started with INVOKER_MODE=queue. Any number of workers can be started (on
+different nodes) against the same database:
+
+```
+python worker.py
+```
+
+A worker claims pending interactions with SELECT ... FOR UPDATE SKIP LOCKED,
+renews the heartbeat of the interactions it's running, and requeues the
+interactions whose worker has stopped renewing their heartbeat. The writes of a
+run are fenced by the worker and the attempt of the claim, so a slow worker whose
+interaction has been requeued aborts it instead of overwriting the next attempt.
+"""
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+
+
+class Worker:
+    """
+    Worker claims queued interactions from the database and runs them on a bounded
+    pool of threads.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        invoker: AsyncInvoker,
+        concurrency: int = 8,
+        poll_interval: float = 1,
+        heartbeat_interval: float = 10,
+        lease_timeout: float = 60,
+        max_attempts: int = 3,
+    ):
+        """
+        Args:
+            database (Database): The database the interactions are queued in.
+            invoker (AsyncInvoker): The invoker to run the interactions.
+            concurrency (int): The maximum number of interactions running at the same time.
+            poll_interval (float): The seconds to wait when there is no pending interaction.
+            heartbeat_interval (float): The seconds between two heartbeats.
+            lease_timeout (float): The seconds after the last heartbeat, an interaction
+                is considered abandoned and requeued.
+            max_attempts (int): The maximum number of times an interaction is run.
+        """
+        self.worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.database = database
+        self.invoker = invoker
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.executor = InvokeExecutor(
+            max_workers=concurrency, max_queue_size=concurrency
+        )
+        # the leases of the running interactions, by ID
+        self.running: Dict[str, Lease] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run_forever(self):
+        """
+        Claim and run interactions until the worker is stopped, then wait for the
+        running interactions to finish.
+        """
+        logging.info(f"worker {self.worker_id} started")
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+        while not self.stopped.is_set():
+            with self.lock:
+                free = self.concurrency - len(self.running)
+            claimed = []
+            if free > 0:
+                try:
+                    claimed = self.database.claim_interactions(self.worker_id, free)
+                except Exception:
+                    logging.exception("failed to claim interactions")
+            for interaction in claimed:
+                self.dispatch(interaction)
+            if not claimed:
+                self.stopped.wait(self.poll_interval)
+
+        logging.info(f"worker {self.worker_id} stopping")
+        while True:
+            with self.lock:
+                if not self.running:
+                    break
+            time.sleep(self.poll_interval)
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def dispatch(self, interaction: Interaction):
+        """
+        Submit a claimed interaction to the worker threads.
+
+        Args:
+            interaction (Interaction): The claimed interaction.
+        """
+        try:
+            app = self.database.get_application(interaction.app_id)
+            version = self.database.get_version(interaction.version_id)
+            graph = self.invoker.get_graph(version)
+        except Exception as e:
+            logging.exception(f"failed to prepare interaction {interaction.id}")
+            self.fail(interaction, e)
+            return
+
+        lease = Lease(self.worker_id, interaction.attempts)
+        with self.lock:
+            self.running[interaction.id] = lease
+        self.executor.reserve(interaction.app_id).submit(
+            self.run,
+            app=app,
+            version=version,
+            interaction=interaction,
+            graph=graph,
+            lease=lease,
+        )
+
+    def run(
+        self,
+        app: Application,
+        version: ApplicationVersion,
+        interaction: Interaction,
+        graph: Graph,
+        lease: Lease,
+    ):
+        try:
+            self.invoker.execute(
+                app=app,
+                interaction_id=interaction.id,
+                version=version,
+                graph=graph,
+                user=interaction.user,
+                input=interaction.input,
+                session_id=interaction.session_id,
+                lease=lease,
+            )
+        finally:
+            with self.lock:
+                if self.running.get(interaction.id) is lease:
+                    del self.running[interaction.id]
+
+    def fail(self, interaction: Interaction, e: Exception):
+        h = AsyncExceptionHandler()
+        register_exception_handlers(h)
+        r = h.render(e)
+        try:
+            self.database.update_interaction(
+                interaction.id,
+                {
+                    "error": {
+                        "status_code": r.status_code,
+                        "content": json.loads(r.body),
+                    },
+                    "status": InteractionStatus.FAILED,
+                },
+                lease=Lease(self.worker_id, interaction.attempts),
+            )
+        except InteractionLeaseLost:
+            logging.warning(f"interaction {interaction.id} has been requeued")
+
+    def heartbeat(self):
+        """
+        Renew the heartbeat of the running interactions, and requeue the abandoned
+        ones, periodically.
+        """
+        while True:
+            try:
+                with self.lock:
+                    running = dict(self.running)
+                lost = self.database.heartbeat_interactions(
+                    self.worker_id, list(running)
+                )
+                for interaction_id in lost:
+                    # aborted as the next node finishes
+                    logging.warning(
+                        f"interaction {interaction_id} has been requeued, aborting it"
+                    )
+                    running[interaction_id].lost.set()
+                n = self.database.requeue_interactions(
+                    timedelta(seconds=self.lease_timeout), self.max_attempts
+                )
+                if n > 0:
+                    logging.warning(f"{n} abandoned interactions requeued or failed")
+            except Exception:
+                logging.exception("failed to renew heartbeat")
+            time.sleep(self.heartbeat_interval)
+
+
+def main():
+    env = Env()
+    env.read_env()
+
+    database = Database(get_engine())
+    invoker = AsyncInvoker(database, max_workers=env.int("GRAPH_MAX_WORKERS", 1))
+    worker = Worker(
+        database,
+        invoker,
+        concurrency=env.int("WORKER_CONCURRENCY", 8),
+        poll_interval=env.float("WORKER_POLL_INTERVAL", 1),
+        heartbeat_interval=env.float("WORKER_HEARTBEAT_INTERVAL", 10),
+        lease_timeout=env.float("WORKER_LEASE_TIMEOUT", 60),
+        max_attempts=env.int("WORKER_MAX_ATTEMPTS", 3),
+    )
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run_forever()
+
+
+if __name__ == "__main__":
+    main()